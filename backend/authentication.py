@@ -0,0 +1,159 @@
+"""Authenticate GraphQL operations by their JWT once, and remember the users of the recent tokens.
+
+`JSONWebTokenMiddleware` authenticates the request when the first root field is resolved,
+instead of at every field, and only with the JWT backend. `JSONWebTokenBackend` keeps the
+users authenticated by the recent tokens, keyed by token signature, for
+`settings.JWT_USER_CACHE_TTL` seconds (never past the expiration of the token), so the
+following requests with the same token neither decode it nor query the user again.
+
+Saving or deleting a user forgets its tokens in the process that made the change. Other
+processes see the change once their cached entry expires.
+"""
+from backend import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from graphql_jwt import backends, middleware
+from graphql_jwt.settings import jwt_settings
+from graphql_jwt.utils import get_credentials, get_http_authorization, get_payload, get_user_by_payload
+
+import collections
+import threading
+import time
+
+# Users of the recent tokens: {token signature: (expiration time, user field values)}
+_users_by_signature = collections.OrderedDict()
+_users_lock = threading.Lock()
+# Incremented by every invalidation, so a user loaded before it is not cached after it
+_invalidations = 0
+
+# Outcome of the authentication of a request: the user, None or the authentication error
+AUTHENTICATION_KEY = '_jwt_authentication'
+
+
+class JSONWebTokenMiddleware(middleware.JSONWebTokenMiddleware):
+    """JWT middleware authenticating each operation once, when its first root field is resolved."""
+
+    def resolve(self, next, root, info, **kwargs):
+        context = info.context
+        if jwt_settings.JWT_ALLOW_ARGUMENT:
+            # Tokens given as arguments may differ between fields
+            return super().resolve(next, root, info, **kwargs)
+
+        # Nested fields run after their root field, which already authenticated the request
+        if len(info.path) == 1 and middleware._authenticate(context) and self.authenticate_context(info, **kwargs):
+            # Mutations save the user they get, so they must not get a user cached before a
+            # change made by another process
+            user = authenticate_request(context, cached=info.operation.operation != 'mutation')
+            if user is not None:
+                context.user = user
+
+        return next(root, info, **kwargs)
+
+
+class JSONWebTokenBackend(backends.JSONWebTokenBackend):
+    """JWT authentication backend reading the users of the recent tokens from the cache."""
+
+    def authenticate(self, request=None, **kwargs):
+        if request is None or getattr(request, '_jwt_token_auth', False):
+            return None
+
+        token = get_credentials(request, **kwargs)
+        if token is not None:
+            return get_user_by_token(token, request)
+
+        return None
+
+
+def authenticate_request(request, cached=True):
+    """Return the user authenticated by the JWT of `request`, None if there is none.
+
+    The request is authenticated once, the following calls return the same user or raise the
+    same error.
+    """
+    if not hasattr(request, AUTHENTICATION_KEY):
+        try:
+            user = get_user_by_token(get_http_authorization(request), request, cached=cached)
+        except Exception as error:
+            user = error
+        setattr(request, AUTHENTICATION_KEY, user)
+
+    user = getattr(request, AUTHENTICATION_KEY)
+    if isinstance(user, Exception):
+        raise user
+
+    return user
+
+
+def authenticate_connection(payload):
+    """Return the user of the WebSocket connection initialized with `payload`, anonymous without token.
+
+    Clients send their JWT in the connection parameters, as in the HTTP header:
+    `{"Authorization": "JWT <token>"}`. Invalid tokens raise.
+    """
+    auth = str((payload or {}).get('Authorization') or '').split()
+    if len(auth) != 2 or auth[0].lower() != jwt_settings.JWT_AUTH_HEADER_PREFIX.lower():
+        return AnonymousUser()
+
+    return get_user_by_token(auth[1]) or AnonymousUser()
+
+
+def get_user_by_token(token, context=None, cached=True):
+    """Return the user authenticated by `token`, like `graphql_jwt.shortcuts.get_user_by_token()`.
+
+    The user comes from the cache when `cached` and the token was used recently.
+    """
+    signature = token.rpartition('.')[2]
+    now = time.time()
+    with _users_lock:
+        entry = _users_by_signature.get(signature)
+        if cached and entry is not None and entry[0] > now:
+            _users_by_signature.move_to_end(signature)
+            return _build_user(entry[1])
+        invalidations = _invalidations
+
+    payload = get_payload(token, context)
+    user = get_user_by_payload(payload)
+    if user is None:
+        return None
+
+    expires = now + settings.JWT_USER_CACHE_TTL
+    if jwt_settings.JWT_VERIFY_EXPIRATION and 'exp' in payload:
+        expires = min(expires, payload['exp'])
+    with _users_lock:
+        if invalidations == _invalidations:
+            _users_by_signature[signature] = (
+                expires,
+                {field.attname: field.value_from_object(user) for field in user._meta.concrete_fields},
+            )
+            while len(_users_by_signature) > settings.JWT_USER_CACHE_SIZE:
+                _users_by_signature.popitem(last=False)
+
+    return user
+
+
+def invalidate_user(pk):
+    """Forget the tokens of the user `pk`."""
+    global _invalidations
+
+    pk_attname = get_user_model()._meta.pk.attname
+    with _users_lock:
+        _invalidations += 1
+        for signature, (_, values) in list(_users_by_signature.items()):
+            if values[pk_attname] == pk:
+                del _users_by_signature[signature]
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def _invalidate_changed_user(instance, **kwargs):
+    invalidate_user(instance.pk)
+    # Requests reading the user before the commit may have cached it again
+    transaction.on_commit(lambda: invalidate_user(instance.pk))
+
+
+def _build_user(values):
+    # A new instance for every request, as requests may change their user
+    return get_user_model().from_db(DEFAULT_DB_ALIAS, list(values), list(values.values()))
@@ -0,0 +1,214 @@
+"""Broadcast subscription payloads with a cost that does not grow with the number of subscribers.
+
+`BroadcastSubscription` converts the models of the payload to plain data once, when it is
+broadcast, and tags the broadcast with an id. The `publish` of the subscriptions rebuilds the
+models of a broadcast with `load_payload()`, once per process for all the subscribers instead
+of once per subscriber. Broadcasts can also be deferred until the transaction commits, merging
+the successive broadcasts about the same object, and be sent to several groups, notifying the
+subscriptions in more than one of them once (see `is_duplicate()`).
+
+Broadcasts are delivered by the stock consumer of channels_graphql_ws.
+"""
+from backend import settings
+from django.apps import apps
+from django.db import DEFAULT_DB_ALIAS, models, transaction
+from promise import Promise
+
+import channels_graphql_ws
+import collections
+import contextlib
+import logging
+import threading
+import uuid
+
+logger = logging.getLogger(__name__)
+
+BROADCAST_ID_KEY = '__broadcast_id__'
+# Groups a payload was broadcast to, and the group of each copy
+GROUPS_KEY = '__groups__'
+GROUP_KEY = '__group__'
+MODEL_KEY = '__model__'
+
+# Payloads of the recent broadcasts with their models rebuilt: {broadcast id: payload}
+_loaded_payloads = collections.OrderedDict()
+_loaded_payloads_lock = threading.Lock()
+
+# Broadcasts waiting for the end of their coalescing window: {key: broadcast function}
+_pending_broadcasts = {}
+_pending_broadcasts_lock = threading.Lock()
+
+# Number of `broadcasts_disabled()` blocks running in the process
+_broadcasts_disabled = 0
+
+
+class BroadcastSubscription(channels_graphql_ws.Subscription):
+    """Subscription whose payload is broadcast as plain data tagged with a broadcast id."""
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def broadcast_on_commit(cls, group, payload, key):
+        """Broadcast `payload` to `group` once the current transaction commits.
+
+        Broadcasts to the same group with the same `key` (e.g. the pk of the changed object)
+        within `settings.SUBSCRIPTION_COALESCE_WINDOW` seconds are merged into the last one.
+        """
+        # Take the payload as it is now, the models may change or be deleted before the broadcast
+        payload = to_plain_payload(payload)
+        transaction.on_commit(
+            lambda: _coalesce_broadcast((cls, group, key), lambda: cls.broadcast(group=group, payload=payload)))
+
+    @classmethod
+    def broadcast_to_groups(cls, groups, payload):
+        """Broadcast `payload` to `groups`. The subscriptions in several of them skip the extra copies."""
+        payload = to_plain_payload(payload)
+        for group in groups:
+            cls.broadcast(group=group, payload=dict(payload, **{GROUPS_KEY: list(groups), GROUP_KEY: group}))
+
+    @staticmethod
+    def load_payload(payload):
+        """Return the broadcast `payload` with its models rebuilt, shared by the subscribers of the process.
+
+        The models must not be changed, every subscriber gets the same instances.
+        """
+        broadcast_id = payload.get(BROADCAST_ID_KEY)
+        if broadcast_id is None:
+            return from_plain_payload(payload)
+
+        with _loaded_payloads_lock:
+            loaded_payload = _loaded_payloads.get(broadcast_id)
+            if loaded_payload is not None:
+                _loaded_payloads.move_to_end(broadcast_id)
+                return loaded_payload
+
+        loaded_payload = from_plain_payload(payload)
+        with _loaded_payloads_lock:
+            loaded_payload = _loaded_payloads.setdefault(broadcast_id, loaded_payload)
+            while len(_loaded_payloads) > settings.SUBSCRIPTION_PAYLOAD_CACHE_SIZE:
+                _loaded_payloads.popitem(last=False)
+
+        return loaded_payload
+
+    @staticmethod
+    def is_duplicate(payload, groups):
+        """Tell whether a subscription in `groups` gets `payload` through another of its groups too.
+
+        Only the copy sent to the first of its groups the payload was broadcast to is not a duplicate.
+        """
+        if GROUP_KEY not in payload:
+            return False
+
+        first_group = next((group for group in payload[GROUPS_KEY] if group in groups), None)
+        return first_group is not None and first_group != payload[GROUP_KEY]
+
+    @classmethod
+    def broadcast_sync(cls, *, group=None, payload=None):
+        if _broadcasts_disabled:
+            return None
+
+        return super().broadcast_sync(group=group, payload=to_plain_payload(payload))
+
+    @classmethod
+    async def broadcast_async(cls, *, group=None, payload=None):
+        if _broadcasts_disabled:
+            return None
+
+        return await super().broadcast_async(group=group, payload=to_plain_payload(payload))
+
+
+@contextlib.contextmanager
+def broadcasts_disabled():
+    """Drop the broadcasts of every thread of the process within the block, e.g. of synthetic data."""
+    global _broadcasts_disabled
+
+    with _pending_broadcasts_lock:
+        _broadcasts_disabled += 1
+    try:
+        yield
+    finally:
+        with _pending_broadcasts_lock:
+            _broadcasts_disabled -= 1
+
+
+def _coalesce_broadcast(key, broadcast):
+    if not settings.SUBSCRIPTION_COALESCE_WINDOW:
+        broadcast()
+        return
+
+    with _pending_broadcasts_lock:
+        scheduled = key in _pending_broadcasts
+        _pending_broadcasts[key] = broadcast
+
+    if not scheduled:
+        timer = threading.Timer(settings.SUBSCRIPTION_COALESCE_WINDOW, _flush_broadcast, [key])
+        timer.daemon = True
+        timer.start()
+
+
+def _flush_broadcast(key):
+    with _pending_broadcasts_lock:
+        broadcast = _pending_broadcasts.pop(key)
+
+    try:
+        broadcast()
+    except Exception:
+        logger.exception('Coalesced broadcast failed')
+
+
+def to_plain_payload(payload):
+    """Tag `payload` with a new broadcast id and replace its models by plain data."""
+    if payload is not None and BROADCAST_ID_KEY in payload:
+        return payload
+
+    plain_payload = {key: model_to_data(value) for key, value in (payload or {}).items()}
+    plain_payload[BROADCAST_ID_KEY] = uuid.uuid4().hex
+
+    return plain_payload
+
+
+def from_plain_payload(payload):
+    """Rebuild the models of a payload made by `to_plain_payload`."""
+    return {key: data_to_model(value) for key, value in payload.items()}
+
+
+def resolve_promises(next_middleware, root, info, **kwargs):
+    """GraphQL middleware waiting for the fields of subscriptions resolved as promises (e.g. by DataLoaders).
+
+    The subscription notifications are encoded as they come out of the execution, which does
+    not wait for promises. Queries and mutations keep batching their promises.
+    """
+    result = next_middleware(root, info, **kwargs)
+    if info.operation.operation != 'subscription' or not Promise.is_thenable(result):
+        return result
+
+    return result.get()
+
+
+def model_to_data(value):
+    """Return the concrete field values of the model `value` as strings, other values as they come."""
+    if not isinstance(value, models.Model):
+        return value
+
+    return {
+        MODEL_KEY: value._meta.label_lower,
+        'fields': {
+            field.attname: None if field.value_from_object(value) is None else field.value_to_string(value)
+            for field in value._meta.concrete_fields
+        },
+    }
+
+
+def data_to_model(value):
+    """Rebuild the model instance encoded by `model_to_data`, without querying the database."""
+    if not isinstance(value, dict) or MODEL_KEY not in value:
+        return value
+
+    model = apps.get_model(value[MODEL_KEY])
+    fields = {field.attname: field for field in model._meta.concrete_fields}
+
+    return model.from_db(
+        DEFAULT_DB_ALIAS,
+        list(value['fields']),
+        [None if string is None else fields[attname].to_python(string) for attname, string in value['fields'].items()],
+    )
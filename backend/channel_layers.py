@@ -0,0 +1,238 @@
+"""Channel layers that deliver messages between the worker processes of one host without Redis.
+
+Every process keeps its own channels and groups in memory, like `InMemoryChannelLayer`.
+Group sends, and sends to channels of another process, are also published on a bus that
+every process listens to, and each process delivers them to its own channels:
+
+* `PostgresChannelLayer` uses PostgreSQL LISTEN/NOTIFY on the database of the project.
+* `SQLiteChannelLayer` polls a table of a SQLite file shared by the processes.
+"""
+from channels.layers import InMemoryChannelLayer
+from contextlib import closing
+from django.db import connections
+from psycopg2 import sql
+
+import asyncio
+import base64
+import logging
+import msgpack
+import psycopg2
+import random
+import sqlite3
+import string
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+
+class BusChannelLayer(InMemoryChannelLayer):
+    """In-memory channel layer whose messages are relayed to the other processes through a bus.
+
+    Subclasses implement the bus with `publish()`, which is called from a thread, and
+    `listen()`, which runs in the event loop of the consumers of the process.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.process_id = uuid.uuid4().hex
+        self._listener = None
+        self._loop = None
+
+    async def new_channel(self, prefix="specific."):
+        # The process id in the name tells which process the channel belongs to
+        return "%s.%s!%s" % (
+            prefix,
+            self.process_id,
+            "".join(random.choice(string.ascii_letters) for i in range(12)),
+        )
+
+    async def send(self, channel, message):
+        if self._is_local(channel):
+            await self._in_consumer_loop(super().send(channel, message))
+        else:
+            await self._publish({'channel': channel, 'message': message})
+
+    async def receive(self, channel):
+        # Only processes with consumers receive, so they are the ones listening to the bus
+        self._loop = asyncio.get_event_loop()
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.ensure_future(self._listen())
+
+        return await super().receive(channel)
+
+    async def group_send(self, group, message):
+        await self._in_consumer_loop(super().group_send(group, message))
+        await self._publish({'group': group, 'message': message})
+
+    async def close(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            self._listener = None
+
+    def publish(self, body):
+        """Publish `body` (bytes) to every process listening to the bus."""
+        raise NotImplementedError()
+
+    async def listen(self, deliver):
+        """Call `deliver` with the body of every message published on the bus, forever."""
+        raise NotImplementedError()
+
+    async def _in_consumer_loop(self, coroutine):
+        """Await `coroutine` in the event loop of the consumers, as their queues are not thread safe."""
+        loop = self._loop
+        if loop is None or loop is asyncio.get_event_loop() or not loop.is_running():
+            return await coroutine
+
+        # Sent from another thread, e.g. by `async_to_sync()` outside of any request
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coroutine, loop))
+
+    def _is_local(self, channel):
+        return '.{}!'.format(self.process_id) in channel
+
+    async def _publish(self, envelope):
+        envelope['sender'] = self.process_id
+        envelope['expires'] = time.time() + self.expiry
+        body = msgpack.packb(envelope, use_bin_type=True)
+
+        await asyncio.get_event_loop().run_in_executor(None, self.publish, body)
+
+    async def _listen(self):
+        while True:
+            try:
+                await self.listen(self._deliver)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception('Channel layer bus failed, listening again in 1 second')
+                await asyncio.sleep(1)
+
+    async def _deliver(self, body):
+        envelope = msgpack.unpackb(body, raw=False)
+        if envelope['sender'] == self.process_id or envelope['expires'] < time.time():
+            return
+
+        if 'group' in envelope:
+            await super().group_send(envelope['group'], envelope['message'])
+        elif self._is_local(envelope['channel']):
+            await super().send(envelope['channel'], envelope['message'])
+
+
+class PostgresChannelLayer(BusChannelLayer):
+    """Channel layer relaying messages through LISTEN/NOTIFY on a PostgreSQL database.
+
+    Connects with the settings of the `database` alias. NOTIFY payloads are limited to
+    8000 bytes, so bigger messages are only delivered to the channels of the sender process.
+    """
+
+    # Base64 grows the payload by 4/3 and 8000 bytes is the NOTIFY limit
+    max_body_size = 8000 * 3 // 4
+
+    def __init__(self, database='default', channel='channel_layer', **kwargs):
+        super().__init__(**kwargs)
+        self.database = database
+        self.channel = channel
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def publish(self, body):
+        if len(body) > self.max_body_size:
+            logger.error('Channel layer message of %s bytes is too big to be sent to other processes', len(body))
+            return
+
+        payload = base64.b64encode(body).decode('ascii')
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    if self._connection is None or self._connection.closed:
+                        self._connection = self._connect()
+                    with self._connection.cursor() as cursor:
+                        cursor.execute('SELECT pg_notify(%s, %s)', [self.channel, payload])
+                    return
+                except (psycopg2.InterfaceError, psycopg2.OperationalError):
+                    # The connection was closed by the server, open a new one once
+                    self._connection = None
+                    if attempt:
+                        raise
+
+    async def listen(self, deliver):
+        loop = asyncio.get_event_loop()
+        connection = await loop.run_in_executor(None, self._connect)
+        notifies = asyncio.Queue()
+
+        def read_notifies():
+            try:
+                connection.poll()
+            except psycopg2.Error as error:
+                notifies.put_nowait(error)
+                return
+            while connection.notifies:
+                notifies.put_nowait(connection.notifies.pop(0))
+
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(sql.SQL('LISTEN {}').format(sql.Identifier(self.channel)))
+            loop.add_reader(connection.fileno(), read_notifies)
+            try:
+                while True:
+                    notify = await notifies.get()
+                    if isinstance(notify, Exception):
+                        raise notify
+                    await deliver(base64.b64decode(notify.payload))
+            finally:
+                loop.remove_reader(connection.fileno())
+        finally:
+            connection.close()
+
+    def _connect(self):
+        connection = psycopg2.connect(**connections[self.database].get_connection_params())
+        connection.autocommit = True
+
+        return connection
+
+
+class SQLiteChannelLayer(BusChannelLayer):
+    """Channel layer relaying messages through a table of a SQLite file, for development.
+
+    Every process polls the table each `poll_interval` seconds. Messages are deleted
+    when they expire.
+    """
+
+    def __init__(self, path, poll_interval=0.05, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self.poll_interval = poll_interval
+
+        with closing(self._connect()) as connection:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS channel_layer_message '
+                '(id INTEGER PRIMARY KEY AUTOINCREMENT, expires REAL NOT NULL, body BLOB NOT NULL)')
+
+    def publish(self, body):
+        with closing(self._connect()) as connection, connection:
+            connection.execute('DELETE FROM channel_layer_message WHERE expires < ?', [time.time()])
+            connection.execute(
+                'INSERT INTO channel_layer_message (expires, body) VALUES (?, ?)', [time.time() + self.expiry, body])
+
+    async def listen(self, deliver):
+        loop = asyncio.get_event_loop()
+        connection = self._connect(check_same_thread=False)
+        try:
+            last_id = await loop.run_in_executor(
+                None, lambda: connection.execute('SELECT COALESCE(MAX(id), 0) FROM channel_layer_message').fetchone()[0])
+            while True:
+                rows = await loop.run_in_executor(
+                    None,
+                    lambda: connection.execute(
+                        'SELECT id, body FROM channel_layer_message WHERE id > ? ORDER BY id', [last_id]).fetchall())
+                for last_id, body in rows:
+                    await deliver(body)
+                await asyncio.sleep(self.poll_interval)
+        finally:
+            connection.close()
+
+    def _connect(self, **kwargs):
+        return sqlite3.connect(self.path, timeout=10, **kwargs)
+
@@ -0,0 +1,163 @@
+"""Estimate the cost of a GraphQL operation from its document, before running it.
+
+Every field costs one per object it is resolved for. Connections and lists multiply the
+objects their selections are resolved for: by their `first`/`last` argument when given,
+otherwise by the largest page of a connection or `settings.QUERY_COST_LIST_SIZE` for other
+lists. So `relayAppointmentStates(first: 10) { edges { node { appointments(first: 20) { ... } } } }`
+resolves the fields of the appointments 200 times. Introspection fields are free.
+"""
+from backend import settings
+from graphene_django.settings import graphene_settings
+from graphql import GraphQLInt, GraphQLList, GraphQLNonNull
+from graphql.language import ast
+from graphql.utils.get_operation_ast import get_operation_ast
+from graphql.utils.value_from_ast import value_from_ast
+
+PAGE_ARGUMENTS = ('first', 'last')
+
+
+class QueryCost:
+    """Cost and depth of an operation."""
+
+    def __init__(self, cost=0, depth=0):
+        self.cost = cost
+        self.depth = depth
+
+    def as_extension(self):
+        """Return the cost as reported in the `extensions` of the responses."""
+        return {
+            'requestedQueryCost': self.cost,
+            'maximumAvailable': settings.QUERY_MAX_COST,
+            'depth': self.depth,
+            'maximumDepth': settings.QUERY_MAX_DEPTH,
+        }
+
+
+def get_query_cost(schema, document_ast, operation_name=None, variables=None):
+    """Return the `QueryCost` of the operation `operation_name` of `document_ast`, None if there is none.
+
+    The walk stops as soon as the cost passes `settings.QUERY_MAX_COST` or the depth passes
+    `settings.QUERY_MAX_DEPTH`, so the cost of a rejected operation is only a lower bound.
+    """
+    operation = get_operation_ast(document_ast, operation_name)
+    if operation is None:
+        return None
+
+    root_type = {
+        'query': schema.get_query_type,
+        'mutation': schema.get_mutation_type,
+        'subscription': schema.get_subscription_type,
+    }[operation.operation]()
+    fragments = {
+        definition.name.value: definition
+        for definition in document_ast.definitions if isinstance(definition, ast.FragmentDefinition)
+    }
+    walk = _CostWalk(schema, fragments, variables or {})
+    try:
+        walk.add_selections_cost(root_type, operation.selection_set, 1, 1, ())
+    except _OverBudget:
+        pass
+
+    return walk.query_cost
+
+
+class _OverBudget(Exception):
+    pass
+
+
+class _CostWalk:
+    # Fragments spread many times are walked once, their cost per object is kept and multiplied
+
+    def __init__(self, schema, fragments, variables):
+        self.schema = schema
+        self.fragments = fragments
+        self.variables = variables
+        self.query_cost = QueryCost()
+        # {(fragment name, type condition): (cost per object, depth of its fields)}
+        self.selection_costs = {}
+
+    def add(self, cost, depth):
+        self.query_cost.cost += cost
+        self.query_cost.depth = max(self.query_cost.depth, depth)
+        if self.query_cost.cost > settings.QUERY_MAX_COST or self.query_cost.depth > settings.QUERY_MAX_DEPTH:
+            raise _OverBudget()
+
+    def add_selections_cost(self, parent_type, selection_set, count, depth, spreads):
+        """Add the cost of `selection_set` resolved for `count` objects, its fields being at `depth`.
+
+        Return its cost per object and the depth of its fields below `depth` (1 for scalar fields only).
+        """
+        cost = height = 0
+        if selection_set is None or parent_type is None or not hasattr(parent_type, 'fields'):
+            return cost, height
+
+        for selection in selection_set.selections:
+            if isinstance(selection, ast.FragmentSpread):
+                fragment = self.fragments.get(selection.name.value)
+                # Cycles are reported by the validation of the document
+                if fragment is None or fragment.name.value in spreads:
+                    continue
+
+                key = (fragment.name.value, fragment.type_condition.name.value)
+                if key in self.selection_costs:
+                    selection_cost, selection_height = self.selection_costs[key]
+                    if selection_height:
+                        self.add(count * selection_cost, depth + selection_height - 1)
+                else:
+                    selection_cost, selection_height = self.add_selections_cost(
+                        self.schema.get_type(fragment.type_condition.name.value), fragment.selection_set, count, depth,
+                        spreads + (fragment.name.value,))
+                    self.selection_costs[key] = (selection_cost, selection_height)
+            elif isinstance(selection, ast.InlineFragment):
+                fragment_type = self.schema.get_type(selection.type_condition.name.value) \
+                    if selection.type_condition else parent_type
+                selection_cost, selection_height = self.add_selections_cost(
+                    fragment_type, selection.selection_set, count, depth, spreads)
+            else:
+                name = selection.name.value
+                field = parent_type.fields.get(name)
+                if name.startswith('__') or field is None:
+                    continue
+
+                self.add(count, depth)
+
+                field_type = field.type
+                if isinstance(field_type, GraphQLNonNull):
+                    field_type = field_type.of_type
+                is_list = isinstance(field_type, GraphQLList)
+                while isinstance(field_type, (GraphQLNonNull, GraphQLList)):
+                    field_type = field_type.of_type
+
+                size = _get_page_size(selection, self.variables)
+                if size is None:
+                    if _is_connection(field_type):
+                        size = graphene_settings.RELAY_CONNECTION_MAX_LIMIT
+                    elif is_list and not _is_connection(parent_type):
+                        size = settings.QUERY_COST_LIST_SIZE
+                    else:
+                        size = 1
+
+                child_cost, child_height = self.add_selections_cost(
+                    field_type, selection.selection_set, count * size, depth + 1, spreads)
+                selection_cost, selection_height = 1 + size * child_cost, 1 + child_height
+
+            cost += selection_cost
+            height = max(height, selection_height)
+
+        return cost, height
+
+
+def _get_page_size(selection, variables):
+    sizes = []
+    for argument in selection.arguments or []:
+        if argument.name.value in PAGE_ARGUMENTS:
+            value = value_from_ast(argument.value, GraphQLInt, variables)
+            if isinstance(value, int):
+                sizes.append(max(value, 0))
+
+    return max(sizes) if sizes else None
+
+
+def _is_connection(graphql_type):
+    # The edges of a connection are its page, they do not multiply it again
+    return getattr(graphql_type, 'name', '').endswith('Connection') and 'edges' in getattr(graphql_type, 'fields', {})
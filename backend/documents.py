@@ -0,0 +1,139 @@
+"""Parse and validate each GraphQL document once, and serve the persisted queries.
+
+`CachedDocumentBackend` keeps the last `settings.GRAPHQL_DOCUMENT_CACHE_SIZE` documents,
+parsed and validated against the schema, keyed by the SHA-256 of their text. A request
+repeating one of them skips the parsing and the validation.
+
+Persisted queries follow the automatic persisted queries protocol of Apollo: a client sends
+`extensions: {"persistedQuery": {"version": 1, "sha256Hash": ...}}` without the query, and
+sends the query with its hash again when it receives a `PersistedQueryNotFound` error,
+which registers it in the `PersistedQuery` table if it is valid and not longer than
+`settings.PERSISTED_QUERY_MAX_LENGTH`. Any client can register queries, so the table keeps
+the last `settings.PERSISTED_QUERY_MAX_ROWS` registered: the clients of the evicted ones get
+`PersistedQueryNotFound` and register them again.
+"""
+from backend import settings
+from dates.models import PersistedQuery
+from graphql.backend import GraphQLCoreBackend, GraphQLDocument
+from graphql.execution import ExecutionResult, execute
+from graphql.language.base import parse
+from graphql.validation import validate
+
+import collections
+import functools
+import hashlib
+import threading
+
+PERSISTED_QUERY_VERSION = 1
+
+
+class ValidatedDocument(GraphQLDocument):
+    """GraphQL document with the errors of its validation against the schema."""
+
+    def __init__(self, schema, document_string, document_ast, execute, validation_errors):
+        super().__init__(schema, document_string, document_ast, execute)
+        self.validation_errors = validation_errors
+
+
+class CachedDocumentBackend(GraphQLCoreBackend):
+    """GraphQL backend returning the recent documents parsed and validated."""
+
+    def __init__(self, executor=None):
+        super().__init__(executor)
+        # {(schema, query hash): document}
+        self._documents = collections.OrderedDict()
+        self._documents_lock = threading.Lock()
+
+    def document_from_string(self, schema, document_string):
+        if not isinstance(document_string, str):
+            return super().document_from_string(schema, document_string)
+
+        key = (schema, get_query_hash(document_string))
+        with self._documents_lock:
+            document = self._documents.get(key)
+            if document is not None:
+                self._documents.move_to_end(key)
+                return document
+
+        # Syntax errors raise here, so only parsed documents are cached
+        document_ast = parse(document_string)
+        validation_errors = validate(schema, document_ast)
+        document = ValidatedDocument(
+            schema=schema,
+            document_string=document_string,
+            document_ast=document_ast,
+            execute=functools.partial(
+                _execute_validated, schema, document_ast, validation_errors, **self.execute_params),
+            validation_errors=validation_errors,
+        )
+        with self._documents_lock:
+            self._documents[key] = document
+            while len(self._documents) > settings.GRAPHQL_DOCUMENT_CACHE_SIZE:
+                self._documents.popitem(last=False)
+
+        return document
+
+    def get_document_string(self, schema, query_hash):
+        """Return the text of the cached document `query_hash`, None if it is not cached."""
+        with self._documents_lock:
+            document = self._documents.get((schema, query_hash))
+
+        return document.document_string if document is not None else None
+
+
+document_backend = CachedDocumentBackend()
+
+
+def get_query_hash(query):
+    """Return the SHA-256 of `query`, as sent by the clients of persisted queries."""
+    return hashlib.sha256(query.encode('utf-8')).hexdigest()
+
+
+def get_persisted_query_hash(extensions):
+    """Return the hash of the persisted query of the request `extensions`, None if there is none."""
+    persisted_query = (extensions or {}).get('persistedQuery')
+    if not isinstance(persisted_query, dict):
+        return None
+    if persisted_query.get('version') != PERSISTED_QUERY_VERSION:
+        raise Exception(settings.PERSISTED_QUERY_NOT_SUPPORTED_ERROR)
+
+    return persisted_query.get('sha256Hash')
+
+
+def get_persisted_query(schema, query_hash):
+    """Return the text of the persisted query `query_hash`, None if it is not registered."""
+    query = document_backend.get_document_string(schema, query_hash)
+    if query is None:
+        query = PersistedQuery.objects.filter(sha256_hash=query_hash).values_list('query', flat=True).first()
+
+    return query
+
+
+def persist_query(schema, query_hash, query):
+    """Register `query` as the persisted query `query_hash` if it is valid against `schema`.
+
+    Clients send the query with its hash only after a `PersistedQueryNotFound` error. Syntax
+    errors raise, and invalid queries are not registered: their execution reports the errors.
+    """
+    if len(query) > settings.PERSISTED_QUERY_MAX_LENGTH:
+        raise Exception(settings.PERSISTED_QUERY_TOO_LONG_ERROR)
+    if get_query_hash(query) != query_hash:
+        raise Exception(settings.PERSISTED_QUERY_HASH_MISMATCH_ERROR)
+
+    if document_backend.document_from_string(schema, query).validation_errors:
+        return
+
+    _, created = PersistedQuery.objects.get_or_create(sha256_hash=query_hash, defaults={'query': query})
+    if created:
+        # Ids follow the registration order
+        evicted = list(PersistedQuery.objects.order_by('-pk').values_list('pk', flat=True)[
+            settings.PERSISTED_QUERY_MAX_ROWS:settings.PERSISTED_QUERY_MAX_ROWS + 1])
+        if evicted:
+            PersistedQuery.objects.filter(pk__lte=evicted[0]).delete()
+
+
+def _execute_validated(schema, document_ast, validation_errors, *args, **kwargs):
+    if validation_errors:
+        return ExecutionResult(errors=validation_errors, invalid=True)
+
+    return execute(schema, document_ast, *args, **kwargs)
@@ -0,0 +1,73 @@
+"""Hash passwords in a pool of processes, so hashing bursts do not starve the other requests.
+
+PBKDF2 takes the CPU of its thread for its whole duration. `PooledPBKDF2PasswordHasher`
+produces the same hashes as Django's `PBKDF2PasswordHasher` (both encode and verify), but
+computes them in at most `settings.PASSWORD_HASHING_WORKERS` processes. Up to
+`settings.PASSWORD_HASHING_QUEUE_LIMIT` more passwords wait for a free process, beyond that
+the request is rejected at once instead of piling up and taking all the request threads
+(see `settings.HTTP_THREADS`).
+"""
+from backend import settings
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+
+import multiprocessing
+import threading
+
+_pool = None
+_pool_lock = threading.Lock()
+_slots = None
+
+
+class PooledPBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """PBKDF2 hasher computing the hashes in the password hashing process pool."""
+
+    def encode(self, password, salt, iterations=None):
+        return run_in_pool(_encode, password, salt, iterations or self.iterations)
+
+
+def run_in_pool(function, *args):
+    """Call `function(*args)` in the password hashing pool and return its result.
+
+    Raises `settings.PASSWORD_HASHING_BUSY_ERROR` when the queue of the pool is full.
+    """
+    pool, slots = _get_pool()
+    if not slots.acquire(blocking=False):
+        raise Exception(settings.PASSWORD_HASHING_BUSY_ERROR)
+
+    try:
+        return pool.submit(function, *args).result()
+    except BrokenProcessPool:
+        # A worker died (e.g. killed by the OOM killer), the next call starts a new pool
+        _reset_pool(pool)
+        raise
+    finally:
+        slots.release()
+
+
+def _encode(password, salt, iterations):
+    return PBKDF2PasswordHasher().encode(password, salt, iterations)
+
+
+def _get_pool():
+    global _pool, _slots
+
+    with _pool_lock:
+        if _pool is None:
+            # Spawned workers do not inherit the threads and connections of the web process
+            _pool = ProcessPoolExecutor(
+                max_workers=settings.PASSWORD_HASHING_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+            _slots = threading.BoundedSemaphore(
+                settings.PASSWORD_HASHING_WORKERS + settings.PASSWORD_HASHING_QUEUE_LIMIT)
+
+        return _pool, _slots
+
+
+def _reset_pool(pool):
+    global _pool
+
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False)
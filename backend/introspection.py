@@ -0,0 +1,60 @@
+"""Serve the introspection of the schema from memory.
+
+GraphiQL and the tooling run the whole introspection query on every load, which resolves
+every type and field of the schema. Operations selecting only introspection fields are
+executed the first time they are received, then answered with the same result, tagged
+with an ETag so clients can revalidate it without downloading it again.
+"""
+from backend import settings
+from backend.documents import document_backend, get_query_hash
+from graphql.language import ast
+from graphql.utils.get_operation_ast import get_operation_ast
+
+import collections
+import json
+import threading
+
+# {(schema, query hash, operation name, variables): (ETag, execution result)}
+_results = collections.OrderedDict()
+_results_lock = threading.Lock()
+
+
+def is_introspection(document_ast, operation_name=None):
+    """Return whether the operation `operation_name` of `document_ast` only selects introspection fields."""
+    operation = get_operation_ast(document_ast, operation_name)
+    if operation is None or operation.operation != 'query':
+        return False
+
+    # Fragments spread at the root may select other fields, they are not looked into
+    return all(
+        isinstance(selection, ast.Field) and selection.name.value.startswith('__')
+        for selection in operation.selection_set.selections
+    )
+
+
+def get_introspection(schema, query, operation_name=None, variables=None):
+    """Return the ETag and the execution result of the introspection operation of `query`.
+
+    Return None when the operation is not an introspection operation or fails.
+    """
+    key = (schema, get_query_hash(query), operation_name, json.dumps(variables or {}, sort_keys=True))
+    with _results_lock:
+        cached = _results.get(key)
+        if cached is not None:
+            _results.move_to_end(key)
+            return cached
+
+    document = document_backend.document_from_string(schema, query)
+    if not is_introspection(document.document_ast, operation_name):
+        return None
+    result = document.execute(operation_name=operation_name, variables=variables)
+    if result.errors:
+        return None
+
+    etag = '"{}"'.format(get_query_hash(json.dumps(result.data, sort_keys=True)))
+    with _results_lock:
+        _results[key] = (etag, result)
+        while len(_results) > settings.INTROSPECTION_CACHE_SIZE:
+            _results.popitem(last=False)
+
+    return etag, result
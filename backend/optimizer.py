@@ -0,0 +1,177 @@
+"""Shape the querysets of the GraphQL resolvers after the selection set of the query.
+
+Only the columns of the selected fields are loaded (`only()`), selected forward relations
+are joined (`select_related()`) and selected reverse relations are loaded in one extra
+query each (`prefetch_related()`), when they are selected whole, without arguments.
+"""
+from django.db.models import Prefetch
+from graphene.utils.str_converters import to_snake_case
+from graphql import GraphQLInterfaceType, GraphQLUnionType
+from graphql.language.ast import FragmentSpread, InlineFragment
+
+import functools
+
+# Arguments of a relay connection that only paginate it
+PAGINATION_ARGS = ('first', 'last', 'before', 'after')
+
+
+def optimize_queryset(queryset, info):
+    """Return `queryset` (or manager) optimized for the fields selected in `info`."""
+    queryset = queryset.all()
+    graphql_type, field_asts = _get_node_selection(_unwrap_type(info.return_type), info.field_asts, info)
+    graphql_type = _get_model_type(graphql_type, queryset.model, info)
+    # Related managers set the instance they belong to on every row through its foreign key
+    required_fields = [field.name for field in queryset._known_related_objects]
+
+    return _apply_plan(queryset, graphql_type, field_asts, info, required_fields)
+
+
+def get_prefetched(instance, name):
+    """Return the list prefetched for the relation `name` of `instance` or None."""
+    prefetched = getattr(instance, '_prefetched_objects_cache', {}).get(name)
+
+    return None if prefetched is None else list(prefetched)
+
+
+def require_fields(queryset, *field_names):
+    """Return `queryset` loading `field_names` too, even if `only()` restricted its columns."""
+    loaded_fields, defer = queryset.query.deferred_loading
+    if defer:
+        return queryset.defer(None).defer(*(set(loaded_fields) - set(field_names)))
+
+    return queryset.only(*loaded_fields, *field_names)
+
+
+def _apply_plan(queryset, graphql_type, field_asts, info, required_fields=()):
+    plan = _QueryPlan()
+    plan.only.extend(required_fields)
+    _plan_selection(plan, queryset.model, graphql_type, field_asts, info)
+
+    if plan.select_related:
+        queryset = queryset.select_related(*plan.select_related)
+    if plan.prefetch_related:
+        queryset = queryset.prefetch_related(*plan.prefetch_related)
+
+    return queryset.only(*plan.only)
+
+
+class _QueryPlan:
+    def __init__(self):
+        self.only = []
+        self.select_related = []
+        self.prefetch_related = []
+
+
+def _plan_selection(plan, model, graphql_type, field_asts, info, prefix=''):
+    model_fields = _get_model_fields(model)
+    columns = [model._meta.pk.name]
+    # A field that is not a model field is resolved by custom code which may read any column
+    restrict_columns = True
+
+    for name, nodes in _get_selected_fields(graphql_type, field_asts, info).items():
+        if name.startswith('__'):
+            continue
+
+        field = model_fields.get(to_snake_case(name))
+        if field is None:
+            restrict_columns = False
+        elif field.one_to_many or field.many_to_many:
+            if any(node.arguments for node in nodes):
+                # Filtered relations are queried again by their connection field, and paginated ones are
+                # loaded page by page, as a prefetch would read every related row
+                continue
+
+            related_type, related_nodes = _get_node_selection(
+                _unwrap_type(graphql_type.fields[name].type), nodes, info)
+            # Prefetching needs the foreign key back to the instances of this model
+            required_fields = [field.field.name] if field.one_to_many else []
+            queryset = _apply_plan(
+                field.related_model._default_manager.all(), related_type, related_nodes, info, required_fields)
+            plan.prefetch_related.append(Prefetch(prefix + field.get_accessor_name(), queryset=queryset))
+        elif field.many_to_one or field.one_to_one:
+            if field.concrete:
+                columns.append(field.name)
+            plan.select_related.append(prefix + field.name)
+            _plan_selection(
+                plan, field.related_model, _unwrap_type(graphql_type.fields[name].type), nodes, info,
+                prefix + field.name + '__')
+        else:
+            columns.append(field.name)
+
+    if not restrict_columns:
+        columns = [field.name for field in model._meta.concrete_fields]
+
+    plan.only.extend(prefix + column for column in columns)
+
+
+@functools.lru_cache(maxsize=None)
+def _get_model_fields(model):
+    """Map the python names of the graphene fields of `model` to its model fields."""
+    model_fields = {}
+    for field in model._meta.get_fields():
+        name = field.get_accessor_name() if field.auto_created and not field.concrete else field.name
+        model_fields[name] = field
+
+    return model_fields
+
+
+def _get_node_selection(graphql_type, field_asts, info):
+    """Step into `edges { node }` when `graphql_type` is a relay connection."""
+    if 'edges' not in getattr(graphql_type, 'fields', {}):
+        return graphql_type, field_asts
+
+    edge_type = _unwrap_type(graphql_type.fields['edges'].type)
+    edge_asts = _get_selected_fields(graphql_type, field_asts, info).get('edges', [])
+    node_asts = _get_selected_fields(edge_type, edge_asts, info).get('node', [])
+
+    return _unwrap_type(edge_type.fields['node'].type), node_asts
+
+
+def _get_model_type(graphql_type, model, info):
+    """Return the object type of `model` when `graphql_type` is an interface or union it belongs to.
+
+    Fields returning e.g. the relay `Node` interface select the fields of the model in fragments
+    on its type, which are only merged for that type.
+    """
+    if not isinstance(graphql_type, (GraphQLInterfaceType, GraphQLUnionType)):
+        return graphql_type
+
+    for possible_type in info.schema.get_possible_types(graphql_type):
+        graphene_meta = getattr(getattr(possible_type, 'graphene_type', None), '_meta', None)
+        if getattr(graphene_meta, 'model', None) is model:
+            return possible_type
+
+    return graphql_type
+
+
+def _get_selected_fields(graphql_type, field_asts, info):
+    """Group the field ASTs selected on `graphql_type` by field name, merging fragments."""
+    type_names = {graphql_type.name} | {interface.name for interface in getattr(graphql_type, 'interfaces', [])}
+    selected_fields = {}
+
+    def collect(selections):
+        for selection in selections:
+            if isinstance(selection, FragmentSpread):
+                fragment = info.fragments[selection.name.value]
+                if fragment.type_condition.name.value in type_names:
+                    collect(fragment.selection_set.selections)
+            elif isinstance(selection, InlineFragment):
+                if selection.type_condition is None or selection.type_condition.name.value in type_names:
+                    collect(selection.selection_set.selections)
+            else:
+                selected_fields.setdefault(selection.name.value, []).append(selection)
+
+    for field_ast in field_asts:
+        if field_ast.selection_set is not None:
+            collect(field_ast.selection_set.selections)
+
+    return selected_fields
+
+
+def _unwrap_type(graphql_type):
+    """Strip the NonNull and List wrappers of `graphql_type`."""
+    while hasattr(graphql_type, 'of_type'):
+        graphql_type = graphql_type.of_type
+
+    return graphql_type
+
@@ -0,0 +1,205 @@
+"""Answer the queries of rarely changing data from memory.
+
+Root query fields are designated with `cache_query_fields()`, with the group of data they
+read and the types their results may contain. Queries selecting only designated fields, and
+only fields of those types, are executed once and their result is kept by every process,
+keyed by normalized document, operation, variables and authorization scope, for
+`settings.RESPONSE_CACHE_TTL` seconds. The cache holds `settings.RESPONSE_CACHE_SIZE`
+results of `settings.RESPONSE_CACHE_MAX_BYTES` bytes of JSON at most.
+
+`invalidate()` forgets the results of a group in the process that changed its data. Other
+processes see the change once their cached result expires.
+"""
+from backend import settings
+from backend.documents import get_query_hash
+from django.db import transaction
+from graphql.language import ast
+from graphql.language.printer import print_ast
+from graphql.utils.get_operation_ast import get_operation_ast
+
+import collections
+import functools
+import json
+import threading
+import time
+
+# Designated root query fields: {field name: (group, names of the types of the results, names of the arguments)}
+_cached_fields = {}
+
+# {key: (expiration time, group, size, execution result)}
+_results = collections.OrderedDict()
+_results_lock = threading.Lock()
+_size = 0
+# Incremented by every invalidation, so a result computed before it is not cached after it
+_invalidations = 0
+_hits = 0
+_misses = 0
+
+
+def cache_query_fields(group, fields, types, arguments):
+    """Cache the results of the root query `fields` reading the data of `group`.
+
+    Only the queries whose selections stay in `types` (type names, e.g. the node, its
+    connection and edge types), and whose root fields only get `arguments`, are cached.
+    Arguments reading other data, like filters by related objects, must be left out.
+    """
+    for field in fields:
+        _cached_fields[field] = (group, frozenset(types) | {'PageInfo'}, frozenset(arguments))
+
+
+def get_scope(user):
+    """Return the authorization scope of `user`, shared by the results it can read."""
+    if user.is_staff:
+        return 'staff'
+
+    return 'authenticated' if user.is_authenticated else 'anonymous'
+
+
+def get_cache_key(schema, document_ast, operation_name, variables, get_user):
+    """Return the key of the result of the operation, None if it cannot be cached.
+
+    `get_user()` returns the user of the request, and is only called for the operations that
+    can be cached, so other operations (e.g. mutations) are not authenticated here.
+    """
+    operation = get_operation_ast(document_ast, operation_name)
+    if operation is None or operation.operation != 'query':
+        return None
+
+    fragments = {
+        definition.name.value: definition
+        for definition in document_ast.definitions if isinstance(definition, ast.FragmentDefinition)
+    }
+    groups = set()
+    root_type = schema.get_query_type()
+    for selection in _expand(operation.selection_set, fragments):
+        if selection.name.value == '__typename':
+            continue
+        if selection.name.value not in _cached_fields:
+            return None
+        group, types, arguments = _cached_fields[selection.name.value]
+        if any(argument.name.value not in arguments for argument in selection.arguments or []):
+            return None
+        groups.add(group)
+        if not _stays_in_types(root_type.fields[selection.name.value].type, selection, fragments, types):
+            return None
+
+    if len(groups) != 1:
+        return None
+
+    return (
+        groups.pop(),
+        _get_normalized_hash(document_ast),
+        operation_name,
+        json.dumps(variables or {}, sort_keys=True),
+        get_scope(get_user()),
+    )
+
+
+def get_result(key):
+    """Return the cached result of `key`, None if there is none."""
+    global _hits, _misses
+
+    with _results_lock:
+        entry = _results.get(key)
+        if entry is not None and entry[0] > time.time():
+            _results.move_to_end(key)
+            _hits += 1
+            return entry[3]
+
+        _misses += 1
+        return None
+
+
+def get_invalidations():
+    """Return the number of invalidations so far, to give to `set_result()`."""
+    return _invalidations
+
+
+def set_result(key, result, invalidations):
+    """Cache `result` as the result of `key`, unless its group was invalidated after `invalidations`."""
+    global _size
+
+    if result.errors or result.invalid:
+        return
+
+    size = len(json.dumps(result.data))
+    if size > settings.RESPONSE_CACHE_MAX_BYTES:
+        return
+
+    with _results_lock:
+        if invalidations != _invalidations:
+            return
+
+        _discard(key)
+        _results[key] = (time.time() + settings.RESPONSE_CACHE_TTL, key[0], size, result)
+        _size += size
+        while len(_results) > settings.RESPONSE_CACHE_SIZE or _size > settings.RESPONSE_CACHE_MAX_BYTES:
+            _discard(next(iter(_results)))
+
+
+def invalidate(group):
+    """Forget the cached results of `group`."""
+    global _invalidations
+
+    with _results_lock:
+        _invalidations += 1
+        for key in [key for key, entry in _results.items() if entry[1] == group]:
+            _discard(key)
+
+
+def invalidate_on_commit(group):
+    """Forget the cached results of `group` now and when the current transaction commits."""
+    invalidate(group)
+    # Requests reading the data before the commit may have cached it again
+    transaction.on_commit(lambda: invalidate(group))
+
+
+def get_stats():
+    """Return the hits, misses, entries and bytes of the cache of this process."""
+    with _results_lock:
+        return {'hits': _hits, 'misses': _misses, 'entries': len(_results), 'bytes': _size}
+
+
+def _discard(key):
+    global _size
+
+    entry = _results.pop(key, None)
+    if entry is not None:
+        _size -= entry[2]
+
+
+@functools.lru_cache(maxsize=settings.GRAPHQL_DOCUMENT_CACHE_SIZE)
+def _get_normalized_hash(document_ast):
+    # Same hash for the documents differing only in whitespace, commas or comments
+    return get_query_hash(print_ast(document_ast))
+
+
+def _expand(selection_set, fragments, spreads=()):
+    # Fields of `selection_set`, with the fields of its fragments
+    for selection in selection_set.selections:
+        if isinstance(selection, ast.Field):
+            yield selection
+        elif isinstance(selection, ast.InlineFragment):
+            yield from _expand(selection.selection_set, fragments, spreads)
+        else:
+            fragment = fragments.get(selection.name.value)
+            if fragment is not None and fragment.name.value not in spreads:
+                yield from _expand(fragment.selection_set, fragments, spreads + (fragment.name.value,))
+
+
+def _stays_in_types(field_type, selection, fragments, types):
+    while hasattr(field_type, 'of_type'):
+        field_type = field_type.of_type
+    if selection.selection_set is None:
+        return True
+    if field_type.name not in types:
+        return False
+
+    for child in _expand(selection.selection_set, fragments):
+        if child.name.value == '__typename':
+            continue
+        field = field_type.fields.get(child.name.value)
+        if field is None or not _stays_in_types(field.type, child, fragments, types):
+            return False
+
+    return True
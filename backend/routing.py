@@ -1,20 +1,79 @@
-import channels_graphql_ws
-
+from .broadcast import resolve_promises
 from .schema import graphql_schema
+from asgiref.sync import async_to_sync, sync_to_async
+from backend import settings
+from backend.authentication import authenticate_connection
+from backend.introspection import get_introspection
+from channels.db import database_sync_to_async
+from channels.http import AsgiHandler
 from channels.routing import ProtocolTypeRouter, URLRouter
+from concurrent.futures import ThreadPoolExecutor
+from django.db import close_old_connections
 from django.urls import path
 
+import channels_graphql_ws
+
 
 # ------------------------------------------ CHANNELS URL CONFIGURATION (For channels_graphql_ws module - subscriptions)
 class MyGraphqlWsConsumer(channels_graphql_ws.GraphqlWsConsumer):
     """Channels WebSocket consumer which provides GraphQL API."""
 
     schema = graphql_schema
+    middleware = [resolve_promises]
+
+    async def on_connect(self, payload):
+        # The subscriptions read the user of the socket from its scope. Invalid tokens reject the connection
+        self.scope['user'] = await database_sync_to_async(authenticate_connection)(payload)
+
+    async def receive_json(self, content):
+        # GraphiQL introspects the schema through the socket on every load
+        if content.get('type') == 'start':
+            payload = content.get('payload') or {}
+            try:
+                introspection = await sync_to_async(get_introspection, thread_sensitive=False)(
+                    self.schema, payload['query'], payload.get('operationName'), payload.get('variables'))
+            except Exception:
+                # Executed as any other operation, which reports the error
+                introspection = None
+
+            if introspection is not None:
+                _, result = introspection
+                await self._send_gql_data(content['id'], data=result.data, errors=result.errors)
+                await self._send_gql_complete(content['id'])
+                return
+
+        await super().receive_json(content)
+
+
+# ------------------------------------------------------------------------- HTTP HANDLER
+_http_executor = ThreadPoolExecutor(max_workers=settings.HTTP_THREADS, thread_name_prefix='http')
+
+
+class ConcurrentAsgiHandler(AsgiHandler):
+    """Django HTTP handler running the requests in a pool of threads.
+
+    The default handler runs all the requests of the process in the same thread, so a request
+    waiting (e.g. for its password to be hashed in another process) blocks all the others.
+    Every thread of the pool keeps its database connection between requests, up to CONN_MAX_AGE
+    seconds as with any other Django thread.
+    """
+
+    async def handle(self, body):
+        await sync_to_async(self._handle, thread_sensitive=False, executor=_http_executor)(body)
+
+    def _handle(self, body):
+        try:
+            # The handling of Django is thread sensitive, so it runs in this thread: the outermost synchronous one
+            async_to_sync(super().handle)(body)
+        finally:
+            # As Django does at the end of every request, even if it was aborted
+            close_old_connections()
 
 
 # ------------------------------------------------------------------------- ASGI ROUTING
 application = ProtocolTypeRouter(
     {
+        "http": ConcurrentAsgiHandler,
         "websocket": URLRouter(
             [
                 # The file graphiql.html should point to the next path for subscriptions
@@ -60,7 +60,7 @@ THIRD_PARTY_APPS = [
 ]
 
 LOCAL_APPS = [
-    'dates'
+    'dates.apps.DatesConfig'
 ]
 
 INSTALLED_APPS = THIRD_PARTY_APPS + LOCAL_APPS + DJANGO_APPS
@@ -72,8 +72,8 @@ AUTH_USER_MODEL = 'dates.User'
 GRAPHENE = {
     'SCHEMA': 'backend.schema.graphql_schema',
     'MIDDLEWARE': [
-        # Django GraphQL JWT
-        'graphql_jwt.middleware.JSONWebTokenMiddleware',
+        # Django GraphQL JWT, authenticating once per operation
+        'backend.authentication.JSONWebTokenMiddleware',
     ],
 }
 
@@ -87,16 +87,66 @@ AUTHENTICATION_BACKENDS = [
     # Django administration
     'django.contrib.auth.backends.ModelBackend',
 
-    # Django GraphQL JWT
-    'graphql_jwt.backends.JSONWebTokenBackend',
+    # Django GraphQL JWT, with the users of the recent tokens cached
+    'backend.authentication.JSONWebTokenBackend',
 ]
 
+# Seconds the user authenticated by a token is cached. A change made to the user by another
+# process is seen after this delay at most
+JWT_USER_CACHE_TTL = 30
+# Tokens whose user is cached by every process
+JWT_USER_CACHE_SIZE = 1000
+
+# Static cost analysis of the GraphQL operations (backend/cost.py), run before they are executed.
+# Operations resolving more fields than QUERY_MAX_COST or nesting them deeper than
+# QUERY_MAX_DEPTH are rejected without running any query
+QUERY_MAX_COST = 10000
+QUERY_MAX_DEPTH = 15
+# Objects assumed for the lists which are not connections
+QUERY_COST_LIST_SIZE = 10
+# GraphQL documents kept parsed and validated by every process
+GRAPHQL_DOCUMENT_CACHE_SIZE = 256
+# Longest query registered as a persisted query, in characters
+PERSISTED_QUERY_MAX_LENGTH = 20000
+# Persisted queries kept, the oldest registered are deleted beyond it
+PERSISTED_QUERY_MAX_ROWS = 1000
+# Results of introspection operations (with their variables) kept by every process
+INTROSPECTION_CACHE_SIZE = 16
+# Results of the designated queries (backend/response_cache.py) kept by every process. A change
+# made by another process is seen after RESPONSE_CACHE_TTL seconds at most
+RESPONSE_CACHE_TTL = 60
+RESPONSE_CACHE_SIZE = 256
+RESPONSE_CACHE_MAX_BYTES = 4 * 1024 * 1024
+# Days the change log (dates/changes.py) is kept by the prune_change_log command
+CHANGE_LOG_RETENTION_DAYS = 30
+# Most changes read by changesSince
+CHANGES_MAX_FIRST = 500
+# Rows read from the database and written to the response at a time by the appointment export
+EXPORT_CHUNK_SIZE = 2000
+
 # Channels settings
-# In this simple example we use in-process in-memory Channel layer.
-# In a real-life cases you should use Redis or something familiar.
-CHANNEL_LAYERS = {"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}
+# The channel layer relays broadcasts between the worker processes, through LISTEN/NOTIFY
+# on the PostgreSQL database in production and through a SQLite file in development.
+if PRO_DATABASE:
+    CHANNEL_LAYERS = {"default": {"BACKEND": "backend.channel_layers.PostgresChannelLayer"}}
+else:
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "backend.channel_layers.SQLiteChannelLayer",
+            "CONFIG": {"path": os.path.join(BASE_DIR, 'channels.sqlite3')},
+        }
+    }
+# Seconds during which successive broadcasts about the same object are merged into the last one
+SUBSCRIPTION_COALESCE_WINDOW = 0.25
+# Recent broadcasts whose payload models are kept rebuilt for the subscriptions of the process
+SUBSCRIPTION_PAYLOAD_CACHE_SIZE = 64
 ROOT_URLCONF = 'backend.urls'
 ASGI_APPLICATION = "backend.routing.application"
+# Threads running the HTTP requests of every web process. Keep it above the password hashing
+# workers plus their queue, so logins never take all of them. Every thread keeps its own
+# database connection: HTTP_THREADS times the web processes (WEB_CONCURRENCY) must fit in the
+# connections the database accepts
+HTTP_THREADS = int(os.getenv('HTTP_THREADS', 32))
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
@@ -180,6 +230,22 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Password hashing
+# https://docs.djangoproject.com/en/2.1/topics/auth/passwords/
+
+# Django's default hashers, but PBKDF2 hashes are computed in a pool of processes (see backend/hashers.py).
+# Both hashers share their algorithm name, so Django's one must not be listed to verify with the pooled one
+PASSWORD_HASHERS = [
+    'backend.hashers.PooledPBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+]
+# Passwords hashed at the same time by every web process
+PASSWORD_HASHING_WORKERS = int(os.getenv('PASSWORD_HASHING_WORKERS', 2))
+# Passwords waiting for a free hashing process, beyond that requests are rejected
+PASSWORD_HASHING_QUEUE_LIMIT = 16
+
 # Internationalization
 # https://docs.djangoproject.com/en/2.1/topics/i18n/
 
@@ -214,6 +280,14 @@ EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 # EMAIL_PORT = 1025
 # EMAIL_USE_TLS = False
 
+# Emails are queued in an outbox and sent in batches over one connection (see dates/outbox.py)
+OUTBOX_BATCH_SIZE = 50
+OUTBOX_MAX_ATTEMPTS = 8
+OUTBOX_RETRY_DELAY = datetime.timedelta(seconds=30)  # Doubled after every failed attempt
+OUTBOX_POLL_INTERVAL = 10  # Seconds between two looks for due emails when nothing is queued
+# False when only the `send_outbox_emails` command sends the emails, in its own process
+OUTBOX_SEND_IN_BACKGROUND = True
+
 #########################################################################################################
 #########################################################################################################
 # Constants
@@ -236,6 +310,14 @@ JWT_EXPIRATION_DELTA_EMAILS = datetime.timedelta(minutes=15)  # For tokens of em
 # Password: Length between 8 and 16 characters. 1 digit, 1 upper case character and 1 lower case character
 EMAIL_REGEX_PATTERN = r"(^[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+$)"
 PASSWORD_REGEX_PATTERN = '^(?=\w*\d)(?=\w*[A-Z])(?=\w*[a-z])\S{8,16}$'
+# Region of the phone numbers given without international prefix
+PHONE_NUMBER_DEFAULT_REGION = 'ES'
+# Distinct phone numbers whose normalization is memoized
+PHONE_NUMBER_CACHE_SIZE = 4096
+# Most users returned by searchUsers
+SEARCH_USERS_MAX_FIRST = 50
+# Most users returned by users
+USERS_MAX_FIRST = 100
 
 # TODO delete comment constants?
 # Messages
@@ -267,6 +349,40 @@ PASSWORD1_REQUIRED_ERROR = 'Password1RequiredError'
 PASSWORD2_REQUIRED_ERROR = 'Password2RequiredError'
 PASSWORD_REGEX_ERROR = 'PasswordRegexError'
 PASSWORDS_NOT_MATCH_ERROR = 'PasswordsNotMatchError'
+PASSWORD_HASHING_BUSY_ERROR = 'PasswordHashingBusyError'
+
+##########################
+#  Dates
+##########################
+
+# Time zone of the shop. Opening hours, slots and the days of the appointments are in its local time
+SHOP_TIME_ZONE = 'Europe/Madrid'
+# Every appointment takes one slot. Slots start at multiples of this duration from midnight
+APPOINTMENT_DURATION = datetime.timedelta(minutes=30)
+# Opening hours in the local time of the shop by weekday (Monday is 0)
+OPENING_HOURS = {
+    0: [(datetime.time(9, 30), datetime.time(14, 0)), (datetime.time(16, 30), datetime.time(20, 30))],
+    1: [(datetime.time(9, 30), datetime.time(14, 0)), (datetime.time(16, 30), datetime.time(20, 30))],
+    2: [(datetime.time(9, 30), datetime.time(14, 0)), (datetime.time(16, 30), datetime.time(20, 30))],
+    3: [(datetime.time(9, 30), datetime.time(14, 0)), (datetime.time(16, 30), datetime.time(20, 30))],
+    4: [(datetime.time(9, 30), datetime.time(14, 0)), (datetime.time(16, 30), datetime.time(20, 30))],
+    5: [(datetime.time(9, 30), datetime.time(14, 0))],
+}
+AVAILABLE_SLOTS_MAX_DAYS = 62
+# Longest date range watched by one appointment change subscription
+APPOINTMENT_CHANGE_MAX_DAYS = 62
+DEFAULT_APPOINTMENT_STATE_NAME = 'Pendiente'
+
+# Error messages
+INVALID_DATE_RANGE_ERROR = 'InvalidDateRangeError'
+INVALID_DURATION_ERROR = 'InvalidDurationError'
+APPOINTMENT_DOES_NOT_EXIST_ERROR = 'AppointmentDoesNotExistError'
+APPOINTMENT_STATE_DOES_NOT_EXIST_ERROR = 'AppointmentStateDoesNotExistError'
+APPOINTMENT_DATE_NOT_VALID_ERROR = 'AppointmentDateNotValidError'
+VALUE_TOO_LONG_ERROR = 'ValueTooLongError'
+SLOT_NOT_VALID_ERROR = 'SlotNotValidError'
+SLOT_NOT_AVAILABLE_ERROR = 'SlotNotAvailableError'
+
 ##########################
 # Generics
 ##########################
@@ -277,11 +393,21 @@ KO = 'KO'
 
 # Error messages
 INVALID_ACTION_ERROR = 'InvalidActionError'
+INVALID_CURSOR_ERROR = 'InvalidCursorError'
 TOKEN_ERROR = 'TokenError'
 TOKEN_REQUIRED_ERROR = 'TokenRequiredError'
 TOKEN_USED_ERROR = 'TokenUsedError'
 TOKEN_NOT_MATCH_ERROR = 'TokenNotMatchError'
 EXPIRED_TOKEN_ERROR = 'ExpiredTokenError'
 OPERATION_NOT_ALLOWED_ERROR = 'OperationNotAllowedError'
+QUERY_TOO_COSTLY_ERROR = 'QueryTooCostlyError'
+QUERY_TOO_DEEP_ERROR = 'QueryTooDeepError'
+# The changes after the cursor were pruned, the client must load everything again
+CHANGES_EXPIRED_ERROR = 'ChangesExpiredError'
+# Message expected by the clients of persisted queries to send the query again
+PERSISTED_QUERY_NOT_FOUND_ERROR = 'PersistedQueryNotFound'
+PERSISTED_QUERY_NOT_SUPPORTED_ERROR = 'PersistedQueryNotSupportedError'
+PERSISTED_QUERY_HASH_MISMATCH_ERROR = 'PersistedQueryHashMismatchError'
+PERSISTED_QUERY_TOO_LONG_ERROR = 'PersistedQueryTooLongError'
 
 django_heroku.settings(locals())
@@ -0,0 +1,256 @@
+from asgiref.sync import async_to_sync
+from backend import authentication, settings
+from backend.authentication import authenticate_connection, get_user_by_token
+from backend.channel_layers import SQLiteChannelLayer
+from backend.cost import get_query_cost
+from backend.documents import get_query_hash
+from backend.hashers import PooledPBKDF2PasswordHasher
+from backend.introspection import get_introspection
+from backend.routing import MyGraphqlWsConsumer
+from backend.schema import graphql_schema
+from channels.testing import WebsocketCommunicator
+from dates.models import PersistedQuery
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+from django.test import SimpleTestCase, TestCase, override_settings
+from graphql import parse
+from graphql_jwt.shortcuts import get_token
+from graphql_relay.node.node import to_global_id
+from unittest import mock
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+
+class QueryCostTest(TestCase):
+    # Every fragment spreads the next one twice, so the last one is resolved 2 ** 20 times
+    CHAINED_FRAGMENTS_QUERY = 'query { ...F0 } ' + ''.join(
+        'fragment F{} on Query {{ ...F{} ...F{} }} '.format(i, i + 1, i + 1) for i in range(20)
+    ) + 'fragment F20 on Query { me { id } }'
+
+    def test_fragments_are_walked_once(self):
+        start = time.time()
+        query_cost = get_query_cost(graphql_schema, parse(self.CHAINED_FRAGMENTS_QUERY))
+
+        self.assertLess(time.time() - start, 1)
+        self.assertGreater(query_cost.cost, settings.QUERY_MAX_COST)
+
+    def test_fragments_cost_is_multiplied(self):
+        # The settings are read from backend.settings, not from django.conf
+        with mock.patch.object(settings, 'QUERY_MAX_COST', 10 ** 9):
+            query_cost = get_query_cost(graphql_schema, parse(self.CHAINED_FRAGMENTS_QUERY))
+
+        # `me` and its `id`, 2 ** 20 times
+        self.assertEqual(query_cost.cost, 2 ** 21)
+        self.assertEqual(query_cost.depth, 2)
+
+    def test_chained_fragments_are_rejected(self):
+        start = time.time()
+        response = self.client.post(
+            '/graphql/', json.dumps({'query': self.CHAINED_FRAGMENTS_QUERY}), content_type='application/json')
+
+        self.assertLess(time.time() - start, 1)
+        self.assertEqual(response.json()['errors'][0]['message'], settings.QUERY_TOO_COSTLY_ERROR)
+
+
+class ResponseCacheAuthenticationTest(TestCase):
+    STATES_QUERY = '{ relayAppointmentStates(first: 1) { edges { node { name } } } }'
+    CREATE_APPOINTMENT_MUTATION = '''
+        mutation($userId: String) {
+            createAppointment(appointmentDate: "2030-01-07T10:00:00+00:00", userId: $userId) { result errors }
+        }
+    '''
+
+    def post(self, query, token, variables=None):
+        return self.client.post(
+            '/graphql/', json.dumps({'query': query, 'variables': variables}), content_type='application/json',
+            HTTP_AUTHORIZATION='JWT {}'.format(token)).json()
+
+    def test_mutations_do_not_get_cached_users(self):
+        staff = get_user_model().objects.create_user(email='staff@example.com', is_staff=True)
+        customer = get_user_model().objects.create_user(email='customer@example.com')
+        token = get_token(staff)
+
+        # Caches the user of the token
+        self.assertNotIn('errors', self.post(self.STATES_QUERY, token))
+        # Changed without signals, like another process would
+        get_user_model().objects.filter(pk=staff.pk).update(is_staff=False)
+
+        response = self.post(self.CREATE_APPOINTMENT_MUTATION, token, {'userId': to_global_id('UserNode', customer.pk)})
+        self.assertEqual(response['data']['createAppointment']['errors'], [settings.OPERATION_NOT_ALLOWED_ERROR])
+
+
+class ConnectionAuthenticationTest(TestCase):
+    def test_token(self):
+        user = get_user_model().objects.create_user(email='customer@example.com')
+
+        self.assertEqual(authenticate_connection({'Authorization': 'JWT {}'.format(get_token(user))}), user)
+
+    def test_without_token(self):
+        for payload in (None, {}, {'Authorization': 'token'}):
+            with self.subTest(payload=payload):
+                self.assertTrue(authenticate_connection(payload).is_anonymous)
+
+    def test_invalid_token(self):
+        with self.assertRaises(Exception):
+            authenticate_connection({'Authorization': 'JWT invalid'})
+
+
+class UserByTokenCacheTest(TestCase):
+    def setUp(self):
+        # Tokens of users made in the same second by other tests are the same
+        authentication._users_by_signature.clear()
+        self.addCleanup(authentication._users_by_signature.clear)
+        self.user = get_user_model().objects.create_user(email='customer@example.com')
+        self.token = get_token(self.user)
+        # Caches the user of the token
+        get_user_by_token(self.token)
+
+    def test_cached_user(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(get_user_by_token(self.token), self.user)
+
+    def test_not_cached(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(get_user_by_token(self.token, cached=False), self.user)
+
+    def test_deactivated_user(self):
+        self.user.is_active = False
+        self.user.save()
+
+        with self.assertRaisesMessage(Exception, 'User is disabled'):
+            get_user_by_token(self.token)
+
+    def test_deleted_user(self):
+        self.user.delete()
+
+        self.assertIsNone(get_user_by_token(self.token))
+
+
+class IntrospectionTest(SimpleTestCase):
+    QUERY = '{ __schema { queryType { name } } }'
+
+    def test_not_modified(self):
+        response = self.client.get('/graphql/', {'query': self.QUERY}, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['data']['__schema']['queryType']['name'], 'Query')
+        etag = response['ETag']
+
+        response = self.client.get(
+            '/graphql/', {'query': self.QUERY}, HTTP_ACCEPT='application/json', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    @override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+    def test_websocket(self):
+        async def run():
+            communicator = WebsocketCommunicator(MyGraphqlWsConsumer, '/subscriptions/', subprotocols=['graphql-ws'])
+            await communicator.connect()
+            await communicator.send_json_to({'type': 'connection_init', 'payload': {}})
+            self.assertEqual((await communicator.receive_json_from())['type'], 'connection_ack')
+
+            await communicator.send_json_to({'type': 'start', 'id': '1', 'payload': {'query': self.QUERY}})
+            message = await communicator.receive_json_from()
+            self.assertEqual(message['payload']['data']['__schema']['queryType']['name'], 'Query')
+            self.assertEqual(await communicator.receive_json_from(), {'type': 'complete', 'id': '1'})
+            await communicator.disconnect()
+
+        with mock.patch('backend.routing.get_introspection', wraps=get_introspection) as introspection:
+            async_to_sync(run)()
+
+        introspection.assert_called_once()
+
+
+class PersistedQueryTest(TestCase):
+    def post(self, query):
+        extensions = {'persistedQuery': {'version': 1, 'sha256Hash': get_query_hash(query)}}
+        return self.client.post(
+            '/graphql/', json.dumps({'query': query, 'extensions': extensions}), content_type='application/json').json()
+
+    def test_valid_query_is_persisted(self):
+        self.post('{ relayAppointmentStates { edges { node { name } } } }')
+
+        self.assertEqual(PersistedQuery.objects.count(), 1)
+
+    def test_invalid_queries_are_not_persisted(self):
+        for query in ('{ relayAppointmentStates {', '{ unknownField }'):
+            with self.subTest(query=query):
+                self.assertTrue(self.post(query)['errors'])
+
+        self.assertFalse(PersistedQuery.objects.exists())
+
+    def test_oldest_queries_are_evicted(self):
+        queries = ['{ relayAppointmentStates { edges { node { %s } } } }' % fields for fields in ('id', 'name', 'id name')]
+
+        with mock.patch.object(settings, 'PERSISTED_QUERY_MAX_ROWS', 2):
+            for query in queries:
+                self.post(query)
+
+        self.assertEqual(set(PersistedQuery.objects.values_list('query', flat=True)), set(queries[1:]))
+
+    def test_long_query_is_not_persisted(self):
+        query = '{ __typename }' + ' ' * settings.PERSISTED_QUERY_MAX_LENGTH
+
+        self.assertEqual(self.post(query)['errors'][0]['message'], settings.PERSISTED_QUERY_TOO_LONG_ERROR)
+        self.assertFalse(PersistedQuery.objects.exists())
+
+
+class PooledPBKDF2PasswordHasherTest(SimpleTestCase):
+    def test_same_hashes_as_django(self):
+        encoded = PooledPBKDF2PasswordHasher().encode('password', 'salt', iterations=1000)
+
+        self.assertEqual(encoded, PBKDF2PasswordHasher().encode('password', 'salt', iterations=1000))
+        self.assertTrue(PooledPBKDF2PasswordHasher().verify('password', encoded))
+        self.assertFalse(PooledPBKDF2PasswordHasher().verify('other', encoded))
+
+    def test_busy_pool(self):
+        pool = mock.Mock()
+        slots = threading.BoundedSemaphore(1)
+        slots.acquire()
+
+        with mock.patch('backend.hashers._get_pool', return_value=(pool, slots)):
+            with self.assertRaisesMessage(Exception, settings.PASSWORD_HASHING_BUSY_ERROR):
+                PooledPBKDF2PasswordHasher().encode('password', 'salt')
+
+        pool.submit.assert_not_called()
+
+
+class SQLiteChannelLayerTest(SimpleTestCase):
+    # Run by another process: joins a group and prints the type of the first message it receives
+    RECEIVER = '''
+import asyncio, sys
+from backend.channel_layers import SQLiteChannelLayer
+
+async def main():
+    layer = SQLiteChannelLayer(sys.argv[1], poll_interval=0.01)
+    channel = await layer.new_channel()
+    await layer.group_add('test', channel)
+    print((await asyncio.wait_for(layer.receive(channel), 10))['type'])
+    await layer.close()
+
+asyncio.get_event_loop().run_until_complete(main())
+'''
+
+    def test_group_send_reaches_another_process(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'channels.sqlite3')
+            layer = SQLiteChannelLayer(path, poll_interval=0.01)
+            receiver = subprocess.Popen(
+                [sys.executable, '-c', self.RECEIVER, path], cwd=settings.BASE_DIR, stdout=subprocess.PIPE)
+            try:
+                # Sent until the receiver listens, as it only gets the messages sent after it started
+                deadline = time.time() + 10
+                while receiver.poll() is None and time.time() < deadline:
+                    async_to_sync(layer.group_send)('test', {'type': 'test.message'})
+                    time.sleep(0.1)
+                output, _ = receiver.communicate(timeout=10)
+            finally:
+                receiver.kill()
+
+        self.assertEqual(receiver.returncode, 0)
+        self.assertEqual(output.decode().strip(), 'test.message')
@@ -13,11 +13,12 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from backend.views import CostLimitedGraphQLView
+from dates.views import export_appointments
 from django.contrib import admin
 from django.urls import path, include
 from django.views.decorators.csrf import \
     csrf_exempt  # Only in development (new solution to disable CORS in development)
-from graphene_django.views import GraphQLView
 
 import django
 import pathlib
@@ -46,7 +47,10 @@ urlpatterns = [
 
     # Subscriptions doesn't work from this url
     # This url is used to get schema.graphql
-    # path('graphql/', GraphQLView.as_view(graphiql=True)), # Uncomment in real?
-    path('graphql/', csrf_exempt(GraphQLView.as_view(graphiql=True))),
-    # path('graphql/', GraphQLView.as_view(graphiql=True)),
+    # path('graphql/', CostLimitedGraphQLView.as_view(graphiql=True)), # Uncomment in real?
+    path('graphql/', csrf_exempt(CostLimitedGraphQLView.as_view(graphiql=True))),
+    # path('graphql/', CostLimitedGraphQLView.as_view(graphiql=True)),
+
+    # Streamed CSV or NDJSON, authenticated by the session or the JWT
+    path('export/appointments/', export_appointments),
 ]
@@ -0,0 +1,138 @@
+"""GraphQL view serving persisted queries, the introspection and the designated queries from memory, and rejecting
+the operations over the cost or depth budget before executing them."""
+from backend import response_cache, settings
+from backend.authentication import authenticate_request
+from backend.cost import get_query_cost
+from backend.documents import document_backend, get_persisted_query, get_persisted_query_hash, persist_query
+from backend.introspection import get_introspection, is_introspection
+from django.http import HttpResponseBadRequest
+from django.utils.cache import get_conditional_response
+from graphene_django.views import GraphQLView, HttpError
+from graphql.execution import ExecutionResult
+from graphql_jwt import middleware
+from graphql_jwt.settings import jwt_settings
+
+import json
+
+# Cost of the operation of a request, reported in the `extensions` of its response
+QUERY_COST_KEY = '_query_cost'
+# ETag of the introspection result of a request
+INTROSPECTION_ETAG_KEY = '_introspection_etag'
+# Whether the result of a request came from the response cache, when it can be cached
+RESPONSE_CACHE_HIT_KEY = '_response_cache_hit'
+
+
+class CostLimitedGraphQLView(GraphQLView):
+    """GraphQL view computing the cost of each operation from its document.
+
+    Documents are parsed and validated once (see backend/documents.py), and may be sent as the
+    hash of a persisted query. Operations over `settings.QUERY_MAX_COST` or
+    `settings.QUERY_MAX_DEPTH` are answered with an error without being executed. The cost of
+    the others is reported in `extensions.cost`. Introspection operations are executed once
+    and answered with an ETag (see backend/introspection.py), and the results of the designated
+    queries are cached (see backend/response_cache.py).
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        response = super().dispatch(request, *args, **kwargs)
+
+        etag = getattr(request, INTROSPECTION_ETAG_KEY, None)
+        if etag is not None and response.status_code == 200:
+            response['ETag'] = etag
+            # Not modified when the client sent the same ETag. POST requests cannot be revalidated
+            if request.method == 'GET':
+                response = get_conditional_response(request, etag=etag, response=response)
+
+        return response
+
+    def get_backend(self, request):
+        return document_backend
+
+    def execute_graphql_request(self, request, data, query, variables, operation_name, show_graphiql=False):
+        extensions = self.get_extensions(request, data)
+        try:
+            query_hash = get_persisted_query_hash(extensions)
+            if query_hash is not None:
+                if query:
+                    persist_query(self.schema, query_hash, query)
+                else:
+                    query = get_persisted_query(self.schema, query_hash)
+                    if query is None:
+                        # The client sends the query again with its hash
+                        return ExecutionResult(errors=[Exception(settings.PERSISTED_QUERY_NOT_FOUND_ERROR)])
+        except Exception as e:
+            return ExecutionResult(errors=[e], invalid=True)
+
+        if query:
+            try:
+                # Cached for the execution by super()
+                document = self.get_backend(request).document_from_string(self.schema, query)
+            except Exception as e:
+                return ExecutionResult(errors=[e], invalid=True)
+
+            query_cost = get_query_cost(self.schema, document.document_ast, operation_name, variables)
+            if query_cost is not None:
+                setattr(request, QUERY_COST_KEY, query_cost)
+                if query_cost.depth > settings.QUERY_MAX_DEPTH:
+                    return ExecutionResult(errors=[Exception(settings.QUERY_TOO_DEEP_ERROR)], invalid=True)
+                if query_cost.cost > settings.QUERY_MAX_COST:
+                    return ExecutionResult(errors=[Exception(settings.QUERY_TOO_COSTLY_ERROR)], invalid=True)
+
+            if not self.batch and is_introspection(document.document_ast, operation_name):
+                introspection = get_introspection(self.schema, query, operation_name, variables)
+                if introspection is not None:
+                    etag, result = introspection
+                    setattr(request, INTROSPECTION_ETAG_KEY, etag)
+                    return result
+
+            cache_key = None if self.batch else self.get_response_cache_key(request, document, operation_name, variables)
+            if cache_key is not None:
+                result = response_cache.get_result(cache_key)
+                setattr(request, RESPONSE_CACHE_HIT_KEY, result is not None)
+                if result is None:
+                    invalidations = response_cache.get_invalidations()
+                    result = super().execute_graphql_request(
+                        request, data, query, variables, operation_name, show_graphiql)
+                    response_cache.set_result(cache_key, result, invalidations)
+
+                return result
+
+        return super().execute_graphql_request(request, data, query, variables, operation_name, show_graphiql)
+
+    def get_response_cache_key(self, request, document, operation_name, variables):
+        try:
+            return response_cache.get_cache_key(
+                self.schema, document.document_ast, operation_name, variables, lambda: self.get_user(request))
+        except Exception:
+            # Reported by the execution
+            return None
+
+    @staticmethod
+    def get_user(request):
+        """Return the user of the JWT of `request`, like the middleware does for queries."""
+        if not jwt_settings.JWT_ALLOW_ARGUMENT and middleware._authenticate(request):
+            return authenticate_request(request) or request.user
+
+        return request.user
+
+    @staticmethod
+    def get_extensions(request, data):
+        extensions = request.GET.get('extensions') or data.get('extensions')
+        if extensions and isinstance(extensions, str):
+            try:
+                extensions = json.loads(extensions)
+            except ValueError:
+                raise HttpError(HttpResponseBadRequest('Extensions are invalid JSON.'))
+
+        return extensions if isinstance(extensions, dict) else None
+
+    def json_encode(self, request, d, pretty=False):
+        # Batched operations are encoded one by one, then the whole list
+        query_cost = request.__dict__.pop(QUERY_COST_KEY, None)
+        if query_cost is not None and isinstance(d, dict):
+            d = dict(d, extensions={'cost': query_cost.as_extension()})
+            cache_hit = request.__dict__.pop(RESPONSE_CACHE_HIT_KEY, None)
+            if cache_hit is not None:
+                d['extensions']['responseCache'] = dict(response_cache.get_stats(), hit=cache_hit)
+
+        return super().json_encode(request, d, pretty)
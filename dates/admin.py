@@ -3,9 +3,10 @@ from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as DjangoUserAdmin
 from django.utils.translation import ugettext_lazy as _
 
-from .models import Appointment, AppointmentState, User
+from .models import Appointment, AppointmentState, ChangeLogEntry, DailyAppointmentStats, OutboxEmail, PersistedQuery, User
+from .search import filter_users
 
-classes = [Appointment, AppointmentState]
+classes = [Appointment, AppointmentState, ChangeLogEntry, DailyAppointmentStats, OutboxEmail, PersistedQuery]
 
 for c in classes:
     admin.site.register(c)
@@ -32,5 +33,12 @@ class UserAdmin(DjangoUserAdmin):
         }),
     )
     list_display = ('email', 'first_name', 'last_name', 'is_vip', 'is_active', 'is_staff')
-    search_fields = ('email', 'first_name', 'last_name')
+    search_fields = ('email', 'first_name', 'last_name', 'phone_number')
     ordering = ('email',)
+
+    def get_search_results(self, request, queryset, search_term):
+        # Searched in the full-text index instead of scanning the columns of search_fields
+        if not search_term:
+            return queryset, False
+
+        return filter_users(queryset, search_term), False
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class DatesConfig(AppConfig):
     name = 'dates'
+
+    def ready(self):
+        # Keep the search index of the users, the daily stats of the appointments and the change log in sync
+        from . import changes, daily_stats, search  # noqa: F401
@@ -0,0 +1,87 @@
+"""Search the free appointment slots.
+
+The occupancy of every day is a bitmap with one bit per slot of `APPOINTMENT_DURATION`
+(bit 0 is the slot starting at the midnight of the shop), built from a single indexed range read of the
+appointment dates. Free runs of slots are then found with a few bitwise operations per day.
+"""
+from .models import Appointment
+from .shop_time import make_shop_aware, to_shop_time
+from backend import settings
+from collections import defaultdict
+
+import datetime
+import math
+
+DAY = datetime.timedelta(days=1)
+
+
+def get_available_slots(start, end, duration):
+    """Return the (start, end) pairs of the free slots of `duration` that fit within [start, end)."""
+    slot = settings.APPOINTMENT_DURATION
+    slots_count = math.ceil(duration / slot)
+
+    occupancy = defaultdict(int)
+    appointment_dates = Appointment.objects \
+        .filter(appointment_date__gt=start - slot, appointment_date__lt=end) \
+        .values_list('appointment_date', flat=True)
+    for appointment_date in appointment_dates:
+        day, offset = _split_local_datetime(appointment_date)
+        first_slot = offset // slot
+        last_slot = math.ceil((offset + slot) / slot) - 1
+        occupancy[day] |= ((1 << (last_slot - first_slot + 1)) - 1) << first_slot
+
+    opening_bitmaps = [_get_opening_bitmap(weekday) for weekday in range(7)]
+    available_slots = []
+    day = to_shop_time(start).date()
+    last_day = to_shop_time(end).date()
+    while day <= last_day:
+        free = opening_bitmaps[day.weekday()] & ~occupancy[day]
+        # Bit i stays set only if the slots i to i + slots_count - 1 are all free
+        runs = free
+        for shift in range(1, slots_count):
+            runs &= free >> shift
+
+        midnight = datetime.datetime.combine(day, datetime.time.min)
+        while runs:
+            index = (runs & -runs).bit_length() - 1
+            runs &= runs - 1
+
+            slot_start = make_shop_aware(midnight + index * slot)
+            slot_end = slot_start + duration
+            if start <= slot_start and slot_end <= end:
+                available_slots.append((slot_start, slot_end))
+
+        day += DAY
+
+    return available_slots
+
+
+def is_bookable_slot(value):
+    """Tell whether an appointment can start at `value`: the start of a slot within the opening hours."""
+    slot = settings.APPOINTMENT_DURATION
+    day, offset = _split_local_datetime(value)
+    if offset % slot:
+        return False
+
+    return bool(_get_opening_bitmap(day.weekday()) >> (offset // slot) & 1)
+
+
+def _split_local_datetime(value):
+    """Split `value` into its local date in the shop and the time elapsed since the local midnight."""
+    local_value = to_shop_time(value)
+
+    return local_value.date(), local_value - local_value.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _get_opening_bitmap(weekday):
+    """Return the bitmap of the slots that are entirely within the opening hours of `weekday`."""
+    slot = settings.APPOINTMENT_DURATION
+    bitmap = 0
+    for opening_time, closing_time in settings.OPENING_HOURS.get(weekday, []):
+        opening = datetime.timedelta(hours=opening_time.hour, minutes=opening_time.minute)
+        closing = datetime.timedelta(hours=closing_time.hour, minutes=closing_time.minute)
+        first_slot = math.ceil(opening / slot)
+        last_slot = closing // slot
+        bitmap |= ((1 << max(last_slot - first_slot, 0)) - 1) << first_slot
+
+    return bitmap
@@ -0,0 +1,77 @@
+"""Book, reschedule and cancel appointments without double booking.
+
+Every appointment takes one slot and `appointment_date` is unique, so the database itself
+rejects the second booking of a slot. Bookings never lock the table nor wait for each other:
+only the writers racing for the very same slot conflict, and all but one of them fail fast.
+Subscribers are notified once the transaction is committed.
+"""
+from .availability import is_bookable_slot
+from .models import Appointment, AppointmentState
+from .subscriptions import AppointmentActionEnum, OnAppointmentChange
+from backend import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+
+class BookingError(Exception):
+    """Raised with one of the error constants of settings when a slot cannot be booked."""
+
+
+def book_appointment(user, appointment_date, appointment_state=None):
+    """Create the appointment of `user` at `appointment_date`, in the default state if `appointment_state` is None."""
+    _check_slot(appointment_date)
+    if appointment_state is None:
+        # Only created for a valid booking
+        appointment_state, _ = AppointmentState.objects.get_or_create(name=settings.DEFAULT_APPOINTMENT_STATE_NAME)
+
+    appointment = Appointment(user=user, appointment_date=appointment_date, appointment_state=appointment_state)
+    _save_slot(appointment)
+    _broadcast_on_commit(AppointmentActionEnum.CREATE_APPOINTMENT, appointment)
+
+    return appointment
+
+
+def reschedule_appointment(appointment, appointment_date):
+    """Move `appointment` to `appointment_date`."""
+    previous_appointment_date = appointment.appointment_date
+    appointment.appointment_date = appointment_date
+    try:
+        _save_slot(appointment)
+    except BookingError:
+        appointment.appointment_date = previous_appointment_date
+        raise
+
+    _broadcast_on_commit(AppointmentActionEnum.RESCHEDULE_APPOINTMENT, appointment, previous_appointment_date)
+
+    return appointment
+
+
+def cancel_appointment(appointment):
+    """Delete `appointment`, releasing its slot."""
+    appointment_id = appointment.pk
+    appointment.delete()
+    # Keep the id so subscribers know which appointment was cancelled
+    appointment.pk = appointment_id
+    _broadcast_on_commit(AppointmentActionEnum.CANCEL_APPOINTMENT, appointment)
+
+    return appointment
+
+
+def _check_slot(appointment_date):
+    if appointment_date <= timezone.now() or not is_bookable_slot(appointment_date):
+        raise BookingError(settings.SLOT_NOT_VALID_ERROR)
+
+
+def _save_slot(appointment):
+    _check_slot(appointment.appointment_date)
+    try:
+        # The savepoint keeps the transaction of the caller usable after a conflict
+        with transaction.atomic():
+            appointment.save()
+    except IntegrityError:
+        raise BookingError(settings.SLOT_NOT_AVAILABLE_ERROR)
+
+
+def _broadcast_on_commit(action, appointment, previous_appointment_date=None):
+    transaction.on_commit(lambda: OnAppointmentChange.appointment_change(
+        action=action.value, appointment_node=appointment, previous_appointment_date=previous_appointment_date))
@@ -0,0 +1,135 @@
+"""Log the changes to the appointments, appointment states and users, for clients to catch up.
+
+Every committed save or delete appends a `ChangeLogEntry` with the kind and id of the object.
+Entries are appended after the commit, so their ids follow the commit order: a client that
+read the log up to an entry has seen every change committed before it. On PostgreSQL the
+appends take a lock on the table for that, only for the time of the insert.
+
+Entries older than `settings.CHANGE_LOG_RETENTION_DAYS` are deleted by the `prune_change_log`
+command, which records the last entry deleted in `ChangeLogStart`. Clients whose last entry
+was deleted must load everything again.
+"""
+from .models import Appointment, AppointmentState, ChangeLogEntry, ChangeLogStart
+from backend import settings
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+from graphql_relay.utils import base64, unbase64
+
+import datetime
+
+CHANGES_CURSOR_PREFIX = 'changes:'
+
+KINDS = {
+    Appointment: 'appointment',
+    AppointmentState: 'appointment_state',
+    get_user_model(): 'user',
+}
+# Fields of the users changed on their own by logins and tokens, which are not logged
+IGNORED_USER_FIELDS = frozenset(['last_login', 'password', 'last_token', 'is_used_last_token', 'normalized_email'])
+
+
+def encode_cursor(entry_id):
+    """Encode the id of an entry as an opaque cursor."""
+    return base64(CHANGES_CURSOR_PREFIX + str(entry_id))
+
+
+def decode_cursor(cursor):
+    """Return the id of the entry of `cursor`."""
+    try:
+        decoded_cursor = unbase64(cursor)
+        if not decoded_cursor.startswith(CHANGES_CURSOR_PREFIX):
+            raise ValueError()
+
+        entry_id = int(decoded_cursor[len(CHANGES_CURSOR_PREFIX):])
+        if entry_id < 0:
+            raise ValueError()
+    except Exception:
+        raise Exception(settings.INVALID_CURSOR_ERROR)
+
+    return entry_id
+
+
+def get_head():
+    """Return the id of the last entry of the log, the last one deleted if it is empty."""
+    last = ChangeLogEntry.objects.order_by('-pk').values_list('pk', flat=True).first()
+    return last or get_pruned_through()
+
+
+def get_changes_since(since, first):
+    """Return the last change of every object changed after the entry `since`, among the next `first` entries.
+
+    Return None when entries after `since` were pruned. Otherwise return the changes, the id of
+    the last entry read and whether there are more entries after it.
+    """
+    entries = list(ChangeLogEntry.objects.filter(pk__gt=since).order_by('pk')[:first + 1])
+    # Read after the entries, so a prune deleting some of them in the meantime is seen
+    if since < get_pruned_through():
+        return None
+
+    has_more = len(entries) > first
+    entries = entries[:first]
+
+    # Only the last change of an object tells how it is now
+    last_changes = {(entry.kind, entry.object_id): entry for entry in entries}
+    changes = sorted(last_changes.values(), key=lambda entry: entry.pk)
+
+    return changes, entries[-1].pk if entries else since, has_more
+
+
+def get_pruned_through():
+    """Return the id of the last entry deleted from the log, 0 if none was."""
+    pruned_through = ChangeLogStart.objects.values_list('pruned_through', flat=True).first()
+    return pruned_through or 0
+
+
+def prune(days):
+    """Delete the entries older than `days` days and return how many were deleted."""
+    limit = timezone.now() - datetime.timedelta(days=days)
+    last = ChangeLogEntry.objects.filter(created__lt=limit).order_by('-pk').values_list('pk', flat=True).first()
+    if last is None:
+        return 0
+
+    with transaction.atomic():
+        ChangeLogStart.objects.update_or_create(pk=1, defaults={'pruned_through': last})
+        # The range of ids is read through the primary key index
+        return ChangeLogEntry.objects.filter(pk__lte=last).delete()[0]
+
+
+def log_created(model, object_ids):
+    """Log the creation of the objects of `model` saved without signals, e.g. by `bulk_create()`."""
+    entries = [ChangeLogEntry(kind=KINDS[model], object_id=object_id) for object_id in object_ids]
+    if entries:
+        transaction.on_commit(lambda: _append(entries))
+
+
+@receiver(post_save, sender=Appointment)
+@receiver(post_save, sender=AppointmentState)
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def _log_saved(sender, instance, update_fields=None, **kwargs):
+    if sender is get_user_model() and update_fields and IGNORED_USER_FIELDS.issuperset(update_fields):
+        return
+
+    _log_on_commit(KINDS[sender], instance.pk, deleted=False)
+
+
+@receiver(post_delete, sender=Appointment)
+@receiver(post_delete, sender=AppointmentState)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def _log_deleted(sender, instance, **kwargs):
+    _log_on_commit(KINDS[sender], instance.pk, deleted=True)
+
+
+def _log_on_commit(kind, object_id, deleted):
+    transaction.on_commit(lambda: _append([ChangeLogEntry(kind=kind, object_id=object_id, deleted=deleted)]))
+
+
+def _append(entries):
+    with transaction.atomic():
+        if connection.vendor == 'postgresql':
+            # Ids are taken and committed in the same order. SQLite writes one transaction at a time
+            with connection.cursor() as cursor:
+                cursor.execute('LOCK TABLE {} IN SHARE ROW EXCLUSIVE MODE'.format(ChangeLogEntry._meta.db_table))
+        ChangeLogEntry.objects.bulk_create(entries)
@@ -0,0 +1,111 @@
+"""Count the appointments of every day by state, for the month calendar.
+
+`DailyAppointmentStats` holds one row per day and state. Saving or deleting an appointment
+updates the counts of its day and state in the same transaction, so the calendar of a month
+reads a few rows instead of the appointments. Appointments created by `bulk_create()` are
+counted with `count_created()`, other bulk changes that send no signals (`QuerySet.update()`,
+raw SQL) are caught up with `rebuild_stats()`.
+"""
+from .models import Appointment, DailyAppointmentStats
+from .shop_time import get_shop_date, get_shop_timezone
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F
+from django.db.models.functions import TruncDate
+from django.db.models.signals import post_delete, post_init, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+import collections
+
+# Attribute keeping the (appointment date, state id) an appointment was loaded or saved with
+SAVED_KEY = '_daily_stats_saved'
+
+
+def get_month_stats(first_day, last_day):
+    """Return the stats of the days from `first_day` to `last_day`, with their appointment state."""
+    return DailyAppointmentStats.objects \
+        .filter(day__gte=first_day, day__lte=last_day, count__gt=0) \
+        .select_related('appointment_state') \
+        .order_by('day', 'appointment_state_id')
+
+
+def rebuild_stats(batch_size=1000):
+    """Count the appointments of every day by state again."""
+    with transaction.atomic():
+        DailyAppointmentStats.objects.all().delete()
+        counts = Appointment.objects \
+            .annotate(day=TruncDate('appointment_date')) \
+            .values('day', 'appointment_state') \
+            .annotate(count=Count('id')) \
+            .order_by()
+        # Days of the shop, as the appointments are counted when saved. TruncDate uses the current time zone
+        with timezone.override(get_shop_timezone()):
+            DailyAppointmentStats.objects.bulk_create(
+                (DailyAppointmentStats(
+                    day=row['day'], appointment_state_id=row['appointment_state'], count=row['count'])
+                 for row in counts.iterator()),
+                batch_size=batch_size)
+
+
+def count_created(appointments):
+    """Count `appointments`, created without signals (e.g. by `bulk_create()`)."""
+    counts = collections.Counter(
+        (get_shop_date(appointment.appointment_date), appointment.appointment_state_id)
+        for appointment in appointments)
+    for (day, appointment_state_id), count in counts.items():
+        _add_to_day(day, appointment_state_id, count)
+
+
+@receiver(post_init, sender=Appointment)
+def _remember_loaded_appointment(instance, **kwargs):
+    # Read from __dict__, deferred fields must not be loaded here
+    values = instance.__dict__
+    setattr(instance, SAVED_KEY, (values.get('appointment_date'), values.get('appointment_state_id')))
+
+
+@receiver(pre_save, sender=Appointment)
+@receiver(pre_delete, sender=Appointment)
+def _load_saved_appointment(instance, **kwargs):
+    # Appointments loaded without their date or state count where the database has them
+    if instance.pk is not None and None in getattr(instance, SAVED_KEY):
+        saved = Appointment.objects.filter(pk=instance.pk).values_list('appointment_date', 'appointment_state').first()
+        setattr(instance, SAVED_KEY, saved or (None, None))
+
+
+@receiver(post_save, sender=Appointment)
+def _count_saved_appointment(instance, created, **kwargs):
+    saved = getattr(instance, SAVED_KEY)
+    current = (instance.appointment_date, instance.appointment_state_id)
+    if not created and saved == current:
+        return
+
+    if not created and None not in saved:
+        _add(saved, -1)
+    _add(current, 1)
+    setattr(instance, SAVED_KEY, current)
+
+
+@receiver(post_delete, sender=Appointment)
+def _count_deleted_appointment(instance, **kwargs):
+    saved = getattr(instance, SAVED_KEY)
+    if None not in saved:
+        _add(saved, -1)
+
+
+def _add(key, delta):
+    appointment_date, appointment_state_id = key
+    _add_to_day(get_shop_date(appointment_date), appointment_state_id, delta)
+
+
+def _add_to_day(day, appointment_state_id, delta):
+    lookup = {'day': day, 'appointment_state_id': appointment_state_id}
+    stats = DailyAppointmentStats.objects.filter(**lookup)
+    if stats.update(count=F('count') + delta) or delta < 0:
+        return
+
+    try:
+        # The savepoint keeps the transaction usable when another one created the row first
+        with transaction.atomic():
+            DailyAppointmentStats.objects.create(count=delta, **lookup)
+    except IntegrityError:
+        stats.update(count=F('count') + delta)
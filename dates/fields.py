@@ -0,0 +1,164 @@
+"""Declare custom GraphQL fields for dates app."""
+from backend import settings
+from backend.optimizer import require_fields
+from django.db.models import Q
+from functools import partial
+from graphene.relay import PageInfo
+from graphene_django.filter import DjangoFilterConnectionField
+from graphql_relay.connection.arrayconnection import cursor_to_offset
+from graphql_relay.utils import base64, unbase64
+from promise import Promise
+
+import json
+
+KEYSET_CURSOR_PREFIX = 'keyset:'
+
+
+def get_list_limit(args):
+    """Return how many rows from the start of a list the connection page of `args` needs.
+
+    The extra row after the page tells whether there is a next page. Return None when the
+    page cannot be known without the length of the list (`last` without `first` nor
+    `before`) or when the whole list is requested (no pagination arguments).
+    """
+    first = args.get('first')
+    before = cursor_to_offset(args['before']) if args.get('before') else None
+    after = cursor_to_offset(args['after']) if args.get('after') else None
+
+    limits = []
+    if first is not None:
+        limits.append((after + 1 if after is not None else 0) + first + 1)
+    if before is not None:
+        limits.append(before)
+
+    return min(limits) if limits else None
+
+
+class BatchedFilterConnectionField(DjangoFilterConnectionField):
+    """Filter connection field whose resolver may also return a DataLoader promise or a list.
+
+    Promises and lists hold rows already loaded in batch (by a DataLoader or a prefetch),
+    so they are paginated as they come instead of being filtered as a queryset.
+    """
+
+    @classmethod
+    def resolve_queryset(cls, connection, iterable, info, args, **kwargs):
+        if Promise.is_thenable(iterable) or isinstance(iterable, list):
+            return iterable
+
+        return super(BatchedFilterConnectionField, cls).resolve_queryset(connection, iterable, info, args, **kwargs)
+
+
+class KeysetFilterConnectionField(DjangoFilterConnectionField):
+    """Filter connection field paginated by keyset instead of OFFSET/LIMIT.
+
+    Rows are ordered by the `keyset` fields (the last one must be unique) and the cursors
+    encode the keyset of their row, so every page is a range read on those fields whatever
+    its depth, and inserting rows never shifts the pages already seen. No COUNT is run.
+    """
+
+    def __init__(self, type, keyset, *args, **kwargs):
+        self.keyset = tuple(keyset)
+        super(KeysetFilterConnectionField, self).__init__(type, *args, **kwargs)
+
+    def get_resolver(self, parent_resolver):
+        return partial(
+            self.keyset_connection_resolver,
+            parent_resolver,
+            self.connection_type,
+            self.get_manager(),
+            self.get_queryset_resolver(),
+            self.max_limit,
+            self.keyset,
+        )
+
+    @classmethod
+    def keyset_connection_resolver(
+            cls, resolver, connection, default_manager, queryset_resolver, max_limit, keyset, root, info, **args):
+        first = args.get('first')
+        last = args.get('last')
+
+        for name, limit in (('first', first), ('last', last)):
+            if max_limit and limit:
+                assert limit <= max_limit, (
+                    "Requesting {} records on the `{}` connection exceeds the `{}` limit of {} records."
+                ).format(limit, info.field_name, name, max_limit)
+
+        queryset = resolver(root, info, **args)
+        if queryset is None:
+            queryset = default_manager
+        queryset = require_fields(queryset_resolver(connection, queryset, info, args), *keyset)
+
+        if args.get('after'):
+            queryset = queryset.filter(cls.keyset_filter(queryset.model, keyset, args['after'], 'gt'))
+        if args.get('before'):
+            queryset = queryset.filter(cls.keyset_filter(queryset.model, keyset, args['before'], 'lt'))
+
+        has_previous_page = False
+        has_next_page = False
+        if last is not None and first is None:
+            # Read the page backwards from its end
+            nodes = cls.fetch(queryset.order_by(*('-' + name for name in keyset))[:last + 1])
+            has_previous_page = len(nodes) > last
+            nodes = nodes[:last][::-1]
+        else:
+            limit = first if first is not None else max_limit
+            nodes = cls.fetch(queryset.order_by(*keyset)[:limit + 1 if limit is not None else None])
+            if limit is not None:
+                has_next_page = len(nodes) > limit
+                nodes = nodes[:limit]
+            if last is not None:
+                has_previous_page = len(nodes) > last
+                nodes = nodes[len(nodes) - last:] if last else []
+
+        edges = [connection.Edge(node=node, cursor=cls.keyset_cursor(node, keyset)) for node in nodes]
+
+        return connection(
+            edges=edges,
+            page_info=PageInfo(
+                start_cursor=edges[0].cursor if edges else None,
+                end_cursor=edges[-1].cursor if edges else None,
+                has_previous_page=has_previous_page,
+                has_next_page=has_next_page,
+            ),
+        )
+
+    @staticmethod
+    def fetch(queryset):
+        """Return the rows of `queryset`, streamed from the database cursor when possible."""
+        if queryset._prefetch_related_lookups:
+            # Prefetches need the whole page loaded first
+            return list(queryset)
+
+        return list(queryset.iterator())
+
+    @staticmethod
+    def keyset_cursor(node, keyset):
+        """Encode the keyset of `node` as an opaque cursor."""
+        values = [node._meta.get_field(name).value_to_string(node) for name in keyset]
+
+        return base64(KEYSET_CURSOR_PREFIX + json.dumps(values))
+
+    @staticmethod
+    def keyset_filter(model, keyset, cursor, lookup):
+        """Build the filter of the rows placed after (`gt`) or before (`lt`) `cursor`."""
+        try:
+            decoded_cursor = unbase64(cursor)
+            if not decoded_cursor.startswith(KEYSET_CURSOR_PREFIX):
+                raise ValueError()
+
+            values = json.loads(decoded_cursor[len(KEYSET_CURSOR_PREFIX):])
+            if not isinstance(values, list) or len(values) != len(keyset):
+                raise ValueError()
+
+            values = [model._meta.get_field(name).to_python(value) for name, value in zip(keyset, values)]
+        except Exception:
+            raise Exception(settings.INVALID_CURSOR_ERROR)
+
+        # (a, b) > (x, y) <=> a > x OR (a = x AND b > y)
+        keyset_filter = Q()
+        for position, name in enumerate(keyset):
+            equal_fields = dict(zip(keyset[:position], values[:position]))
+            keyset_filter |= Q(**equal_fields, **{'{}__{}'.format(name, lookup): values[position]})
+
+        return keyset_filter
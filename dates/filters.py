@@ -0,0 +1,25 @@
+"""Declare the filtersets of the relay connections of dates app."""
+from .models import Appointment
+from .shop_time import make_shop_aware
+
+import datetime
+import django_filters
+
+
+class AppointmentFilter(django_filters.FilterSet):
+    # Filtered as a range of the whole day of the shop, so the indexes on appointment_date are used
+    day = django_filters.DateFilter(method='filter_day')
+
+    class Meta:
+        model = Appointment
+        fields = {
+            'user': ['exact'],
+            'appointment_date': ['exact', 'gte', 'lt'],
+            'appointment_state': ['exact'],
+        }
+
+    def filter_day(self, queryset, name, value):
+        day_start = make_shop_aware(datetime.datetime.combine(value, datetime.time.min))
+        day_end = make_shop_aware(datetime.datetime.combine(value + datetime.timedelta(days=1), datetime.time.min))
+
+        return queryset.filter(appointment_date__gte=day_start, appointment_date__lt=day_end)
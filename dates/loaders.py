@@ -0,0 +1,90 @@
+"""Declare the DataLoaders used to batch the relations of the relay nodes."""
+from collections import defaultdict
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+from django.http import HttpRequest
+from promise import Promise
+from promise.dataloader import DataLoader
+
+from .models import Appointment, AppointmentState
+
+
+class UserLoader(DataLoader):
+    """Load users by primary key."""
+
+    def batch_load_fn(self, keys):
+        users = get_user_model().objects.in_bulk(keys)
+        return Promise.resolve([users.get(key) for key in keys])
+
+
+class AppointmentStateLoader(DataLoader):
+    """Load appointment states by primary key."""
+
+    def batch_load_fn(self, keys):
+        appointment_states = AppointmentState.objects.in_bulk(keys)
+        return Promise.resolve([appointment_states.get(key) for key in keys])
+
+
+class AppointmentsByStateLoader(DataLoader):
+    """Load the appointments of each (appointment state primary key, limit), the first `limit` ones by primary key.
+
+    A None limit loads every appointment of the state.
+    """
+
+    def batch_load_fn(self, keys):
+        appointments_by_key = defaultdict(list)
+        # Usually one limit, shared by the states of a page
+        for limit in {limit for _, limit in keys}:
+            state_ids = [pk for pk, key_limit in keys if key_limit == limit]
+            appointments = Appointment.objects.filter(appointment_state__in=state_ids)
+            if limit is not None:
+                appointments = first_rows_by(appointments, 'appointment_state', limit)
+            for appointment in appointments.order_by('pk'):
+                appointments_by_key[(appointment.appointment_state_id, limit)].append(appointment)
+
+        return Promise.resolve([appointments_by_key[key] for key in keys])
+
+
+def first_rows_by(queryset, field_name, limit):
+    """Filter `queryset` to the first `limit` rows by primary key of every value of `field_name`.
+
+    The rows are numbered in the database (ROW_NUMBER() OVER (PARTITION BY ...)), so only
+    `limit` rows of each value are loaded.
+    """
+    numbered = queryset.annotate(
+        row_number=Window(RowNumber(), partition_by=[F(field_name)], order_by=F('pk').asc()),
+    ).values('pk', 'row_number')
+    sql, params = numbered.query.sql_with_params()
+    quote_name = connection.ops.quote_name
+    pk_column = quote_name(queryset.model._meta.pk.column)
+
+    # pk__in=RawSQL() would compile to `IN ((SELECT ...))`, which SQLite reads as the first id only
+    return queryset.extra(
+        where=['{}.{} IN (SELECT {} FROM ({}) numbered WHERE {} <= %s)'.format(
+            quote_name(queryset.model._meta.db_table), pk_column, pk_column, sql, quote_name('row_number'))],
+        params=list(params) + [limit])
+
+
+class DataLoaders:
+    """Group of DataLoaders shared by every resolver of an operation."""
+
+    def __init__(self, cache=True):
+        self.user = UserLoader(cache=cache)
+        self.appointment_state = AppointmentStateLoader(cache=cache)
+        self.appointments_by_state = AppointmentsByStateLoader(cache=cache)
+
+
+def get_loaders(info):
+    """Return the DataLoaders attached to `info.context`, creating them on first use."""
+    context = info.context
+    loaders = getattr(context, 'dataloaders', None)
+    if loaders is None:
+        # Websocket contexts live as long as the connection, so there the loaders
+        # only batch and never keep rows between operations
+        loaders = DataLoaders(cache=isinstance(context, HttpRequest))
+        context.dataloaders = loaders
+
+    return loaders
@@ -0,0 +1,83 @@
+"""Benchmark the indexed date-range filters of relay_appointments."""
+from backend import settings
+from dates.filters import AppointmentFilter
+from dates.models import Appointment, AppointmentState
+from dates.shop_time import get_shop_date, make_shop_aware
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+import datetime
+import random
+import time
+
+
+class Command(BaseCommand):
+    help = 'Fill a synthetic appointments table (rolled back at the end) and report the query plans ' \
+           'and timings of the relay_appointments filters.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000000, help='Number of synthetic appointments')
+        parser.add_argument('--users', type=int, default=1000, help='Number of synthetic users')
+        parser.add_argument('--batch-size', type=int, default=10000, help='Rows inserted per query')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            users, appointment_states, start = self.fill(options['rows'], options['users'], options['batch_size'])
+
+            day = get_shop_date(start + datetime.timedelta(days=180))
+            week_start = make_shop_aware(datetime.datetime.combine(day, datetime.time.min))
+            week_end = week_start + datetime.timedelta(days=7)
+            filters = [
+                ('Week', {'appointment_date__gte': week_start, 'appointment_date__lt': week_end}),
+                ('Day', {'day': day}),
+                ('User and week', {'user': users[0].pk,
+                                   'appointment_date__gte': week_start, 'appointment_date__lt': week_end}),
+                ('State and day', {'appointment_state': appointment_states[0].pk, 'day': day}),
+            ]
+            for name, data in filters:
+                self.benchmark(name, AppointmentFilter(data=data, queryset=Appointment.objects.all()).qs)
+
+            transaction.set_rollback(True)
+
+    def fill(self, rows, users_count, batch_size):
+        self.stdout.write('Inserting {} users and {} appointments...'.format(users_count, rows))
+        get_user_model().objects.bulk_create(
+            [get_user_model()(email='user-{0}@benchmark.invalid'.format(i),
+                              normalized_email='user-{0}@benchmark.invalid'.format(i),
+                              password='!') for i in range(users_count)],
+            batch_size=batch_size)
+        # bulk_create does not set the primary keys on every database backend
+        users = list(get_user_model().objects.filter(email__endswith='@benchmark.invalid'))
+        appointment_states = [AppointmentState.objects.create(name=name) for name in ('Pending', 'Done', 'Cancelled')]
+
+        # Appointments in distinct slots (appointment_date is unique) along three years, or more if
+        # there are more rows than slots
+        start = timezone.now().replace(minute=0, second=0, microsecond=0) - datetime.timedelta(days=365)
+        slots = max(datetime.timedelta(days=3 * 365) // settings.APPOINTMENT_DURATION, rows)
+        randomizer = random.Random(0)
+        slot_numbers = randomizer.sample(range(slots), rows)
+        for offset in range(0, rows, batch_size):
+            Appointment.objects.bulk_create([
+                Appointment(
+                    user=randomizer.choice(users),
+                    appointment_state=randomizer.choice(appointment_states),
+                    appointment_date=start + slot_number * settings.APPOINTMENT_DURATION)
+                for slot_number in slot_numbers[offset:offset + batch_size]
+            ])
+
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+        return users, appointment_states, start
+
+    def benchmark(self, name, queryset):
+        self.stdout.write(self.style.MIGRATE_HEADING(name))
+        self.stdout.write(queryset.order_by('appointment_date', 'id').explain())
+
+        begin = time.perf_counter()
+        count = queryset.count()
+        page = list(queryset.order_by('appointment_date', 'id')[:100])
+        elapsed = time.perf_counter() - begin
+        self.stdout.write('{} rows, first page of {} in {:.2f} ms'.format(count, len(page), elapsed * 1000))
@@ -0,0 +1,106 @@
+"""Benchmark the booking engine with many concurrent writers on the same day."""
+from backend import settings
+from backend.broadcast import broadcasts_disabled
+from concurrent.futures import ThreadPoolExecutor
+from dates.availability import get_available_slots
+from dates.booking import BookingError, book_appointment
+from dates.changes import KINDS
+from dates.models import Appointment, AppointmentState, ChangeLogEntry
+from dates.shop_time import get_shop_date, make_shop_aware
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, connection, transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+
+import datetime
+import random
+import time
+
+
+class Command(BaseCommand):
+    help = 'Book the slots of one day from many concurrent writers and report the throughput, ' \
+           'the conflicts and the double bookings. Nothing is broadcast to the subscribers, and the data ' \
+           'created is deleted at the end with its change log entries.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=16, help='Number of concurrent writers')
+        parser.add_argument('--attempts', type=int, default=50, help='Bookings attempted by every writer')
+
+    def handle(self, *args, **options):
+        # A far away opening day, so no real appointment is touched
+        day = get_shop_date(timezone.now()) + datetime.timedelta(days=3650)
+        while not settings.OPENING_HOURS.get(day.weekday()):
+            day += datetime.timedelta(days=1)
+        day_start = make_shop_aware(datetime.datetime.combine(day, datetime.time.min))
+        day_end = day_start + datetime.timedelta(days=1)
+        slots = [start for start, _ in get_available_slots(day_start, day_end, settings.APPOINTMENT_DURATION)]
+
+        # The writers commit on their own connections, so the data cannot be rolled back
+        with broadcasts_disabled():
+            users = [get_user_model().objects.create(email='writer-{}@benchmark.invalid'.format(i), password='!')
+                     for i in range(options['writers'])]
+            appointment_state = AppointmentState.objects.create(name='Benchmark')
+            try:
+                self.benchmark(users, appointment_state, slots, day_start, day_end, options['attempts'])
+            finally:
+                self.clean_up(users, appointment_state)
+
+    def benchmark(self, users, appointment_state, slots, day_start, day_end, attempts):
+        self.stdout.write('{} writers racing for {} slots on {}...'.format(len(users), len(slots), day_start.date()))
+        begin = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=len(users)) as executor:
+            results = list(executor.map(lambda user: self.write(user, appointment_state, slots, attempts), users))
+        elapsed = time.perf_counter() - begin
+
+        booked = sum(result['booked'] for result in results)
+        conflicts = sum(result['conflicts'] for result in results)
+        errors = sum(result['errors'] for result in results)
+        latencies = sorted(latency for result in results for latency in result['latencies'])
+        appointments = Appointment.objects.filter(appointment_date__gte=day_start, appointment_date__lt=day_end)
+        double_bookings = appointments.values('appointment_date').annotate(count=Count('id')) \
+            .filter(count__gt=1).count()
+
+        self.stdout.write('{} attempts in {:.2f} s ({:.0f} attempts/s)'.format(
+            len(latencies), elapsed, len(latencies) / elapsed))
+        self.stdout.write('Booked: {}, conflicts: {}, database errors: {}'.format(booked, conflicts, errors))
+        self.stdout.write('Latency p50: {:.2f} ms, p99: {:.2f} ms'.format(
+            latencies[len(latencies) // 2] * 1000, latencies[int(len(latencies) * 0.99)] * 1000))
+        style = self.style.SUCCESS if double_bookings == 0 and booked == appointments.count() else self.style.ERROR
+        self.stdout.write(style('Double bookings: {}'.format(double_bookings)))
+
+    def clean_up(self, users, appointment_state):
+        user_ids = [user.pk for user in users]
+        appointment_state_id = appointment_state.pk
+        appointment_ids = list(appointment_state.appointments.values_list('pk', flat=True))
+        with transaction.atomic():
+            # The daily stats of the appointments go with their state
+            get_user_model().objects.filter(pk__in=user_ids).delete()
+            appointment_state.delete()
+
+        # Logged once the deletions are committed
+        ChangeLogEntry.objects.filter(
+            Q(kind=KINDS[get_user_model()], object_id__in=user_ids)
+            | Q(kind=KINDS[Appointment], object_id__in=appointment_ids)
+            | Q(kind=KINDS[AppointmentState], object_id=appointment_state_id)
+        ).delete()
+
+    def write(self, user, appointment_state, slots, attempts):
+        result = {'booked': 0, 'conflicts': 0, 'errors': 0, 'latencies': []}
+        randomizer = random.Random(user.pk)
+        try:
+            for _ in range(attempts):
+                begin = time.perf_counter()
+                try:
+                    book_appointment(user, randomizer.choice(slots), appointment_state)
+                    result['booked'] += 1
+                except BookingError:
+                    result['conflicts'] += 1
+                except DatabaseError:
+                    # SQLite serializes the writers and may time out waiting for its lock
+                    result['errors'] += 1
+                result['latencies'].append(time.perf_counter() - begin)
+        finally:
+            connection.close()
+
+        return result
@@ -0,0 +1,57 @@
+"""Benchmark the case insensitive email lookups of the users."""
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+import random
+import time
+
+
+class Command(BaseCommand):
+    help = 'Fill a synthetic users table (rolled back at the end) and report the query plans and timings ' \
+           'of email__iexact lookups and of lookups by the normalized email.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000000, help='Number of synthetic users')
+        parser.add_argument('--lookups', type=int, default=100, help='Lookups timed by every method')
+        parser.add_argument('--batch-size', type=int, default=10000, help='Rows inserted per query')
+
+    def handle(self, *args, **options):
+        users = get_user_model().objects
+        with transaction.atomic():
+            self.fill(options['users'], options['batch_size'])
+
+            randomizer = random.Random(0)
+            # Mixed case, as typed by the users
+            emails = ['User-{}@Benchmark.invalid'.format(randomizer.randrange(options['users']))
+                      for _ in range(options['lookups'])]
+            self.benchmark('email__iexact', lambda email: users.filter(email__iexact=email), emails)
+            self.benchmark('normalized_email', users.filter_by_email, emails)
+
+            transaction.set_rollback(True)
+
+    def fill(self, users_count, batch_size):
+        self.stdout.write('Inserting {} users...'.format(users_count))
+        for offset in range(0, users_count, batch_size):
+            get_user_model().objects.bulk_create([
+                get_user_model()(email='user-{}@benchmark.invalid'.format(i),
+                                 normalized_email='user-{}@benchmark.invalid'.format(i),
+                                 password='!')
+                for i in range(offset, min(offset + batch_size, users_count))
+            ])
+
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def benchmark(self, name, lookup, emails):
+        self.stdout.write(self.style.MIGRATE_HEADING(name))
+        self.stdout.write(lookup(emails[0]).explain())
+
+        latencies = []
+        for email in emails:
+            begin = time.perf_counter()
+            assert lookup(email).exists()
+            latencies.append(time.perf_counter() - begin)
+        latencies.sort()
+        self.stdout.write('{} lookups, p50: {:.2f} ms, p99: {:.2f} ms'.format(
+            len(latencies), latencies[len(latencies) // 2] * 1000, latencies[int(len(latencies) * 0.99)] * 1000))
@@ -0,0 +1,82 @@
+"""Benchmark the parsing and validation of the GraphQL documents, with and without the document cache."""
+from backend.documents import CachedDocumentBackend, get_query_hash
+from backend.schema import graphql_schema
+from django.core.management.base import BaseCommand
+from graphql.language.base import parse
+from graphql.validation import validate
+
+import json
+import time
+
+# Operations as sent by the frontend
+OPERATIONS = {
+    'me': '''
+query Me {
+  me { id email firstName lastName phoneNumber isVip }
+}
+''',
+    'appointments': '''
+query Appointments($first: Int, $after: String, $from: DateTime, $to: DateTime) {
+  relayAppointmentsKeyset(first: $first, after: $after, appointmentDate_Gte: $from, appointmentDate_Lt: $to) {
+    pageInfo { hasNextPage endCursor }
+    edges {
+      node {
+        ...AppointmentFields
+        user { id email firstName lastName phoneNumber }
+      }
+    }
+  }
+}
+
+fragment AppointmentFields on AppointmentNode {
+  id
+  appointmentDate
+  appointmentState { id name }
+}
+''',
+    'availableSlots': '''
+query AvailableSlots($from: DateTime!, $to: DateTime!, $duration: Int) {
+  availableSlots(from: $from, to: $to, duration: $duration) { start end }
+}
+''',
+    'login': '''
+mutation Login($email: String!, $password: String!) {
+  tokenAuth(input: {email: $email, password: $password}) { token }
+}
+''',
+}
+
+
+class Command(BaseCommand):
+    help = 'Parse and validate the usual operations of the frontend on every request, as graphql-core does, then ' \
+           'through the document cache, and report the latencies and the request sizes with persisted queries.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=1000, help='Requests timed for every operation')
+
+    def handle(self, *args, **options):
+        self.benchmark('parse + validate', lambda query: validate(graphql_schema, parse(query)), options['requests'])
+
+        backend = CachedDocumentBackend()
+        for query in OPERATIONS.values():
+            backend.document_from_string(graphql_schema, query)
+        self.benchmark('cached document',
+                       lambda query: backend.document_from_string(graphql_schema, query), options['requests'])
+
+        self.stdout.write(self.style.MIGRATE_HEADING('request body sizes'))
+        for name, query in OPERATIONS.items():
+            persisted = {'persistedQuery': {'version': 1, 'sha256Hash': get_query_hash(query)}}
+            self.stdout.write('{}: {} bytes, persisted: {} bytes'.format(
+                name, len(json.dumps({'query': query})), len(json.dumps({'extensions': persisted}))))
+
+    def benchmark(self, name, prepare, requests):
+        self.stdout.write(self.style.MIGRATE_HEADING(name))
+        for operation, query in OPERATIONS.items():
+            latencies = []
+            for _ in range(requests):
+                begin = time.perf_counter()
+                prepare(query)
+                latencies.append(time.perf_counter() - begin)
+            latencies.sort()
+            self.stdout.write('{}: p50: {:.3f} ms, p99: {:.3f} ms'.format(
+                operation, latencies[len(latencies) // 2] * 1000, latencies[int(len(latencies) * 0.99)] * 1000))
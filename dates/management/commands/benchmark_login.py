@@ -0,0 +1,100 @@
+"""Benchmark concurrent logins, and the other requests served meanwhile, through the ASGI application."""
+from backend import settings
+from backend.routing import application
+from channels.http import AsgiHandler
+from channels.routing import ProtocolTypeRouter
+from channels.testing import HttpCommunicator
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+import asyncio
+import json
+import time
+
+LOGIN_MUTATION = '''
+mutation Login($email: String!, $password: String!) {
+  tokenAuth(input: {email: $email, password: $password}) { token }
+}
+'''
+PASSWORD = 'Benchmark1'
+
+
+class Command(BaseCommand):
+    help = 'Log in from many concurrent clients while another client runs a light query every 50 ms, and report the ' \
+           'throughput and latencies of both. --inline hashes in the request threads, as Django does, to compare.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=16, help='Number of concurrent login clients')
+        parser.add_argument('--logins', type=int, default=10, help='Logins made by every client')
+        parser.add_argument('--inline', action='store_true',
+                            help="Use Django's hasher and request handler instead of the pooled ones")
+
+    def handle(self, *args, **options):
+        if options['inline']:
+            hashers = ['django.contrib.auth.hashers.PBKDF2PasswordHasher'] + settings.PASSWORD_HASHERS[1:]
+            with override_settings(PASSWORD_HASHERS=hashers):
+                self.benchmark(ProtocolTypeRouter({'http': AsgiHandler}), options)
+        else:
+            self.benchmark(application, options)
+
+    def benchmark(self, app, options):
+        email = 'login@benchmark.invalid'
+        user = get_user_model()(email=email, is_active=True)
+        user.set_password(PASSWORD)
+        user.save()
+        try:
+            self.stdout.write('{} clients logging in {} times each...'.format(options['clients'], options['logins']))
+            logins, queries, elapsed = asyncio.get_event_loop().run_until_complete(
+                self.run(app, email, options['clients'], options['logins']))
+        finally:
+            user.delete()
+
+        latencies = sorted(latency for latency, ok in logins if ok)
+        rejected = sum(1 for _, ok in logins if not ok)
+        self.stdout.write('{} logins in {:.2f} s ({:.1f} logins/s), {} rejected'.format(
+            len(latencies), elapsed, len(latencies) / elapsed, rejected))
+        if latencies:
+            self.stdout.write('Login latency p50: {:.0f} ms, p99: {:.0f} ms'.format(
+                latencies[len(latencies) // 2] * 1000, latencies[int(len(latencies) * 0.99)] * 1000))
+        queries.sort()
+        self.stdout.write('{} other queries meanwhile, latency p50: {:.0f} ms, p99: {:.0f} ms'.format(
+            len(queries), queries[len(queries) // 2] * 1000, queries[int(len(queries) * 0.99)] * 1000))
+
+    async def run(self, app, email, clients, logins):
+        done = asyncio.Event()
+
+        async def log_in():
+            results = []
+            for _ in range(logins):
+                begin = time.perf_counter()
+                response = await self.post(app, LOGIN_MUTATION, {'email': email, 'password': PASSWORD})
+                token = ((response.get('data') or {}).get('tokenAuth') or {}).get('token')
+                results.append((time.perf_counter() - begin, token is not None))
+            return results
+
+        async def query():
+            latencies = []
+            while not done.is_set() or not latencies:
+                begin = time.perf_counter()
+                await self.post(app, '{ __typename }')
+                latencies.append(time.perf_counter() - begin)
+                await asyncio.sleep(0.05)
+            return latencies
+
+        begin = time.perf_counter()
+        querying = asyncio.ensure_future(query())
+        results = await asyncio.gather(*(log_in() for _ in range(clients)))
+        elapsed = time.perf_counter() - begin
+        done.set()
+
+        return [result for client_results in results for result in client_results], await querying, elapsed
+
+    @staticmethod
+    async def post(app, query, variables=None):
+        communicator = HttpCommunicator(
+            app, 'POST', '/graphql/', body=json.dumps({'query': query, 'variables': variables}).encode(),
+            headers=[(b'host', b'localhost'), (b'content-type', b'application/json')])
+        response = await communicator.get_response(timeout=600)
+
+        return json.loads(response['body'].decode())
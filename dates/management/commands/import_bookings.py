@@ -0,0 +1,232 @@
+"""Import the customers and appointments of a CSV file."""
+from backend import settings
+from dates.changes import log_created
+from dates.daily_stats import count_created
+from dates.models import Appointment, AppointmentState, UserManager
+from dates.phones import get_national_number, normalize_phone_number
+from dates.search import index_users
+from dates.shop_time import make_shop_aware
+from dates.views import FORMULA_ESCAPE, FORMULA_PREFIXES
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+import csv
+import re
+import time
+
+# Columns of the CSV file, the same as the appointment export (see dates/views.py)
+EMAIL_COLUMN = 'user_email'
+FIRST_NAME_COLUMN = 'user_first_name'
+LAST_NAME_COLUMN = 'user_last_name'
+PHONE_NUMBER_COLUMN = 'user_phone_number'
+APPOINTMENT_DATE_COLUMN = 'appointment_date'
+APPOINTMENT_STATE_COLUMN = 'appointment_state'
+
+
+class Command(BaseCommand):
+    help = 'Import the customers and appointments of a CSV file with the columns user_email, user_first_name, ' \
+           'user_last_name, user_phone_number, appointment_date (ISO 8601, the local time of the shop without ' \
+           'offset) and appointment_state (name). Rows without appointment_date only import the customer. ' \
+           'Customers are found by email or created without password, so they set one by resetting it. Rows ' \
+           'are validated and inserted in batches, one transaction each, and the rejected rows are reported ' \
+           'with their error.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('file', help='CSV file')
+        parser.add_argument('--batch-size', type=int, default=500, help='Rows validated and inserted per transaction')
+
+    def handle(self, *args, **options):
+        # Names are looked up once, not per row
+        self.states = {name.lower(): pk for pk, name in AppointmentState.objects.values_list('pk', 'name')}
+        self.email_pattern = re.compile(settings.EMAIL_REGEX_PATTERN)
+        self.verbosity = options['verbosity']
+        self.users_created = 0
+        self.appointments_created = 0
+        self.rejected = 0
+
+        start = time.time()
+        rows = 0
+        with self.open(options['file']) as csv_file:
+            reader = csv.DictReader(csv_file)
+            missing = {EMAIL_COLUMN, APPOINTMENT_DATE_COLUMN, APPOINTMENT_STATE_COLUMN} - set(reader.fieldnames or [])
+            if missing:
+                raise CommandError('Missing columns: {}'.format(', '.join(sorted(missing))))
+
+            batch = []
+            # Line 1 is the header
+            for line, row in enumerate(reader, 2):
+                batch.append((line, row))
+                if len(batch) >= options['batch_size']:
+                    rows += self.import_batch(batch)
+                    batch = []
+                    self.report_progress(rows, start)
+            rows += self.import_batch(batch)
+
+        elapsed = time.time() - start
+        self.stdout.write('{} rows in {:.1f}s ({:.0f} rows/s): {} customers and {} appointments created, {} rows '
+                          'rejected'.format(rows, elapsed, rows / elapsed if elapsed else 0, self.users_created,
+                                            self.appointments_created, self.rejected))
+
+    @staticmethod
+    def open(path):
+        try:
+            # Read line by line, the file is never loaded whole
+            return open(path, encoding='utf-8-sig', newline='')
+        except OSError as e:
+            raise CommandError(e)
+
+    def import_batch(self, batch):
+        """Import the rows of `batch`, a list of (line number, row), and return how many there were."""
+        valid = []
+        rejected = []
+        for line, row in batch:
+            error, values = self.validate(row)
+            if error is None:
+                valid.append((line, values))
+            else:
+                rejected.append((line, error))
+
+        try:
+            with transaction.atomic():
+                users_created, appointments_created, taken_lines = self.insert(valid)
+        except IntegrityError as e:
+            # A customer or appointment was created meanwhile, nothing of the batch was inserted
+            rejected.extend((line, e) for line, _ in valid)
+        else:
+            self.users_created += users_created
+            self.appointments_created += appointments_created
+            rejected.extend((line, settings.SLOT_NOT_AVAILABLE_ERROR) for line in taken_lines)
+
+        self.rejected += len(rejected)
+        for line, error in sorted(rejected, key=lambda rejection: rejection[0]):
+            self.stdout.write(self.style.WARNING('Line {}: {}'.format(line, error)))
+
+        return len(batch)
+
+    def validate(self, row):
+        """Return the error of `row`, or None and its cleaned values."""
+        email = _get_cell(row, EMAIL_COLUMN).lower()
+        if not email:
+            return settings.EMAIL_REQUIRED_ERROR, None
+        if self.email_pattern.match(email) is None:
+            return settings.EMAIL_REGEX_ERROR, None
+
+        phone_number = _get_cell(row, PHONE_NUMBER_COLUMN) or None
+        if phone_number is not None:
+            phone_number = normalize_phone_number(phone_number)
+            if phone_number is None:
+                return settings.PHONE_NUMBER_NOT_VALID_ERROR, None
+
+        appointment_date = _get_cell(row, APPOINTMENT_DATE_COLUMN) or None
+        appointment_state_id = None
+        if appointment_date is not None:
+            try:
+                appointment_date = parse_datetime(appointment_date)
+            except ValueError:
+                appointment_date = None
+            if appointment_date is None:
+                return settings.APPOINTMENT_DATE_NOT_VALID_ERROR, None
+            if timezone.is_naive(appointment_date):
+                # Local time of the shop
+                appointment_date = make_shop_aware(appointment_date)
+
+            appointment_state_id = self.states.get(_get_cell(row, APPOINTMENT_STATE_COLUMN).lower())
+            if appointment_state_id is None:
+                return settings.APPOINTMENT_STATE_DOES_NOT_EXIST_ERROR, None
+
+        values = {
+            'email': email,
+            'first_name': _get_cell(row, FIRST_NAME_COLUMN),
+            'last_name': _get_cell(row, LAST_NAME_COLUMN),
+            'phone_number': phone_number,
+            'appointment_date': appointment_date,
+            'appointment_state_id': appointment_state_id,
+        }
+        # PostgreSQL would fail the whole batch
+        for name in ('email', 'first_name', 'last_name'):
+            if len(values[name]) > get_user_model()._meta.get_field(name).max_length:
+                return settings.VALUE_TOO_LONG_ERROR, None
+
+        return None, values
+
+    def insert(self, valid):
+        """Create the customers and appointments of the validated rows, a list of (line number, values).
+
+        Return the number of customers and appointments created, and the lines of the rows whose
+        slot was taken, which are not imported.
+        """
+        User = get_user_model()
+
+        # Every appointment takes its slot
+        dates = {values['appointment_date'] for _, values in valid if values['appointment_date'] is not None}
+        taken = set(Appointment.objects.filter(appointment_date__in=dates).values_list('appointment_date', flat=True))
+        accepted = []
+        taken_lines = []
+        for line, values in valid:
+            if values['appointment_date'] is None:
+                accepted.append(values)
+            elif values['appointment_date'] in taken:
+                taken_lines.append(line)
+            else:
+                taken.add(values['appointment_date'])
+                accepted.append(values)
+
+        # Customers: the ones already registered are kept as they are, the first row of the others is created
+        normalized_emails = {UserManager.normalize_email_key(values['email']) for values in accepted}
+        users = User.objects.filter(normalized_email__in=normalized_emails)
+        user_ids = dict(users.values_list('normalized_email', 'pk'))
+        new_users = {}
+        for values in accepted:
+            normalized_email = UserManager.normalize_email_key(values['email'])
+            if normalized_email not in user_ids and normalized_email not in new_users:
+                user = User(
+                    email=values['email'],
+                    normalized_email=normalized_email,
+                    first_name=values['first_name'],
+                    last_name=values['last_name'],
+                    phone_number=values['phone_number'],
+                    national_phone_number=get_national_number(values['phone_number']))
+                # No password hashing, the customers set their password by resetting it
+                user.set_unusable_password()
+                new_users[normalized_email] = user
+
+        if new_users:
+            User.objects.bulk_create(new_users.values())
+            # SQLite does not return the ids of bulk_create()
+            created = dict(User.objects.filter(normalized_email__in=new_users).values_list('normalized_email', 'pk'))
+            user_ids.update(created)
+            # bulk_create() sends no signals: the changes, search index and daily stats are updated here
+            log_created(User, created.values())
+            index_users(created.values())
+
+        new_appointments = [
+            Appointment(
+                user_id=user_ids[UserManager.normalize_email_key(values['email'])],
+                appointment_date=values['appointment_date'],
+                appointment_state_id=values['appointment_state_id'])
+            for values in accepted if values['appointment_date'] is not None
+        ]
+        if new_appointments:
+            Appointment.objects.bulk_create(new_appointments)
+            log_created(Appointment, Appointment.objects.filter(
+                appointment_date__in=[appointment.appointment_date for appointment in new_appointments],
+            ).values_list('pk', flat=True))
+            count_created(new_appointments)
+
+        return len(new_users), len(new_appointments), taken_lines
+
+    def report_progress(self, rows, start):
+        if self.verbosity > 1:
+            self.stdout.write('{} rows ({:.0f} rows/s)'.format(rows, rows / (time.time() - start)))
+
+
+def _get_cell(row, column):
+    # The formulas escaped by the export are read back as they were
+    value = (row.get(column) or '').strip()
+    if value.startswith(FORMULA_ESCAPE) and value[len(FORMULA_ESCAPE):].startswith(FORMULA_PREFIXES):
+        value = value[len(FORMULA_ESCAPE):]
+
+    return value
@@ -0,0 +1,44 @@
+"""Normalize the phone numbers of the existing users to E.164."""
+from dates.phones import get_national_number, normalize_phone_number
+from dates.search import rebuild_index
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Normalize the phone numbers of the users to E.164 in batches. Invalid numbers are kept and reported.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Users read and updated per query')
+
+    def handle(self, *args, **options):
+        users = get_user_model().objects.exclude(phone_number=None).order_by('pk').only('pk', 'phone_number', 'national_phone_number')
+        last_pk = 0
+        updated = 0
+        invalid = []
+        while True:
+            batch = list(users.filter(pk__gt=last_pk)[:options['batch_size']])
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+
+            changed = []
+            for user in batch:
+                phone_number = normalize_phone_number(user.phone_number)
+                if phone_number is None:
+                    invalid.append(user)
+                elif phone_number != user.phone_number or user.national_phone_number is None:
+                    user.phone_number = phone_number
+                    user.national_phone_number = get_national_number(phone_number)
+                    changed.append(user)
+
+            get_user_model().objects.bulk_update(changed, ['phone_number', 'national_phone_number'])
+            updated += len(changed)
+
+        if updated:
+            # bulk_update() does not update the search index
+            rebuild_index()
+
+        self.stdout.write('{} phone numbers normalized'.format(updated))
+        for user in invalid:
+            self.stdout.write(self.style.WARNING('User {}: invalid phone number {!r}'.format(user.pk, user.phone_number)))
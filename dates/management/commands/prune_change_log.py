@@ -0,0 +1,16 @@
+"""Delete the old entries of the change log."""
+from backend import settings
+from dates.changes import prune
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Delete the entries of the change log older than the retention. Clients whose cursor was deleted get ' \
+           'ChangesExpiredError from changesSince and must load everything again.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.CHANGE_LOG_RETENTION_DAYS,
+                            help='Days the entries are kept')
+
+    def handle(self, *args, **options):
+        self.stdout.write('Change log entries deleted: {}'.format(prune(options['days'])))
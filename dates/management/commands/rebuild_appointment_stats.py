@@ -0,0 +1,16 @@
+"""Count the appointments of every day by state again."""
+from dates.daily_stats import rebuild_stats
+from dates.models import DailyAppointmentStats
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Count the appointments of every day by state again, e.g. after appointments were changed by bulk ' \
+           'updates, which do not update the daily stats.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows inserted per query')
+
+    def handle(self, *args, **options):
+        rebuild_stats(options['batch_size'])
+        self.stdout.write('Daily appointment stats rebuilt: {} rows'.format(DailyAppointmentStats.objects.count()))
@@ -0,0 +1,12 @@
+"""Index the text of all the users again."""
+from dates.search import rebuild_index
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Index the text of all the users again, e.g. after users were changed by bulk updates, ' \
+           'which do not update the search index.'
+
+    def handle(self, *args, **options):
+        rebuild_index()
+        self.stdout.write('Search index rebuilt')
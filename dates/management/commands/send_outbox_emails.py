@@ -0,0 +1,28 @@
+"""Send the emails queued in the outbox."""
+from dates.outbox import send_due_emails, send_emails_forever
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Send the emails queued in the outbox, forever or only the ones already due (--once). ' \
+           'Run it as a worker process when OUTBOX_SEND_IN_BACKGROUND is disabled.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Send the due emails and exit')
+        parser.add_argument('--batch-size', type=int, default=None, help='Emails sent over every connection')
+
+    def handle(self, *args, **options):
+        if not options['once']:
+            self.stdout.write('Sending the outbox emails as they come...')
+            send_emails_forever()
+
+        total_sent = 0
+        total_failed = 0
+        while True:
+            sent, failed = send_due_emails(options['batch_size'])
+            if not sent and not failed:
+                break
+            total_sent += sent
+            total_failed += failed
+
+        self.stdout.write('{} emails sent, {} failed and scheduled for retry'.format(total_sent, total_failed))
@@ -0,0 +1,47 @@
+"""Write the GraphQL schema to files, as SDL and as the result of the introspection query."""
+from backend.introspection import get_introspection
+from backend.schema import graphql_schema
+from django.core.management.base import BaseCommand, CommandError
+from graphql.utils.introspection_query import introspection_query
+from graphql.utils.schema_printer import print_schema
+
+import json
+import os
+
+
+class Command(BaseCommand):
+    help = 'Write the schema SDL and its introspection JSON, for the clients and the CI to use without querying the ' \
+           'server. --check fails instead when the files are not up to date.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sdl', default='schema.graphql', help='SDL file, empty to skip it')
+        parser.add_argument('--json', default='schema.json', help='Introspection JSON file, empty to skip it')
+        parser.add_argument('--check', action='store_true', help='Only check that the files are up to date')
+
+    def handle(self, *args, **options):
+        snapshots = {}
+        if options['sdl']:
+            snapshots[options['sdl']] = print_schema(graphql_schema) + '\n'
+        if options['json']:
+            _, result = get_introspection(graphql_schema, introspection_query)
+            snapshots[options['json']] = json.dumps({'data': result.data}, indent=2, sort_keys=True) + '\n'
+
+        outdated = []
+        for path, snapshot in snapshots.items():
+            current = None
+            if os.path.exists(path):
+                with open(path, encoding='utf-8') as snapshot_file:
+                    current = snapshot_file.read()
+            if current == snapshot:
+                continue
+
+            outdated.append(path)
+            if not options['check']:
+                with open(path, 'w', encoding='utf-8') as snapshot_file:
+                    snapshot_file.write(snapshot)
+                self.stdout.write('Wrote {}'.format(path))
+
+        if options['check'] and outdated:
+            raise CommandError('Outdated schema snapshots: {}'.format(', '.join(outdated)))
+        if not outdated:
+            self.stdout.write('Schema snapshots up to date')
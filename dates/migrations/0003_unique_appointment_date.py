@@ -0,0 +1,21 @@
+# Generated by Django 2.2.28 on 2026-10-18 07:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dates', '0002_appointment_indexes'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='appointment',
+            constraint=models.UniqueConstraint(fields=('appointment_date',), name='unique_appointment_date'),
+        ),
+        migrations.RemoveIndex(
+            model_name='appointment',
+            name='appointment_date_idx',
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 2.2.28 on 2026-10-18 09:12
+
+from django.db import migrations, models
+from django.db.models.functions import Lower
+
+
+def fill_normalized_email(apps, schema_editor):
+    User = apps.get_model('dates', 'User')
+    User.objects.update(normalized_email=Lower('email'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dates', '0004_outbox_email'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='normalized_email',
+            field=models.EmailField(editable=False, max_length=254, null=True, verbose_name='normalized email address'),
+        ),
+        # Fails if two emails only differ in their case, they must be merged by hand first
+        migrations.RunPython(fill_normalized_email, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='user',
+            name='normalized_email',
+            field=models.EmailField(editable=False, max_length=254, unique=True, verbose_name='normalized email address'),
+        ),
+    ]
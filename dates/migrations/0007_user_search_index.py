@@ -0,0 +1,39 @@
+# Generated by Django 2.2.28 on 2026-10-18 08:40
+
+from django.db import migrations
+
+SQLITE_CREATE = [
+    "CREATE VIRTUAL TABLE dates_user_search USING fts5(first_name, last_name, email, phone_number)",
+    "INSERT INTO dates_user_search (rowid, first_name, last_name, email, phone_number) "
+    "SELECT id, first_name, last_name, email, phone_number FROM dates_user",
+]
+SQLITE_DROP = ["DROP TABLE dates_user_search"]
+
+POSTGRESQL_CREATE = [
+    "CREATE INDEX user_search_idx ON dates_user USING gin (to_tsvector('simple', first_name || ' ' || last_name "
+    "|| ' ' || translate(email, '@.', '  ') || ' ' || coalesce(phone_number, '')))",
+]
+POSTGRESQL_DROP = ["DROP INDEX user_search_idx"]
+
+
+def run_sql(statements_by_vendor):
+    def run(apps, schema_editor):
+        for statement in statements_by_vendor.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dates', '0006_user_date_joined_index'),
+    ]
+
+    operations = [
+        # Full-text search of the users (see dates/search.py)
+        migrations.RunPython(
+            run_sql({'sqlite': SQLITE_CREATE, 'postgresql': POSTGRESQL_CREATE}),
+            run_sql({'sqlite': SQLITE_DROP, 'postgresql': POSTGRESQL_DROP}),
+        ),
+    ]
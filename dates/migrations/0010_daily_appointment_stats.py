@@ -0,0 +1,44 @@
+# Generated by Django 2.2.28 on 2026-10-18 08:33
+
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import TruncDate
+import django.db.models.deletion
+
+
+def fill_daily_appointment_stats(apps, schema_editor):
+    Appointment = apps.get_model('dates', 'Appointment')
+    DailyAppointmentStats = apps.get_model('dates', 'DailyAppointmentStats')
+    counts = Appointment.objects \
+        .annotate(day=TruncDate('appointment_date')) \
+        .values('day', 'appointment_state') \
+        .annotate(count=Count('id')) \
+        .order_by()
+    DailyAppointmentStats.objects.bulk_create(
+        (DailyAppointmentStats(day=row['day'], appointment_state_id=row['appointment_state'], count=row['count'])
+         for row in counts.iterator()),
+        batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dates', '0009_persisted_query'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyAppointmentStats',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('appointment_state', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to='dates.AppointmentState')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='dailyappointmentstats',
+            constraint=models.UniqueConstraint(fields=('day', 'appointment_state'), name='unique_daily_appointment_stats'),
+        ),
+        migrations.RunPython(fill_daily_appointment_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,74 @@
+# Generated by Django 2.2.28 on 2026-10-18 10:05
+
+from django.conf import settings
+from django.db import migrations, models
+
+import phonenumbers
+
+FIELDS = 'first_name, last_name, email, phone_number'
+NEW_FIELDS = FIELDS + ', national_phone_number'
+
+SQLITE_CREATE = [
+    "DROP TABLE dates_user_search",
+    "CREATE VIRTUAL TABLE dates_user_search USING fts5({})".format(NEW_FIELDS),
+    "INSERT INTO dates_user_search (rowid, {0}) SELECT id, {0} FROM dates_user".format(NEW_FIELDS),
+]
+SQLITE_DROP = [
+    "DROP TABLE dates_user_search",
+    "CREATE VIRTUAL TABLE dates_user_search USING fts5({})".format(FIELDS),
+    "INSERT INTO dates_user_search (rowid, {0}) SELECT id, {0} FROM dates_user".format(FIELDS),
+]
+
+POSTGRESQL_CREATE = [
+    "DROP INDEX user_search_idx",
+    "CREATE INDEX user_search_idx ON dates_user USING gin (to_tsvector('simple', first_name || ' ' || last_name "
+    "|| ' ' || translate(email, '@.', '  ') || ' ' || coalesce(phone_number, '') || ' ' "
+    "|| coalesce(national_phone_number, '')))",
+]
+POSTGRESQL_DROP = [
+    "DROP INDEX user_search_idx",
+    "CREATE INDEX user_search_idx ON dates_user USING gin (to_tsvector('simple', first_name || ' ' || last_name "
+    "|| ' ' || translate(email, '@.', '  ') || ' ' || coalesce(phone_number, '')))",
+]
+
+
+def fill_national_phone_number(apps, schema_editor):
+    # The same as dates.phones.get_national_number
+    User = apps.get_model('dates', 'User')
+    users = User.objects.exclude(phone_number=None).only('pk', 'phone_number')
+    for user in users.iterator():
+        try:
+            parsed_phone_number = phonenumbers.parse(user.phone_number, settings.PHONE_NUMBER_DEFAULT_REGION)
+        except phonenumbers.NumberParseException:
+            continue
+        user.national_phone_number = phonenumbers.national_significant_number(parsed_phone_number)
+        user.save(update_fields=['national_phone_number'])
+
+
+def run_sql(statements_by_vendor):
+    def run(apps, schema_editor):
+        for statement in statements_by_vendor.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dates', '0011_change_log'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='national_phone_number',
+            field=models.CharField(blank=True, default=None, editable=False, max_length=16, null=True, verbose_name='national phone number'),
+        ),
+        migrations.RunPython(fill_national_phone_number, migrations.RunPython.noop),
+        # Full-text search of the users by their national phone number too (see dates/search.py)
+        migrations.RunPython(
+            run_sql({'sqlite': SQLITE_CREATE, 'postgresql': POSTGRESQL_CREATE}),
+            run_sql({'sqlite': SQLITE_DROP, 'postgresql': POSTGRESQL_DROP}),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 2.2.28 on 2026-10-18 11:20
+
+from django.conf import settings
+from django.db import migrations
+from django.db.models import Count
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+
+def recount_daily_appointment_stats(apps, schema_editor):
+    # The days were those of TIME_ZONE, they are the days of the shop now (see dates/shop_time.py)
+    Appointment = apps.get_model('dates', 'Appointment')
+    DailyAppointmentStats = apps.get_model('dates', 'DailyAppointmentStats')
+    DailyAppointmentStats.objects.all().delete()
+    counts = Appointment.objects \
+        .annotate(day=TruncDate('appointment_date')) \
+        .values('day', 'appointment_state') \
+        .annotate(count=Count('id')) \
+        .order_by()
+    with timezone.override(settings.SHOP_TIME_ZONE):
+        DailyAppointmentStats.objects.bulk_create(
+            (DailyAppointmentStats(day=row['day'], appointment_state_id=row['appointment_state'], count=row['count'])
+             for row in counts.iterator()),
+            batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dates', '0012_user_national_phone_number'),
+    ]
+
+    operations = [
+        migrations.RunPython(recount_daily_appointment_stats, migrations.RunPython.noop),
+    ]
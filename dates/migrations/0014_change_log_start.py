@@ -0,0 +1,30 @@
+# Generated by Django 2.2.28 on 2026-10-18 09:17
+
+from django.db import migrations, models
+
+
+def set_pruned_through(apps, schema_editor):
+    # Entries pruned before the start was recorded: the ids before the first entry left
+    ChangeLogEntry = apps.get_model('dates', 'ChangeLogEntry')
+    ChangeLogStart = apps.get_model('dates', 'ChangeLogStart')
+    first = ChangeLogEntry.objects.order_by('pk').values_list('pk', flat=True).first()
+    if first is not None and first > 1:
+        ChangeLogStart.objects.create(pk=1, pruned_through=first - 1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dates', '0013_recount_daily_appointment_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeLogStart',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('pruned_through', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(set_pruned_through, migrations.RunPython.noop),
+    ]
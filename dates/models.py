@@ -1,7 +1,9 @@
 """Declare models for users app."""
+from .phones import get_national_number
 from django.db import models
 from django.conf import settings
 from django.contrib.auth.models import AbstractUser, BaseUserManager
+from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 
 
@@ -38,13 +40,29 @@ class UserManager(BaseUserManager):
 
         return self._create_user(email, password, **extra_fields)
 
+    @staticmethod
+    def normalize_email_key(email):
+        """Return the case insensitive form of `email`, stored in `User.normalized_email`."""
+        return email.lower()
+
+    def filter_by_email(self, email):
+        """Filter the users by `email` ignoring its case, using the unique index of `normalized_email`."""
+        return self.filter(normalized_email=self.normalize_email_key(email))
+
 
 class User(AbstractUser):
     """User model."""
 
     username = None
     email = models.EmailField(_('email address'), unique=True)
-    phone_number = models.CharField(_('phone number'), default=None, max_length=15, null=True, blank=True)
+    # Lower case email, so case insensitive lookups use an index (see UserManager.filter_by_email)
+    normalized_email = models.EmailField(_('normalized email address'), unique=True, editable=False)
+    # E.164 format (see dates/phones.py), indexed to find the callers
+    phone_number = models.CharField(
+        _('phone number'), default=None, max_length=16, null=True, blank=True, db_index=True)
+    # Phone number without the country code, as the customers give it, for the search (see dates/search.py)
+    national_phone_number = models.CharField(
+        _('national phone number'), default=None, max_length=16, null=True, blank=True, editable=False)
     is_vip = models.BooleanField(default=False)
     # TODO delete user_managed_by?
     # user_managed_by = models.ForeignKey(
@@ -58,6 +76,23 @@ class User(AbstractUser):
 
     objects = UserManager()
 
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            # Order of the pages of relay_users, also serving its date_joined filters
+            models.Index(fields=['date_joined', 'id'], name='user_date_joined_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.normalized_email = UserManager.normalize_email_key(self.email)
+        self.national_phone_number = get_national_number(self.phone_number)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'email' in update_fields:
+            kwargs['update_fields'] = set(update_fields) | {'normalized_email'}
+        if update_fields is not None and 'phone_number' in update_fields:
+            kwargs['update_fields'] = set(kwargs['update_fields']) | {'national_phone_number'}
+
+        super().save(*args, **kwargs)
+
 
 class DateTimeModel(models.Model):
     """ A base model with created and edited datetime fields """
@@ -84,8 +119,105 @@ class Appointment(DateTimeModel):
     appointment_date = models.DateTimeField()
     appointment_state = models.ForeignKey(AppointmentState, on_delete=models.CASCADE, related_name='appointments')
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'appointment_date'], name='appointment_user_date_idx'),
+            models.Index(fields=['appointment_state', 'appointment_date'], name='appointment_state_date_idx'),
+        ]
+        constraints = [
+            # Every appointment takes one slot, so this is what prevents double booking.
+            # Its index also serves the filters on appointment_date
+            models.UniqueConstraint(fields=['appointment_date'], name='unique_appointment_date'),
+        ]
+
     def __unicode__(self):
         return '{} - {}'.format(self.user, self.appointment_date)
 
     def __str__(self):
         return '{} - {}'.format(self.user, self.appointment_date)
+
+
+class DailyAppointmentStats(models.Model):
+    """Number of appointments of a day in a state, kept up to date by dates/daily_stats.py."""
+
+    day = models.DateField()
+    appointment_state = models.ForeignKey(AppointmentState, on_delete=models.CASCADE, related_name='daily_stats')
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            # Its index also serves the reads of the days of a month
+            models.UniqueConstraint(fields=['day', 'appointment_state'], name='unique_daily_appointment_stats'),
+        ]
+
+    def __unicode__(self):
+        return '{} - {}: {}'.format(self.day, self.appointment_state, self.count)
+
+    def __str__(self):
+        return '{} - {}: {}'.format(self.day, self.appointment_state, self.count)
+
+
+class ChangeLogEntry(models.Model):
+    """Change to an appointment, appointment state or user, in commit order (see dates/changes.py)."""
+
+    created = models.DateTimeField(auto_now_add=True)
+    kind = models.CharField(max_length=32)
+    object_id = models.PositiveIntegerField()
+    deleted = models.BooleanField(default=False)
+
+    def __unicode__(self):
+        return '{} - {} {}'.format(self.pk, self.kind, self.object_id)
+
+    def __str__(self):
+        return '{} - {} {}'.format(self.pk, self.kind, self.object_id)
+
+
+class ChangeLogStart(models.Model):
+    """Only row telling the last entry deleted from the change log (see dates/changes.py)."""
+
+    pruned_through = models.PositiveIntegerField(default=0)
+
+    def __unicode__(self):
+        return str(self.pruned_through)
+
+    def __str__(self):
+        return str(self.pruned_through)
+
+
+class OutboxEmail(DateTimeModel):
+    """Email waiting to be sent by the outbox sender (see dates/outbox.py)."""
+
+    to = models.EmailField()
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    sent_at = models.DateTimeField(default=None, null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    # Identifies the sender sending the email, until `next_attempt_at`
+    claim = models.CharField(max_length=32, blank=True)
+
+    class Meta:
+        indexes = [
+            # The sender looks for the unsent emails that are due
+            models.Index(fields=['sent_at', 'next_attempt_at'], name='outbox_email_pending_idx'),
+        ]
+
+    def __unicode__(self):
+        return '{} - {}'.format(self.to, self.subject)
+
+    def __str__(self):
+        return '{} - {}'.format(self.to, self.subject)
+
+
+class PersistedQuery(DateTimeModel):
+    """GraphQL document registered by a client, which can then send its hash instead (see backend/documents.py)."""
+
+    sha256_hash = models.CharField(max_length=64, unique=True)
+    query = models.TextField()
+
+    def __unicode__(self):
+        return self.sha256_hash
+
+    def __str__(self):
+        return self.sha256_hash
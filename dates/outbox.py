@@ -0,0 +1,122 @@
+"""Queue transactional emails in the database and send them in the background.
+
+Requests only insert an `OutboxEmail` row, so they never wait for the mail server. A sender
+(a thread of the web process, or the `send_outbox_emails` command) sends the due emails in
+batches over one connection to the mail server, and retries the failed ones with an
+exponential backoff up to `settings.OUTBOX_MAX_ATTEMPTS` times.
+"""
+from .models import OutboxEmail
+from backend import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import close_old_connections, transaction
+from django.db.models import Subquery
+from django.utils import timezone
+
+import datetime
+import logging
+import threading
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Time an email is reserved for the sender that claimed it, then it is due again
+CLAIM_TIMEOUT = datetime.timedelta(minutes=5)
+
+_sender_thread = None
+_sender_lock = threading.Lock()
+_sender_wakeup = threading.Event()
+
+
+def enqueue_email(subject, body, to):
+    """Queue an email to `to`, sent once the current transaction commits."""
+    email = OutboxEmail.objects.create(subject=subject, body=body, to=to)
+    if settings.OUTBOX_SEND_IN_BACKGROUND:
+        transaction.on_commit(_wake_sender)
+
+    return email
+
+
+def send_due_emails(batch_size=None):
+    """Send one batch of due emails and return the number of emails sent and failed."""
+    emails = _claim_due_emails(batch_size or settings.OUTBOX_BATCH_SIZE)
+    if not emails:
+        return 0, 0
+
+    sent = []
+    failed = []
+    connection = get_connection()
+    try:
+        # One connection to the mail server for the whole batch
+        connection.open()
+        for email in emails:
+            try:
+                connection.send_messages([EmailMessage(email.subject, email.body, to=[email.to])])
+                sent.append(email)
+            except Exception as error:
+                failed.append((email, error))
+    except Exception as error:
+        # The connection could not be opened, or was lost: the rest of the batch failed too
+        done = {email.pk for email in sent} | {email.pk for email, _ in failed}
+        failed.extend((email, error) for email in emails if email.pk not in done)
+    finally:
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    now = timezone.now()
+    OutboxEmail.objects.filter(pk__in=[email.pk for email in sent]).update(sent_at=now)
+    for email, error in failed:
+        _schedule_retry(email, error, now)
+
+    return len(sent), len(failed)
+
+
+def send_emails_forever(poll_interval=None):
+    """Send the due emails as they come, until the process ends."""
+    poll_interval = poll_interval or settings.OUTBOX_POLL_INTERVAL
+    while True:
+        _sender_wakeup.clear()
+        try:
+            while sum(send_due_emails()):
+                pass
+        except Exception:
+            logger.exception('Outbox sender failed')
+        finally:
+            close_old_connections()
+
+        _sender_wakeup.wait(poll_interval)
+
+
+def _claim_due_emails(batch_size):
+    now = timezone.now()
+    claim = uuid.uuid4().hex
+    due_emails = OutboxEmail.objects.filter(
+        sent_at=None, attempts__lt=settings.OUTBOX_MAX_ATTEMPTS, next_attempt_at__lte=now)
+    # A single UPDATE, so concurrent senders never claim the same email: the database
+    # checks again that the email is due before updating it
+    due_emails.filter(pk__in=Subquery(due_emails.order_by('next_attempt_at').values('pk')[:batch_size])).update(
+        claim=claim, next_attempt_at=now + CLAIM_TIMEOUT)
+
+    return list(OutboxEmail.objects.filter(claim=claim).order_by('next_attempt_at'))
+
+
+def _schedule_retry(email, error, now):
+    email.attempts += 1
+    email.next_attempt_at = now + settings.OUTBOX_RETRY_DELAY * 2 ** (email.attempts - 1)
+    email.last_error = '{}: {}'.format(type(error).__name__, error)
+    email.save(update_fields=['attempts', 'next_attempt_at', 'last_error', 'edited'])
+
+    if email.attempts >= settings.OUTBOX_MAX_ATTEMPTS:
+        logger.error('Email %s to %s not sent after %s attempts: %s', email.pk, email.to, email.attempts, error)
+
+
+def _wake_sender():
+    global _sender_thread
+
+    with _sender_lock:
+        if _sender_thread is None:
+            _sender_thread = threading.Thread(target=send_emails_forever, name='outbox-sender', daemon=True)
+            _sender_thread.start()
+
+    _sender_wakeup.set()
@@ -0,0 +1,41 @@
+"""Normalize the phone numbers to E.164, so every number is stored and looked up in one format.
+
+Parsing and validating a number is slow, and the same inputs come again and again (the
+number of a user at every edit, the callers looked up by the reception desk), so the
+results are memoized.
+"""
+from backend import settings
+
+import functools
+import phonenumbers
+
+
+@functools.lru_cache(maxsize=settings.PHONE_NUMBER_CACHE_SIZE)
+def normalize_phone_number(phone_number):
+    """Return `phone_number` in E.164 format (e.g. +34600111222), or None if it is not valid.
+
+    Numbers without international prefix belong to `settings.PHONE_NUMBER_DEFAULT_REGION`.
+    """
+    try:
+        parsed_phone_number = phonenumbers.parse(phone_number, settings.PHONE_NUMBER_DEFAULT_REGION)
+    except phonenumbers.NumberParseException:
+        return None
+
+    if not phonenumbers.is_valid_number(parsed_phone_number):
+        return None
+
+    return phonenumbers.format_number(parsed_phone_number, phonenumbers.PhoneNumberFormat.E164)
+
+
+@functools.lru_cache(maxsize=settings.PHONE_NUMBER_CACHE_SIZE)
+def get_national_number(phone_number):
+    """Return the number of `phone_number` without its country code (e.g. 600111222 for +34600111222), or None."""
+    if phone_number is None:
+        return None
+
+    try:
+        parsed_phone_number = phonenumbers.parse(phone_number, settings.PHONE_NUMBER_DEFAULT_REGION)
+    except phonenumbers.NumberParseException:
+        return None
+
+    return phonenumbers.national_significant_number(parsed_phone_number)
@@ -1,16 +1,34 @@
+from backend import response_cache, settings
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from graphene import relay
 from graphene_django.filter import DjangoFilterConnectionField
-from graphql_relay.node.node import from_global_id
-
+from graphql_relay.node.node import from_global_id, to_global_id
+from users.schema import UserNode
+
+from .availability import get_available_slots
+from .booking import BookingError, book_appointment, cancel_appointment, reschedule_appointment
+from .changes import decode_cursor, encode_cursor, get_changes_since, get_head
+from .daily_stats import get_month_stats
+from .fields import KeysetFilterConnectionField
 from .subscriptions import \
+    Appointment, \
     AppointmentNode, \
     AppointmentStateActionEnum, \
     AppointmentStateNode, \
     AppointmentState, \
+    OnAppointmentChange, \
     OnAppointmentState
 
+import calendar
+import collections
+import datetime
 import graphene
 
+# Results of the queries of appointment states, which change a few times a year
+APPOINTMENT_STATES_CACHE_GROUP = 'appointment_states'
+
 
 class CreateAppointmentState(graphene.Mutation):
     # Relay allows Output objects
@@ -66,8 +84,12 @@ class DeleteAppointmentState(graphene.Mutation):
         int_id = int(from_global_id(id)[1])
 
         appointment_state = AppointmentState.objects.get(pk=int_id)
+        appointment_state_id = appointment_state.pk
         appointment_state.delete()
+        # Keep the id so subscribers know which appointment state was deleted
+        appointment_state.pk = appointment_state_id
 
+        # Broadcast after the commit
         OnAppointmentState.action_appointment_state(
             action=AppointmentStateActionEnum.DELETE_APPOINTMENT_STATE.value,
             appointment_state_node=appointment_state
@@ -76,6 +98,177 @@ class DeleteAppointmentState(graphene.Mutation):
         return DeleteAppointmentState(appointment_state_node=appointment_state)
 
 
+def get_user_appointment(user, id, errors_list):
+    """Return the appointment with the global `id` if `user` can manage it, otherwise add the error to `errors_list`."""
+    appointment = None
+    try:
+        appointment = Appointment.objects.get(pk=int(from_global_id(id)[1]))
+    except (Appointment.DoesNotExist, ValueError):
+        errors_list.append(settings.APPOINTMENT_DOES_NOT_EXIST_ERROR)
+
+    if appointment is not None and appointment.user_id != user.pk and not user.is_staff:
+        errors_list.append(settings.OPERATION_NOT_ALLOWED_ERROR)
+        appointment = None
+
+    return appointment
+
+
+def check_logged_in_user(user, errors_list):
+    """Add the error to `errors_list` if `user` is not logged in with an active account."""
+    if user.is_anonymous:
+        errors_list.append(settings.USER_NOT_LOGGED_IN_ERROR)
+    elif not user.is_active:
+        errors_list.append(settings.ACCOUNT_INACTIVE_ERROR)
+
+
+class CreateAppointment(graphene.Mutation):
+    appointment_node = graphene.Field(AppointmentNode)
+    result = graphene.String()
+    errors = graphene.List(graphene.String)
+
+    class Arguments:
+        appointment_date = graphene.DateTime(required=True)
+        # Only staff accounts can book for another user
+        user_id = graphene.String()
+        # Only staff accounts can choose the state, the default one otherwise
+        appointment_state_id = graphene.String()
+
+    def mutate(self, info, appointment_date, user_id=None, appointment_state_id=None):
+        appointment = None
+        result = settings.KO
+        errors_list = []
+
+        logged_in_user = info.context.user
+        check_logged_in_user(logged_in_user, errors_list)
+
+        user = logged_in_user
+        if len(errors_list) == 0 and user_id is not None:
+            if not logged_in_user.is_staff:
+                errors_list.append(settings.OPERATION_NOT_ALLOWED_ERROR)
+            else:
+                try:
+                    user = get_user_model().objects.get(pk=int(from_global_id(user_id)[1]))
+                except (get_user_model().DoesNotExist, ValueError):
+                    errors_list.append(settings.ACCOUNT_DOES_NOT_EXIST_ERROR)
+
+        appointment_state = None
+        if len(errors_list) == 0 and appointment_state_id is not None:
+            if not logged_in_user.is_staff:
+                errors_list.append(settings.OPERATION_NOT_ALLOWED_ERROR)
+            else:
+                try:
+                    appointment_state = AppointmentState.objects.get(
+                        pk=int(from_global_id(appointment_state_id)[1]))
+                except (AppointmentState.DoesNotExist, ValueError):
+                    errors_list.append(settings.APPOINTMENT_STATE_DOES_NOT_EXIST_ERROR)
+
+        if len(errors_list) == 0:
+            try:
+                appointment = book_appointment(user, appointment_date, appointment_state)
+                result = settings.OK
+            except BookingError as e:
+                errors_list.append(str(e))
+
+        return CreateAppointment(appointment_node=appointment, result=result, errors=errors_list)
+
+
+class RescheduleAppointment(graphene.Mutation):
+    appointment_node = graphene.Field(AppointmentNode)
+    result = graphene.String()
+    errors = graphene.List(graphene.String)
+
+    class Arguments:
+        id = graphene.String(required=True)
+        appointment_date = graphene.DateTime(required=True)
+
+    def mutate(self, info, id, appointment_date):
+        appointment = None
+        result = settings.KO
+        errors_list = []
+
+        user = info.context.user
+        check_logged_in_user(user, errors_list)
+
+        if len(errors_list) == 0:
+            appointment = get_user_appointment(user, id, errors_list)
+
+        if len(errors_list) == 0:
+            try:
+                reschedule_appointment(appointment, appointment_date)
+                result = settings.OK
+            except BookingError as e:
+                errors_list.append(str(e))
+
+        return RescheduleAppointment(appointment_node=appointment, result=result, errors=errors_list)
+
+
+class CancelAppointment(graphene.Mutation):
+    appointment_node = graphene.Field(AppointmentNode)
+    result = graphene.String()
+    errors = graphene.List(graphene.String)
+
+    class Arguments:
+        id = graphene.String(required=True)
+
+    def mutate(self, info, id):
+        appointment = None
+        result = settings.KO
+        errors_list = []
+
+        user = info.context.user
+        check_logged_in_user(user, errors_list)
+
+        if len(errors_list) == 0:
+            appointment = get_user_appointment(user, id, errors_list)
+
+        if len(errors_list) == 0:
+            cancel_appointment(appointment)
+            result = settings.OK
+
+        return CancelAppointment(appointment_node=appointment, result=result, errors=errors_list)
+
+
+class AvailableSlotType(graphene.ObjectType):
+    start = graphene.DateTime()
+    end = graphene.DateTime()
+
+
+class AppointmentStateCountType(graphene.ObjectType):
+    appointment_state = graphene.Field(AppointmentStateNode)
+    count = graphene.Int()
+
+
+class AppointmentCalendarDayType(graphene.ObjectType):
+    day = graphene.Date()
+    count = graphene.Int()
+    states = graphene.List(AppointmentStateCountType)
+
+
+class ChangedNode(graphene.Union):
+    class Meta:
+        types = (AppointmentNode, AppointmentStateNode, UserNode)
+
+
+class ChangeType(graphene.ObjectType):
+    id = graphene.ID(description="Global id of the changed object")
+    deleted = graphene.Boolean()
+    node = graphene.Field(ChangedNode, description="The object as it is now, null when deleted")
+
+
+class ChangesType(graphene.ObjectType):
+    changes = graphene.List(ChangeType)
+    cursor = graphene.String(description="Cursor of the last change read, to get the following ones")
+    has_more = graphene.Boolean()
+
+
+# Node types and models of the kinds of the change log
+CHANGE_NODE_TYPES = {
+    'appointment': AppointmentNode,
+    'appointment_state': AppointmentStateNode,
+    'user': UserNode,
+}
+
+
 class Query(graphene.ObjectType):
     """Root GraphQL query."""
 
@@ -84,6 +277,108 @@ class Query(graphene.ObjectType):
 
     relay_appointment = relay.Node.Field(AppointmentNode)
     relay_appointments = DjangoFilterConnectionField(AppointmentNode)
+    # Opt-in keyset pagination: constant cost at any depth and stable pages under inserts
+    relay_appointments_keyset = KeysetFilterConnectionField(AppointmentNode, keyset=('appointment_date', 'id'))
+
+    available_slots = graphene.List(
+        AvailableSlotType,
+        from_=graphene.DateTime(required=True, name='from'),
+        to=graphene.DateTime(required=True),
+        duration=graphene.Int(description="Minutes of the slots (one appointment by default)"))
+
+    appointment_calendar = graphene.List(
+        AppointmentCalendarDayType,
+        year=graphene.Int(required=True),
+        month=graphene.Int(required=True),
+        description="Number of appointments of every day of the month, by state")
+
+    # Staff only
+    changes_since = graphene.Field(
+        ChangesType,
+        cursor=graphene.String(description="Without cursor, no changes are returned, only the current cursor"),
+        first=graphene.Int(description="Maximum number of changes read"),
+        description="Last change of every object changed after the cursor, in the order they were committed")
+
+    def resolve_available_slots(self, info, from_, to, duration=None):
+        if from_ >= to or to - from_ > datetime.timedelta(days=settings.AVAILABLE_SLOTS_MAX_DAYS):
+            raise Exception(settings.INVALID_DATE_RANGE_ERROR)
+
+        if duration is None:
+            duration = settings.APPOINTMENT_DURATION
+        elif duration > 0:
+            duration = datetime.timedelta(minutes=duration)
+        else:
+            raise Exception(settings.INVALID_DURATION_ERROR)
+
+        return [AvailableSlotType(start=start, end=end) for start, end in get_available_slots(from_, to, duration)]
+
+    def resolve_appointment_calendar(self, info, year, month):
+        try:
+            first_day = datetime.date(year, month, 1)
+        except ValueError:
+            raise Exception(settings.INVALID_DATE_RANGE_ERROR)
+        last_day = first_day.replace(day=calendar.monthrange(year, month)[1])
+
+        states_by_day = collections.defaultdict(list)
+        for stats in get_month_stats(first_day, last_day):
+            states_by_day[stats.day].append(
+                AppointmentStateCountType(appointment_state=stats.appointment_state, count=stats.count))
+
+        days = (first_day + datetime.timedelta(days=i) for i in range(last_day.day))
+        return [
+            AppointmentCalendarDayType(
+                day=day, count=sum(state.count for state in states_by_day[day]), states=states_by_day[day])
+            for day in days
+        ]
+
+    def resolve_changes_since(self, info, cursor=None, first=None):
+        user = info.context.user
+        if user.is_anonymous:
+            raise Exception(settings.USER_NOT_LOGGED_IN_ERROR)
+        elif not user.is_staff:
+            raise Exception(settings.OPERATION_NOT_ALLOWED_ERROR)
+
+        if cursor is None:
+            return ChangesType(changes=[], cursor=encode_cursor(get_head()), has_more=False)
+
+        first = min(first or settings.CHANGES_MAX_FIRST, settings.CHANGES_MAX_FIRST)
+        page = get_changes_since(decode_cursor(cursor), first)
+        if page is None:
+            raise Exception(settings.CHANGES_EXPIRED_ERROR)
+        entries, last_entry_id, has_more = page
+
+        # One query by kind of object
+        nodes = {}
+        for kind, node_type in CHANGE_NODE_TYPES.items():
+            ids = [entry.object_id for entry in entries if entry.kind == kind and not entry.deleted]
+            if ids:
+                model = node_type._meta.model
+                nodes.update(((kind, pk), node) for pk, node in model.objects.in_bulk(ids).items())
+
+        changes = []
+        for entry in entries:
+            node = nodes.get((entry.kind, entry.object_id))
+            changes.append(ChangeType(
+                id=to_global_id(CHANGE_NODE_TYPES[entry.kind]._meta.name, entry.object_id),
+                # Also deleted when it was deleted after the last entry read
+                deleted=node is None,
+                node=node))
+
+        return ChangesType(changes=changes, cursor=encode_cursor(last_entry_id), has_more=has_more)
+
+
+response_cache.cache_query_fields(
+    APPOINTMENT_STATES_CACHE_GROUP,
+    ['relayAppointmentState', 'relayAppointmentStates'],
+    ['AppointmentStateNode', 'AppointmentStateNodeConnection', 'AppointmentStateNodeEdge'],
+    # Not the filter by appointments, which change all the time
+    ['id', 'before', 'after', 'first', 'last', 'name'])
+
+
+@receiver(post_save, sender=AppointmentState)
+@receiver(post_delete, sender=AppointmentState)
+def _invalidate_appointment_states(**kwargs):
+    response_cache.invalidate_on_commit(APPOINTMENT_STATES_CACHE_GROUP)
 
 
 class Mutation(graphene.ObjectType):
@@ -93,8 +388,13 @@ class Mutation(graphene.ObjectType):
     update_appointment_state = UpdateAppointmentState.Field()
     delete_appointment_state = DeleteAppointmentState.Field()
 
+    create_appointment = CreateAppointment.Field()
+    reschedule_appointment = RescheduleAppointment.Field()
+    cancel_appointment = CancelAppointment.Field()
+
 
 class Subscription(graphene.ObjectType):
     """GraphQL """
 
     on_appointment_state_action = OnAppointmentState.Field()
+    on_appointment_change = OnAppointmentChange.Field()
@@ -0,0 +1,129 @@
+"""Full-text search of the users by the prefixes of their names, email and phone number.
+
+Phone numbers are found with or without their country code (+34600111222 or 600111222).
+
+On SQLite the text of the users is copied to the FTS5 table `dates_user_search`, updated
+when a user is saved or deleted (`index_users()` and `rebuild_index()` catch up with bulk
+changes). On
+PostgreSQL a GIN index on the `tsvector` of the same text is kept by the database itself.
+"""
+from .models import User
+from django.db import connection, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+import itertools
+import re
+
+SEARCH_TABLE = 'dates_user_search'
+SEARCH_FIELDS = ('first_name', 'last_name', 'email', 'phone_number', 'national_phone_number')
+
+# Same expression as the index of migration 0012, so PostgreSQL uses it
+POSTGRESQL_VECTOR = (
+    "to_tsvector('simple', first_name || ' ' || last_name || ' ' || translate(email, '@.', '  ') || ' ' "
+    "|| coalesce(phone_number, '') || ' ' || coalesce(national_phone_number, ''))"
+)
+
+
+def search_user_ids(text, limit):
+    """Return the ids of the `limit` users best matching every word of `text` as a prefix."""
+    sql, params = _match_sql(text, ranked=True)
+    if sql is None:
+        return []
+
+    with connection.cursor() as cursor:
+        cursor.execute('{} LIMIT %s'.format(sql), params + [limit])
+        return [row[0] for row in cursor.fetchall()]
+
+
+def filter_users(queryset, text):
+    """Filter the users of `queryset` matching every word of `text` as a prefix."""
+    sql, params = _match_sql(text, ranked=False)
+    if sql is None:
+        return queryset.none()
+
+    # pk__in=RawSQL() would compile to `IN ((SELECT ...))`, which SQLite reads as the first id only
+    quote_name = connection.ops.quote_name
+    column = '{}.{}'.format(quote_name(User._meta.db_table), quote_name(User._meta.pk.column))
+    return queryset.extra(where=['{} IN ({})'.format(column, sql)], params=params)
+
+
+def rebuild_index():
+    """Index the text of all the users again."""
+    if connection.vendor != 'sqlite':
+        return
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute('DELETE FROM {}'.format(SEARCH_TABLE))
+        cursor.execute('INSERT INTO {} (rowid, {}) SELECT id, {} FROM {}'.format(
+            SEARCH_TABLE, ', '.join(SEARCH_FIELDS), ', '.join(SEARCH_FIELDS), User._meta.db_table))
+
+
+def index_users(user_ids, batch_size=500):
+    """Index the text of the users `user_ids` again, e.g. after they were saved by `bulk_create()`."""
+    if connection.vendor != 'sqlite':
+        return
+
+    user_ids = list(user_ids)
+    with transaction.atomic(), connection.cursor() as cursor:
+        # Older SQLite versions take at most 999 parameters
+        for start in range(0, len(user_ids), batch_size):
+            batch = user_ids[start:start + batch_size]
+            placeholders = ', '.join(['%s'] * len(batch))
+            cursor.execute('DELETE FROM {} WHERE rowid IN ({})'.format(SEARCH_TABLE, placeholders), batch)
+            cursor.execute('INSERT INTO {} (rowid, {}) SELECT id, {} FROM {} WHERE id IN ({})'.format(
+                SEARCH_TABLE, ', '.join(SEARCH_FIELDS), ', '.join(SEARCH_FIELDS), User._meta.db_table,
+                placeholders), batch)
+
+
+@receiver(post_save, sender=User)
+def _index_user(instance, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM {} WHERE rowid = %s'.format(SEARCH_TABLE), [instance.pk])
+        cursor.execute(
+            'INSERT INTO {} (rowid, {}) VALUES (%s, {})'.format(
+                SEARCH_TABLE, ', '.join(SEARCH_FIELDS), ', '.join(['%s'] * len(SEARCH_FIELDS))),
+            [instance.pk] + [getattr(instance, name) for name in SEARCH_FIELDS])
+
+
+@receiver(post_delete, sender=User)
+def _unindex_user(instance, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM {} WHERE rowid = %s'.format(SEARCH_TABLE), [instance.pk])
+
+
+def _match_sql(text, ranked):
+    # Only the words are kept, so the text cannot inject search operators
+    words = _join_digit_groups(re.findall(r'\w+', text or ''))
+    if not words:
+        return None, []
+
+    if connection.vendor == 'postgresql':
+        query = ' & '.join('{}:*'.format(word) for word in words)
+        sql = "SELECT id FROM {} WHERE {} @@ to_tsquery('simple', %s)".format(User._meta.db_table, POSTGRESQL_VECTOR)
+        if ranked:
+            sql += " ORDER BY ts_rank({}, to_tsquery('simple', %s)) DESC, id".format(POSTGRESQL_VECTOR)
+            return sql, [query, query]
+        return sql, [query]
+
+    query = ' '.join('"{}"*'.format(word) for word in words)
+    sql = 'SELECT rowid FROM {} WHERE {} MATCH %s'.format(SEARCH_TABLE, SEARCH_TABLE)
+    if ranked:
+        sql += ' ORDER BY rank, rowid'
+
+    return sql, [query]
+
+
+def _join_digit_groups(words):
+    # Phone numbers are typed in groups of digits (e.g. 600 11), the prefix of one number
+    joined = []
+    for is_number, group in itertools.groupby(words, str.isdigit):
+        joined.extend([''.join(group)] if is_number else group)
+
+    return joined
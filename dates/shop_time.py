@@ -0,0 +1,29 @@
+"""Dates and times in the time zone of the shop, `settings.SHOP_TIME_ZONE`.
+
+The opening hours, the slots and the days of the appointments are in the local time of the
+shop, whatever the time zone of the server (`settings.TIME_ZONE`).
+"""
+from backend import settings
+from django.utils import timezone
+
+import pytz
+
+
+def get_shop_timezone():
+    """Return the time zone of the shop."""
+    return pytz.timezone(settings.SHOP_TIME_ZONE)
+
+
+def to_shop_time(value):
+    """Return the aware datetime `value` in the local time of the shop."""
+    return timezone.localtime(value, get_shop_timezone())
+
+
+def get_shop_date(value):
+    """Return the local date of the shop at the aware datetime `value`."""
+    return to_shop_time(value).date()
+
+
+def make_shop_aware(value):
+    """Return the naive datetime `value`, in the local time of the shop, as an aware datetime."""
+    return timezone.make_aware(value, get_shop_timezone())
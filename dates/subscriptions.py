@@ -1,12 +1,23 @@
+from .fields import BatchedFilterConnectionField, get_list_limit
+from .filters import AppointmentFilter
+from .loaders import get_loaders
 from .models import Appointment, AppointmentState
+from .shop_time import get_shop_date
+from backend import settings
+from backend.broadcast import BroadcastSubscription
+from backend.optimizer import PAGINATION_ARGS, get_prefetched, optimize_queryset
+from django.utils.dateparse import parse_datetime
 from graphene import relay
 from graphene_django import DjangoObjectType
+from graphql_relay.node.node import from_global_id
 
-import channels_graphql_ws
+import datetime
 import graphene
 
 
 class AppointmentStateNode(DjangoObjectType):
+    appointments = BatchedFilterConnectionField(lambda: AppointmentNode, required=True)
+
     class Meta:
         model = AppointmentState
         exclude_fields = ('created', 'edited')
@@ -15,18 +26,50 @@ class AppointmentStateNode(DjangoObjectType):
             'appointments']
         interfaces = (relay.Node,)
 
+    @classmethod
+    def get_queryset(cls, queryset, info):
+        return optimize_queryset(queryset, info)
+
+    def resolve_appointments(self, info, **kwargs):
+        if any(arg not in PAGINATION_ARGS for arg in kwargs):
+            # Filtered pages are resolved by the filterset of the connection field
+            return self.appointments.all()
+
+        prefetched = get_prefetched(self, 'appointments')
+        if prefetched is not None:
+            return prefetched
+
+        limit = get_list_limit(kwargs)
+        if limit is None and kwargs:
+            # The end of the list is counted and sliced by the connection field, in the database
+            return self.appointments.order_by('pk')
+
+        return get_loaders(info).appointments_by_state.load((self.pk, limit))
+
 
 class AppointmentNode(DjangoObjectType):
     class Meta:
         model = Appointment
         exclude_fields = ('created', 'edited')
-        filter_fields = [
-            'user',
-            'appointment_date',
-            'appointment_state'
-        ]
+        filterset_class = AppointmentFilter
         interfaces = (relay.Node,)
 
+    @classmethod
+    def get_queryset(cls, queryset, info):
+        return optimize_queryset(queryset, info)
+
+    def resolve_user(self, info):
+        if Appointment.user.is_cached(self):
+            return self.user
+
+        return get_loaders(info).user.load(self.user_id)
+
+    def resolve_appointment_state(self, info):
+        if Appointment.appointment_state.is_cached(self):
+            return self.appointment_state
+
+        return get_loaders(info).appointment_state.load(self.appointment_state_id)
+
 
 class AppointmentStateActionEnum(graphene.Enum):
     CREATE_APPOINTMENT_STATE = "Create_appointment"
@@ -34,7 +77,7 @@ class AppointmentStateActionEnum(graphene.Enum):
     DELETE_APPOINTMENT_STATE = "Delete_appointment"
 
 
-class OnAppointmentState(channels_graphql_ws.Subscription):
+class OnAppointmentState(BroadcastSubscription):
     """Subscription triggers on a new appointment state."""
 
     action = graphene.String()
@@ -55,8 +98,9 @@ class OnAppointmentState(channels_graphql_ws.Subscription):
         del info
 
         # The `self` contains payload delivered from the `broadcast()`.
-        action = self["action"]
-        appointment_state_node = self["appointment_state_node"]
+        payload = OnAppointmentState.load_payload(self)
+        action = payload["action"]
+        appointment_state_node = payload["appointment_state_node"]
 
         return OnAppointmentState(action=action, appointment_state_node=appointment_state_node)
 
@@ -68,6 +112,118 @@ class OnAppointmentState(channels_graphql_ws.Subscription):
         That allows to consider a structure of the `payload` as an
         implementation details.
         """
-        cls.broadcast(
+        cls.broadcast_on_commit(
             group="appointment_state_{}".format(action),
-            payload={"action": action, "appointment_state_node": appointment_state_node})
+            payload={"action": action, "appointment_state_node": appointment_state_node},
+            key=appointment_state_node.pk)
+
+
+APPOINTMENT_ALL_GROUP = "appointment"
+APPOINTMENT_DAY_GROUP = "appointment_day_{}"
+APPOINTMENT_USER_GROUP = "appointment_user_{}"
+
+
+class AppointmentActionEnum(graphene.Enum):
+    CREATE_APPOINTMENT = "Create_appointment"
+    RESCHEDULE_APPOINTMENT = "Reschedule_appointment"
+    CANCEL_APPOINTMENT = "Cancel_appointment"
+
+
+class OnAppointmentChange(BroadcastSubscription):
+    """Subscription triggers on a booked, rescheduled or cancelled appointment.
+
+    Subscriptions to a date range join one group per day of the shop in the range and changes are
+    only broadcast to the groups of the days they touch. Subscriptions to a user without
+    range join the group of the user, and the rest the group of every change. Only staff
+    accounts can subscribe to the appointments of every user, the others to their own ones.
+    """
+
+    action = graphene.String()
+    appointment_node = graphene.Field(AppointmentNode)
+
+    class Arguments:
+        """Subscription arguments."""
+        from_ = graphene.DateTime(name='from')
+        to = graphene.DateTime()
+        user_id = graphene.String()
+
+    def subscribe(self, info, from_=None, to=None, user_id=None):
+        """Client subscription handler."""
+        user = getattr(info.context, 'user', None)
+        if user is None or user.is_anonymous:
+            raise Exception(settings.USER_NOT_LOGGED_IN_ERROR)
+        if not user.is_active:
+            raise Exception(settings.ACCOUNT_INACTIVE_ERROR)
+        if not user.is_staff and (user_id is None or _get_user_pk(user_id) != user.pk):
+            raise Exception(settings.OPERATION_NOT_ALLOWED_ERROR)
+
+        return _get_groups(from_, to, user_id)
+
+    def publish(self, info, from_=None, to=None, user_id=None):
+        """Called to prepare the subscription notification appointment."""
+        del info
+
+        # The `self` contains payload delivered from the `broadcast()`.
+        if OnAppointmentChange.is_duplicate(self, _get_groups(from_, to, user_id)):
+            return OnAppointmentChange.SKIP
+
+        payload = OnAppointmentChange.load_payload(self)
+        appointment = payload["appointment_node"]
+        if user_id is not None and appointment.user_id != _get_user_pk(user_id):
+            return OnAppointmentChange.SKIP
+
+        if from_ is not None:
+            # Day groups are wider than the range, and a rescheduled appointment concerns both dates
+            appointment_dates = [appointment.appointment_date]
+            if payload["previous_appointment_date"] is not None:
+                appointment_dates.append(parse_datetime(payload["previous_appointment_date"]))
+            if not any(from_ <= appointment_date < to for appointment_date in appointment_dates):
+                return OnAppointmentChange.SKIP
+
+        return OnAppointmentChange(action=payload["action"], appointment_node=appointment)
+
+    @classmethod
+    def appointment_change(cls, action, appointment_node, previous_appointment_date=None):
+        """Auxiliary function to send subscription notifications."""
+        appointment_dates = [appointment_node.appointment_date]
+        if previous_appointment_date is not None:
+            appointment_dates.append(previous_appointment_date)
+
+        groups = [APPOINTMENT_ALL_GROUP, APPOINTMENT_USER_GROUP.format(appointment_node.user_id)]
+        for day in sorted({get_shop_date(appointment_date) for appointment_date in appointment_dates}):
+            groups.append(APPOINTMENT_DAY_GROUP.format(day))
+
+        cls.broadcast_to_groups(groups, payload={
+            "action": action,
+            "appointment_node": appointment_node,
+            "previous_appointment_date":
+                None if previous_appointment_date is None else previous_appointment_date.isoformat(),
+        })
+
+
+def _get_groups(from_, to, user_id):
+    """Return the groups of a subscription to the appointments of `user_id` from `from_` to `to`."""
+    if from_ is None and to is None:
+        if user_id is not None:
+            return [APPOINTMENT_USER_GROUP.format(_get_user_pk(user_id))]
+        return [APPOINTMENT_ALL_GROUP]
+
+    if from_ is None or to is None or from_ >= to \
+            or to - from_ > datetime.timedelta(days=settings.APPOINTMENT_CHANGE_MAX_DAYS):
+        raise Exception(settings.INVALID_DATE_RANGE_ERROR)
+
+    first_day = get_shop_date(from_)
+    last_day = get_shop_date(to - datetime.timedelta(microseconds=1))
+
+    return [
+        APPOINTMENT_DAY_GROUP.format(first_day + datetime.timedelta(days=days))
+        for days in range((last_day - first_day).days + 1)
+    ]
+
+
+def _get_user_pk(user_id):
+    """Return the primary key of the user of the global id `user_id`."""
+    try:
+        return int(from_global_id(user_id)[1])
+    except ValueError:
+        raise Exception(settings.ACCOUNT_DOES_NOT_EXIST_ERROR)
@@ -1,3 +1,776 @@
-from django.test import TestCase
+from asgiref.sync import async_to_sync
+from backend import settings
+from backend.broadcast import from_plain_payload
+from backend.routing import MyGraphqlWsConsumer
+from backend.schema import graphql_schema
+from channels.db import database_sync_to_async
+from channels.testing import WebsocketCommunicator
+from dates.availability import get_available_slots, is_bookable_slot
+from dates.changes import encode_cursor, prune
+from dates.daily_stats import rebuild_stats
+from dates.filters import AppointmentFilter
+from dates.loaders import first_rows_by
+from dates.models import Appointment, AppointmentState, ChangeLogEntry, DailyAppointmentStats, OutboxEmail
+from dates.outbox import _claim_due_emails, send_due_emails
+from dates.search import search_user_ids
+from dates.shop_time import make_shop_aware
+from dates.subscriptions import AppointmentActionEnum, AppointmentNode, OnAppointmentChange, OnAppointmentState
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.management import call_command
+from django.db import connection
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from graphene import relay
+from graphql_jwt.shortcuts import get_token
+from graphql_relay.node.node import to_global_id
+from promise.promise import async_instance
+from unittest import mock
 
-# Create your tests here.
+import asyncore
+import csv
+import datetime
+import graphene
+import io
+import json
+import os
+import smtpd
+import socket
+import tempfile
+import threading
+import types
+
+
+def execute(query, variables=None, user=None, schema=graphql_schema):
+    request = RequestFactory().post('/graphql/')
+    request.user = user or AnonymousUser()
+
+    # The promise trampoline batches the DataLoaders in the threads of the requests. channels_graphql_ws
+    # disables it in the thread importing it, which is the main thread of the tests
+    trampoline_enabled = async_instance.trampoline_enabled
+    async_instance.enable_trampoline()
+    try:
+        return schema.execute(query, variables=variables, context_value=request)
+    finally:
+        async_instance.trampoline_enabled = trampoline_enabled
+
+
+class AppointmentsByStateTest(TestCase):
+    STATES = 3
+    APPOINTMENTS_PER_STATE = 150
+    QUERY = '''
+        query($first: Int, $after: String) {
+            relayAppointmentStates {
+                edges { node { name appointments(first: $first, after: $after) {
+                    edges { node { id appointmentDate } }
+                    pageInfo { hasNextPage endCursor }
+                } } }
+            }
+        }
+    '''
+
+    @classmethod
+    def setUpTestData(cls):
+        user = get_user_model().objects.create_user(email='customer@example.com')
+        start = timezone.make_aware(datetime.datetime(2030, 1, 7, 9, 0))
+        for state_number in range(cls.STATES):
+            state = AppointmentState.objects.create(name='State {}'.format(state_number))
+            Appointment.objects.bulk_create(
+                Appointment(
+                    user=user, appointment_state=state,
+                    appointment_date=start + datetime.timedelta(hours=state_number * cls.APPOINTMENTS_PER_STATE + i))
+                for i in range(cls.APPOINTMENTS_PER_STATE))
+
+    def assert_pages(self, first, after=None):
+        # Count and page of the states, then the appointments of every state in one query
+        with self.assertNumQueries(3):
+            result = execute(self.QUERY, {'first': first, 'after': after})
+
+        self.assertIsNone(result.errors)
+        states = result.data['relayAppointmentStates']['edges']
+        self.assertEqual(len(states), self.STATES)
+        for state in states:
+            appointments = state['node']['appointments']
+            self.assertEqual(len(appointments['edges']), first)
+            self.assertTrue(appointments['pageInfo']['hasNextPage'])
+
+        return states
+
+    def test_10_edges_page(self):
+        self.assert_pages(10)
+
+    def test_100_edges_page(self):
+        self.assert_pages(100)
+
+    def test_next_page(self):
+        first_page = self.assert_pages(10)
+        cursor = first_page[0]['node']['appointments']['pageInfo']['endCursor']
+
+        second_page = self.assert_pages(10, cursor)
+        first_page_ids = [edge['node']['id'] for edge in first_page[0]['node']['appointments']['edges']]
+        second_page_ids = [edge['node']['id'] for edge in second_page[0]['node']['appointments']['edges']]
+        self.assertFalse(set(first_page_ids) & set(second_page_ids))
+
+    def test_rows_are_limited_in_the_database(self):
+        appointments = Appointment.objects.all()
+
+        self.assertEqual(first_rows_by(appointments, 'appointment_state', 2).count(), 2 * self.STATES)
+
+
+class KeysetConnectionTest(TestCase):
+    QUERY = '''
+        query($first: Int) {
+            relayAppointmentsKeyset(first: $first) { edges { node { id } } pageInfo { hasNextPage } }
+        }
+    '''
+
+    @classmethod
+    def setUpTestData(cls):
+        user = get_user_model().objects.create_user(email='customer@example.com')
+        state = AppointmentState.objects.create(name='Pending')
+        start = timezone.make_aware(datetime.datetime(2030, 1, 7, 9, 0))
+        Appointment.objects.bulk_create(
+            Appointment(user=user, appointment_state=state, appointment_date=start + datetime.timedelta(hours=i))
+            for i in range(5))
+
+    def test_first_0(self):
+        with self.assertNumQueries(1):
+            result = execute(self.QUERY, {'first': 0})
+
+        self.assertIsNone(result.errors)
+        self.assertEqual(result.data['relayAppointmentsKeyset']['edges'], [])
+        self.assertTrue(result.data['relayAppointmentsKeyset']['pageInfo']['hasNextPage'])
+
+    def test_first(self):
+        result = execute(self.QUERY, {'first': 2})
+
+        self.assertEqual(len(result.data['relayAppointmentsKeyset']['edges']), 2)
+        self.assertTrue(result.data['relayAppointmentsKeyset']['pageInfo']['hasNextPage'])
+
+
+class _NodeQuery(graphene.ObjectType):
+    # Root field of the relay clients, returning the Node interface
+    node = relay.Node.Field()
+
+
+class NodeQueryTest(TestCase):
+    QUERY = '''
+        query($id: ID!) {
+            node(id: $id) {
+                id
+                ... on AppointmentNode { appointmentDate user { email } appointmentState { name } }
+            }
+        }
+    '''
+
+    def test_fragment_fields_are_loaded_in_one_query(self):
+        user = get_user_model().objects.create_user(email='customer@example.com')
+        appointment = Appointment.objects.create(
+            user=user, appointment_state=AppointmentState.objects.create(name='Pending'),
+            appointment_date=timezone.make_aware(datetime.datetime(2030, 1, 7, 9, 0)))
+        schema = graphene.Schema(query=_NodeQuery, types=[AppointmentNode])
+
+        with self.assertNumQueries(1):
+            result = execute(self.QUERY, {'id': to_global_id('AppointmentNode', appointment.pk)}, schema=schema)
+
+        self.assertIsNone(result.errors)
+        self.assertEqual(result.data['node']['user'], {'email': 'customer@example.com'})
+        self.assertEqual(result.data['node']['appointmentState'], {'name': 'Pending'})
+
+
+class _SMTPServer(smtpd.SMTPServer):
+    # Mail server of the tests, in a thread, keeping the connections opened and the messages received
+    def __init__(self):
+        self.map = {}
+        self.connections = 0
+        self.messages = []
+        super().__init__(('127.0.0.1', 0), None, map=self.map, decode_data=True)
+        self.port = self.socket.getsockname()[1]
+        self.thread = threading.Thread(target=asyncore.loop, kwargs={'timeout': 0.01, 'map': self.map})
+        self.thread.start()
+
+    def handle_accepted(self, conn, addr):
+        self.connections += 1
+        super().handle_accepted(conn, addr)
+
+    def process_message(self, peer, mailfrom, rcpttos, data, **kwargs):
+        self.messages.append(rcpttos)
+
+    def stop(self):
+        for channel in list(self.map.values()):
+            channel.close()
+        self.thread.join()
+
+
+def _free_port():
+    # A port nobody listens on, so the connections to it are refused
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend', EMAIL_HOST='127.0.0.1',
+                   EMAIL_HOST_USER='', EMAIL_HOST_PASSWORD='', EMAIL_USE_TLS=False, EMAIL_USE_SSL=False)
+class OutboxTest(TestCase):
+    def setUp(self):
+        self.server = _SMTPServer()
+        self.addCleanup(self.server.stop)
+
+    def create_emails(self, number):
+        return [OutboxEmail.objects.create(subject='Subject', body='Body', to='customer{}@example.com'.format(i))
+                for i in range(number)]
+
+    def test_one_connection_per_batch(self):
+        self.create_emails(5)
+
+        with self.settings(EMAIL_PORT=self.server.port):
+            self.assertEqual(send_due_emails(batch_size=3), (3, 0))
+            self.assertEqual(send_due_emails(batch_size=3), (2, 0))
+            self.assertEqual(send_due_emails(batch_size=3), (0, 0))
+
+        self.assertEqual(self.server.connections, 2)
+        self.assertEqual(len(self.server.messages), 5)
+        self.assertFalse(OutboxEmail.objects.filter(sent_at=None).exists())
+
+    def test_retry_with_backoff_after_refused_connection(self):
+        email, = self.create_emails(1)
+
+        with self.settings(EMAIL_PORT=_free_port()):
+            before = timezone.now()
+            self.assertEqual(send_due_emails(), (0, 1))
+            email.refresh_from_db()
+            self.assertEqual(email.attempts, 1)
+            self.assertIn('ConnectionRefusedError', email.last_error)
+            self.assertGreaterEqual(email.next_attempt_at, before + settings.OUTBOX_RETRY_DELAY)
+            # Not due until then
+            self.assertEqual(send_due_emails(), (0, 0))
+
+            OutboxEmail.objects.filter(pk=email.pk).update(next_attempt_at=timezone.now())
+            before = timezone.now()
+            self.assertEqual(send_due_emails(), (0, 1))
+            email.refresh_from_db()
+            self.assertEqual(email.attempts, 2)
+            self.assertGreaterEqual(email.next_attempt_at, before + 2 * settings.OUTBOX_RETRY_DELAY)
+
+        OutboxEmail.objects.filter(pk=email.pk).update(next_attempt_at=timezone.now())
+        with self.settings(EMAIL_PORT=self.server.port):
+            self.assertEqual(send_due_emails(), (1, 0))
+
+        email.refresh_from_db()
+        self.assertIsNotNone(email.sent_at)
+        self.assertEqual(self.server.messages, [['customer0@example.com']])
+
+    def test_claimed_emails_are_not_claimed_again(self):
+        self.create_emails(3)
+
+        first_claim = _claim_due_emails(2)
+        second_claim = _claim_due_emails(2)
+
+        self.assertEqual(len(first_claim), 2)
+        self.assertEqual(len(second_claim), 1)
+        self.assertFalse({email.pk for email in first_claim} & {email.pk for email in second_claim})
+        self.assertNotEqual(first_claim[0].claim, second_claim[0].claim)
+        # Another sender finds nothing due until the claims time out
+        with self.settings(EMAIL_PORT=self.server.port):
+            self.assertEqual(send_due_emails(), (0, 0))
+        self.assertEqual(self.server.connections, 0)
+
+
+class CreateAppointmentTest(TestCase):
+    QUERY = '''
+        mutation($appointmentDate: DateTime!, $appointmentStateId: String) {
+            createAppointment(appointmentDate: $appointmentDate, appointmentStateId: $appointmentStateId) {
+                result errors
+            }
+        }
+    '''
+
+    def test_anonymous_user_writes_nothing(self):
+        result = execute(self.QUERY, {'appointmentDate': '2030-01-07T09:00:00+00:00'})
+
+        self.assertEqual(result.data['createAppointment']['errors'], [settings.USER_NOT_LOGGED_IN_ERROR])
+        self.assertFalse(AppointmentState.objects.exists())
+
+    def test_invalid_slot_writes_nothing(self):
+        user = get_user_model().objects.create_user(email='customer@example.com')
+
+        result = execute(self.QUERY, {'appointmentDate': '2000-01-03T09:00:00+00:00'}, user)
+
+        self.assertEqual(result.data['createAppointment']['errors'], [settings.SLOT_NOT_VALID_ERROR])
+        self.assertFalse(AppointmentState.objects.exists())
+
+    def test_only_staff_chooses_the_state(self):
+        user = get_user_model().objects.create_user(email='customer@example.com')
+        state = AppointmentState.objects.create(name='Done')
+
+        result = execute(self.QUERY, {'appointmentDate': '2030-01-07T09:00:00+00:00',
+                                      'appointmentStateId': to_global_id('AppointmentStateNode', state.pk)}, user)
+
+        self.assertEqual(result.data['createAppointment']['errors'], [settings.OPERATION_NOT_ALLOWED_ERROR])
+        self.assertFalse(Appointment.objects.exists())
+
+
+class UserSearchTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(email='customer@example.com', phone_number='+34600111222')
+        get_user_model().objects.create_user(email='other@example.com', phone_number='+34611222333')
+
+    def test_phone_number(self):
+        for text in ('+34600111222', '34600', '600', '600111222', '600 11', '600 111 222'):
+            with self.subTest(text=text):
+                self.assertEqual(search_user_ids(text, 10), [self.user.pk])
+
+    def test_phone_number_change(self):
+        self.user.phone_number = '+34622000000'
+        self.user.save(update_fields=['phone_number'])
+
+        self.assertEqual(search_user_ids('622', 10), [self.user.pk])
+        self.assertEqual(search_user_ids('600', 10), [])
+
+
+class OnAppointmentChangeTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = get_user_model().objects.create_user(email='customer@example.com')
+        cls.other = get_user_model().objects.create_user(email='other@example.com')
+        cls.staff = get_user_model().objects.create_user(email='staff@example.com', is_staff=True)
+
+    def subscribe(self, user, **kwargs):
+        info = types.SimpleNamespace(context=types.SimpleNamespace(user=user))
+        return OnAppointmentChange.subscribe(None, info, **kwargs)
+
+    def assert_error(self, error, user, **kwargs):
+        with self.assertRaisesMessage(Exception, error):
+            self.subscribe(user, **kwargs)
+
+    def test_anonymous_user(self):
+        self.assert_error(settings.USER_NOT_LOGGED_IN_ERROR, AnonymousUser())
+        self.assert_error(settings.USER_NOT_LOGGED_IN_ERROR, None)
+
+    def test_customer_subscribes_to_their_appointments(self):
+        user_id = to_global_id('UserNode', self.customer.pk)
+
+        self.assertEqual(
+            self.subscribe(self.customer, user_id=user_id), ['appointment_user_{}'.format(self.customer.pk)])
+        self.assert_error(settings.OPERATION_NOT_ALLOWED_ERROR, self.customer)
+        self.assert_error(settings.OPERATION_NOT_ALLOWED_ERROR, self.customer,
+                          user_id=to_global_id('UserNode', self.other.pk))
+        self.assert_error(settings.OPERATION_NOT_ALLOWED_ERROR, self.customer, from_=timezone.now(),
+                          to=timezone.now() + datetime.timedelta(days=1))
+
+    def test_staff_subscribes_to_every_appointment(self):
+        self.assertEqual(self.subscribe(self.staff), ['appointment'])
+        self.assertEqual(self.subscribe(self.staff, user_id=to_global_id('UserNode', self.other.pk)),
+                         ['appointment_user_{}'.format(self.other.pk)])
+
+
+class _ConfirmingGraphqlWsConsumer(MyGraphqlWsConsumer):
+    # Tell when the subscription is registered, so the tests broadcast after it
+    confirm_subscriptions = True
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class OnAppointmentChangeConsumerTest(TransactionTestCase):
+    QUERY = '''
+        subscription($from: DateTime, $to: DateTime) {
+            onAppointmentChange(from: $from, to: $to) {
+                action appointmentNode { id user { email } appointmentState { name } }
+            }
+        }
+    '''
+
+    def setUp(self):
+        self.staff = get_user_model().objects.create_user(email='staff@example.com', is_staff=True)
+        self.appointment = Appointment.objects.create(
+            user=self.staff, appointment_state=AppointmentState.objects.create(name='Booked'),
+            appointment_date=timezone.make_aware(datetime.datetime(2030, 1, 7, 9, 0)))
+
+    async def connect(self):
+        communicator = WebsocketCommunicator(_ConfirmingGraphqlWsConsumer, '/subscriptions/', subprotocols=['graphql-ws'])
+        await communicator.connect()
+        await communicator.send_json_to(
+            {'type': 'connection_init', 'payload': {'Authorization': 'JWT {}'.format(get_token(self.staff))}})
+        self.assertEqual((await communicator.receive_json_from())['type'], 'connection_ack')
+
+        return communicator
+
+    async def subscribe(self, communicator, operation_id, variables=None):
+        await communicator.send_json_to(
+            {'type': 'start', 'id': operation_id, 'payload': {'query': self.QUERY, 'variables': variables or {}}})
+        self.assertEqual((await communicator.receive_json_from())['payload'], {'data': None})
+
+    async def broadcast(self, previous_appointment_date=None):
+        await database_sync_to_async(OnAppointmentChange.appointment_change)(
+            AppointmentActionEnum.RESCHEDULE_APPOINTMENT.value, self.appointment, previous_appointment_date)
+
+    def test_subscription_in_several_groups_is_notified_once(self):
+        async def run():
+            communicator = await self.connect()
+            await self.subscribe(communicator, '1', {
+                'from': '2030-01-06T00:00:00+00:00', 'to': '2030-01-09T00:00:00+00:00'})
+
+            # Broadcast to the groups of both days of the subscription
+            await self.broadcast(self.appointment.appointment_date - datetime.timedelta(days=1))
+
+            message = await communicator.receive_json_from()
+            self.assertEqual(message['payload']['data']['onAppointmentChange']['appointmentNode'], {
+                'id': to_global_id('AppointmentNode', self.appointment.pk),
+                'user': {'email': 'staff@example.com'},
+                'appointmentState': {'name': 'Booked'},
+            })
+            self.assertTrue(await communicator.receive_nothing())
+            await communicator.disconnect()
+
+        async_to_sync(run)()
+
+    def test_subscriptions_share_the_payload(self):
+        async def run():
+            communicators = [await self.connect() for _ in range(2)]
+            for communicator in communicators:
+                await self.subscribe(communicator, '1')
+
+            with mock.patch('backend.broadcast.from_plain_payload', wraps=from_plain_payload) as load:
+                await self.broadcast()
+                for communicator in communicators:
+                    message = await communicator.receive_json_from()
+                    self.assertEqual(message['payload']['data']['onAppointmentChange']['action'],
+                                     AppointmentActionEnum.RESCHEDULE_APPOINTMENT.value)
+
+            load.assert_called_once()
+            for communicator in communicators:
+                await communicator.disconnect()
+
+        async_to_sync(run)()
+
+    def test_failing_publish_does_not_stop_the_consumer(self):
+        async def run():
+            communicator = await self.connect()
+            await self.subscribe(communicator, '1')
+
+            with mock.patch.object(OnAppointmentChange, 'load_payload', side_effect=Exception('Publish failed')):
+                await self.broadcast()
+                self.assertEqual((await communicator.receive_json_from())['payload']['errors'][0]['message'],
+                                 'Exception: Publish failed')
+
+            # The consumer still serves new subscriptions
+            await self.subscribe(communicator, '2')
+            await self.broadcast()
+            message = await communicator.receive_json_from()
+            self.assertEqual(message['id'], '2')
+            self.assertIsNotNone(message['payload']['data']['onAppointmentChange'])
+            await communicator.disconnect()
+
+        async_to_sync(run)()
+
+
+class DeleteAppointmentStateTest(TestCase):
+    QUERY = '''
+        mutation($id: String!) { deleteAppointmentState(id: $id) { appointmentStateNode { id } } }
+    '''
+
+    def test_broadcast_after_delete(self):
+        state = AppointmentState.objects.create(name='Done')
+        state_id = to_global_id('AppointmentStateNode', state.pk)
+
+        def broadcast(action, appointment_state_node):
+            # Registered for the commit once the state is deleted, with its id
+            self.assertFalse(AppointmentState.objects.filter(pk=state.pk).exists())
+            self.assertEqual(appointment_state_node.pk, state.pk)
+
+        with mock.patch.object(OnAppointmentState, 'action_appointment_state', side_effect=broadcast) as action:
+            result = execute(self.QUERY, {'id': state_id})
+
+        self.assertIsNone(result.errors)
+        self.assertEqual(result.data['deleteAppointmentState']['appointmentStateNode']['id'], state_id)
+        action.assert_called_once()
+
+
+class ExportAppointmentsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = get_user_model().objects.create_user(email='staff@example.com', is_staff=True)
+        user = get_user_model().objects.create_user(
+            email='customer@example.com', first_name='=HYPERLINK("http://example.com")', last_name='@SUM(A1)',
+            phone_number='+34600111222')
+        state = AppointmentState.objects.create(name='-Pending')
+        Appointment.objects.create(
+            user=user, appointment_state=state, appointment_date=timezone.make_aware(datetime.datetime(2030, 1, 7, 9)))
+
+    def export(self, export_format):
+        response = self.client.get('/export/appointments/', {'format': export_format},
+                                   HTTP_AUTHORIZATION='JWT {}'.format(get_token(self.staff)))
+        return b''.join(response.streaming_content).decode()
+
+    def test_csv_formulas_are_escaped(self):
+        row = next(csv.DictReader(io.StringIO(self.export('csv'))))
+
+        self.assertEqual(row['user_first_name'], '\'=HYPERLINK("http://example.com")')
+        self.assertEqual(row['user_last_name'], "'@SUM(A1)")
+        self.assertEqual(row['user_phone_number'], "'+34600111222")
+        self.assertEqual(row['appointment_state'], "'-Pending")
+
+    def test_ndjson_is_not_escaped(self):
+        row = json.loads(self.export('ndjson'))
+
+        self.assertEqual(row['user_phone_number'], '+34600111222')
+
+
+class ShopTimeZoneTest(TestCase):
+    # Monday. The shop opens at 9:30 in Madrid, 8:30 UTC in winter
+    MONDAY = datetime.date(2030, 1, 7)
+
+    def utc(self, hour, minute=0, day=MONDAY):
+        return datetime.datetime.combine(day, datetime.time(hour, minute, tzinfo=datetime.timezone.utc))
+
+    def test_opening_hours(self):
+        with timezone.override('UTC'):
+            self.assertTrue(is_bookable_slot(self.utc(8, 30)))
+            self.assertTrue(is_bookable_slot(self.utc(19)))
+            self.assertFalse(is_bookable_slot(self.utc(19, 30)))
+
+            slots = get_available_slots(self.utc(0), self.utc(23), settings.APPOINTMENT_DURATION)
+        self.assertEqual(slots[0][0], self.utc(8, 30))
+        self.assertEqual(slots[-1][1], self.utc(19, 30))
+
+    def test_days(self):
+        user = get_user_model().objects.create_user(email='customer@example.com')
+        state = AppointmentState.objects.create(name='Pending')
+        # Tuesday 0:30 in Madrid
+        appointment = Appointment.objects.create(user=user, appointment_state=state, appointment_date=self.utc(23, 30))
+        tuesday = self.MONDAY + datetime.timedelta(days=1)
+
+        with timezone.override('UTC'):
+            self.assertEqual(list(DailyAppointmentStats.objects.values_list('day', 'count')), [(tuesday, 1)])
+            rebuild_stats()
+            self.assertEqual(list(DailyAppointmentStats.objects.values_list('day', 'count')), [(tuesday, 1)])
+
+            filterset = AppointmentFilter({'day': tuesday}, queryset=Appointment.objects.all())
+            self.assertEqual(list(filterset.qs), [appointment])
+
+
+class ChangesSinceTest(TestCase):
+    QUERY = '''
+        query($cursor: String, $first: Int) {
+            changesSince(cursor: $cursor, first: $first) {
+                changes { id deleted node { ... on AppointmentStateNode { name } } }
+                cursor
+                hasMore
+            }
+        }
+    '''
+
+    def setUp(self):
+        self.staff = get_user_model().objects.create_user(email='staff@example.com', is_staff=True)
+        self.states = [AppointmentState.objects.create(name='State {}'.format(i)) for i in range(3)]
+
+    def log(self, state, deleted=False):
+        # The entries are appended on commit, which never comes in these tests
+        return ChangeLogEntry.objects.create(kind='appointment_state', object_id=state.pk, deleted=deleted)
+
+    def changes_since(self, cursor, first=None, user=None):
+        result = execute(self.QUERY, {'cursor': cursor, 'first': first}, user=user or self.staff)
+        if result.errors:
+            raise result.errors[0]
+
+        return result.data['changesSince']
+
+    def state_id(self, state):
+        return to_global_id('AppointmentStateNode', state.pk)
+
+    def test_last_change_of_every_object(self):
+        cursor = self.changes_since(None)['cursor']
+        first_state, second_state, _ = self.states
+        self.log(first_state)
+        self.log(second_state)
+        self.log(first_state)
+        self.log(second_state, deleted=True)
+        second_state_id = self.state_id(second_state)
+        second_state.delete()
+
+        self.assertEqual(self.changes_since(cursor)['changes'], [
+            {'id': self.state_id(first_state), 'deleted': False, 'node': {'name': 'State 0'}},
+            {'id': second_state_id, 'deleted': True, 'node': None},
+        ])
+
+    def test_pages(self):
+        cursor = self.changes_since(None)['cursor']
+        for state in self.states:
+            self.log(state)
+
+        page = self.changes_since(cursor, first=2)
+        self.assertEqual([change['id'] for change in page['changes']],
+                         [self.state_id(state) for state in self.states[:2]])
+        self.assertTrue(page['hasMore'])
+
+        page = self.changes_since(page['cursor'], first=2)
+        self.assertEqual([change['id'] for change in page['changes']], [self.state_id(self.states[2])])
+        self.assertFalse(page['hasMore'])
+
+        self.assertEqual(self.changes_since(page['cursor'])['changes'], [])
+
+    def test_cursor_expires_when_its_changes_are_pruned(self):
+        empty_log_cursor = self.changes_since(None)['cursor']
+        entries = [self.log(state) for state in self.states]
+        ChangeLogEntry.objects.filter(pk__lte=entries[1].pk).update(
+            created=timezone.now() - datetime.timedelta(days=settings.CHANGE_LOG_RETENTION_DAYS + 1))
+
+        self.assertEqual(prune(settings.CHANGE_LOG_RETENTION_DAYS), 2)
+
+        for entry_id in (0, entries[0].pk):
+            with self.assertRaisesMessage(Exception, settings.CHANGES_EXPIRED_ERROR):
+                self.changes_since(encode_cursor(entry_id))
+        with self.assertRaisesMessage(Exception, settings.CHANGES_EXPIRED_ERROR):
+            self.changes_since(empty_log_cursor)
+        self.assertEqual([change['id'] for change in self.changes_since(encode_cursor(entries[1].pk))['changes']],
+                         [self.state_id(self.states[2])])
+
+    def test_cursor_of_the_pruned_log(self):
+        entry = self.log(self.states[0])
+        ChangeLogEntry.objects.update(created=timezone.now() - datetime.timedelta(days=1))
+        prune(0)
+
+        cursor = self.changes_since(None)['cursor']
+        self.assertEqual(cursor, encode_cursor(entry.pk))
+        self.assertEqual(self.changes_since(cursor)['changes'], [])
+
+    def test_staff_only(self):
+        customer = get_user_model().objects.create_user(email='customer@example.com')
+
+        with self.assertRaisesMessage(Exception, settings.USER_NOT_LOGGED_IN_ERROR):
+            self.changes_since(None, user=AnonymousUser())
+        with self.assertRaisesMessage(Exception, settings.OPERATION_NOT_ALLOWED_ERROR):
+            self.changes_since(None, user=customer)
+
+
+def get_stats_rows():
+    # Daily stats with appointments, to compare the counts kept up to date with those of rebuild_stats()
+    return list(DailyAppointmentStats.objects.filter(count__gt=0).order_by('day', 'appointment_state_id')
+                .values_list('day', 'appointment_state_id', 'count'))
+
+
+def assert_stats_rebuilt(test_case):
+    stats_rows = get_stats_rows()
+    rebuild_stats()
+    test_case.assertEqual(stats_rows, get_stats_rows())
+
+
+class DailyAppointmentStatsTest(TestCase):
+    QUERY = '''
+        query($year: Int!, $month: Int!) {
+            appointmentCalendar(year: $year, month: $month) { day count states { appointmentState { name } count } }
+        }
+    '''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(email='customer@example.com')
+        cls.pending = AppointmentState.objects.create(name='Pending')
+        cls.done = AppointmentState.objects.create(name='Done')
+
+    def test_counts_follow_the_appointments(self):
+        # Late in the evening of the shop, the next day in UTC
+        appointment_date = make_shop_aware(datetime.datetime(2030, 1, 7, 23, 30))
+        appointment = Appointment.objects.create(
+            user=self.user, appointment_state=self.pending, appointment_date=appointment_date)
+        self.assertEqual(get_stats_rows(), [(datetime.date(2030, 1, 7), self.pending.pk, 1)])
+        assert_stats_rebuilt(self)
+
+        appointment.appointment_state = self.done
+        appointment.save()
+        self.assertEqual(get_stats_rows(), [(datetime.date(2030, 1, 7), self.done.pk, 1)])
+        assert_stats_rebuilt(self)
+
+        # Loaded without its date, which is read before it is saved
+        appointment = Appointment.objects.only('pk').get(pk=appointment.pk)
+        appointment.appointment_date = appointment_date + datetime.timedelta(days=1)
+        appointment.save()
+        self.assertEqual(get_stats_rows(), [(datetime.date(2030, 1, 8), self.done.pk, 1)])
+        assert_stats_rebuilt(self)
+
+        Appointment.objects.only('pk').get(pk=appointment.pk).delete()
+        self.assertEqual(get_stats_rows(), [])
+        assert_stats_rebuilt(self)
+
+    def test_calendar_reads_the_stats_only(self):
+        for hour, state in ((10, self.pending), (11, self.pending), (12, self.done)):
+            Appointment.objects.create(user=self.user, appointment_state=state,
+                                       appointment_date=make_shop_aware(datetime.datetime(2030, 1, 7, hour)))
+
+        with CaptureQueriesContext(connection) as queries:
+            result = execute(self.QUERY, {'year': 2030, 'month': 1})
+
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('"{}"'.format(Appointment._meta.db_table), queries[0]['sql'])
+        self.assertIsNone(result.errors)
+        days = {day['day']: day for day in result.data['appointmentCalendar']}
+        self.assertEqual(len(days), 31)
+        self.assertEqual(days['2030-01-07']['count'], 3)
+        self.assertEqual(days['2030-01-07']['states'], [
+            {'appointmentState': {'name': 'Pending'}, 'count': 2}, {'appointmentState': {'name': 'Done'}, 'count': 1}])
+        self.assertEqual(days['2030-01-08']['count'], 0)
+
+
+class ImportBookingsTest(TestCase):
+    HEADER = 'user_email,user_first_name,user_last_name,user_phone_number,appointment_date,appointment_state\n'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.state = AppointmentState.objects.create(name='Pending')
+
+    def import_bookings(self, rows):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as csv_file:
+            csv_file.write(self.HEADER + rows)
+        self.addCleanup(os.remove, csv_file.name)
+
+        stdout = io.StringIO()
+        call_command('import_bookings', csv_file.name, stdout=stdout)
+        return stdout.getvalue()
+
+    def test_valid_file(self):
+        output = self.import_bookings(
+            'ana@example.com,Ana,García,600111222,2030-01-07T10:00:00,pending\n'
+            'ana@example.com,Ana,García,600111222,2030-01-08T10:00:00,Pending\n'
+            'luis@example.com,Luis,Pérez,,,\n')
+
+        self.assertIn('2 customers and 2 appointments created, 0 rows rejected', output)
+        ana = get_user_model().objects.get(email='ana@example.com')
+        self.assertEqual(ana.phone_number, '+34600111222')
+        self.assertEqual(list(Appointment.objects.filter(user=ana).values_list('appointment_date', flat=True)), [
+            make_shop_aware(datetime.datetime(2030, 1, 7, 10)), make_shop_aware(datetime.datetime(2030, 1, 8, 10))])
+        self.assertEqual(search_user_ids('600111', 10), [ana.pk])
+        self.assertEqual(search_user_ids('luis', 10), [get_user_model().objects.get(email='luis@example.com').pk])
+        self.assertEqual(get_stats_rows(), [
+            (datetime.date(2030, 1, 7), self.state.pk, 1), (datetime.date(2030, 1, 8), self.state.pk, 1)])
+        assert_stats_rebuilt(self)
+
+    def test_rejected_rows(self):
+        customer = get_user_model().objects.create_user(email='customer@example.com')
+        Appointment.objects.create(user=customer, appointment_state=self.state,
+                                   appointment_date=make_shop_aware(datetime.datetime(2030, 1, 7, 10)))
+
+        output = self.import_bookings(
+            'ana@example.com,Ana,García,600111222,2030-01-07T10:00:00,Pending\n'
+            'luis@example.com,Luis,Pérez,123,2030-01-07T11:00:00,Pending\n'
+            'eva@example.com,Eva,Ruiz,,2030-01-07T12:00:00,Pending\n')
+
+        self.assertIn('Line 2: {}'.format(settings.SLOT_NOT_AVAILABLE_ERROR), output)
+        self.assertIn('Line 3: {}'.format(settings.PHONE_NUMBER_NOT_VALID_ERROR), output)
+        self.assertIn('1 customers and 1 appointments created, 2 rows rejected', output)
+        self.assertEqual(set(get_user_model().objects.values_list('email', flat=True)),
+                         {'customer@example.com', 'eva@example.com'})
+        assert_stats_rebuilt(self)
+
+    def test_import_again(self):
+        rows = 'ana@example.com,Ana,García,600111222,2030-01-07T10:00:00,Pending\n'
+        self.import_bookings(rows)
+        stats_rows = get_stats_rows()
+
+        output = self.import_bookings(rows)
+
+        self.assertIn('0 customers and 0 appointments created, 1 rows rejected', output)
+        self.assertEqual(get_user_model().objects.count(), 1)
+        self.assertEqual(Appointment.objects.count(), 1)
+        self.assertEqual(get_stats_rows(), stats_rows)
+        assert_stats_rebuilt(self)
@@ -1,3 +1,120 @@
-from django.shortcuts import render
+"""Export the appointments as CSV or NDJSON.
 
-# Create your views here.
+The rows are streamed while they are read from the database, `settings.EXPORT_CHUNK_SIZE`
+at a time (through a server side cursor on PostgreSQL), so the memory used does not grow
+with the number of appointments exported.
+"""
+from .filters import AppointmentFilter
+from .models import Appointment
+from backend import settings
+from backend.authentication import authenticate_request
+from django.http import HttpResponse, HttpResponseBadRequest, StreamingHttpResponse
+from django.views.decorators.http import require_GET
+from graphql_jwt import middleware
+
+import csv
+import json
+
+# Exported columns: {column name: field lookup}. Users and states are joined in the same query
+EXPORT_COLUMNS = {
+    'id': 'id',
+    'appointment_date': 'appointment_date',
+    'appointment_state_id': 'appointment_state_id',
+    'appointment_state': 'appointment_state__name',
+    'user_id': 'user_id',
+    'user_email': 'user__email',
+    'user_first_name': 'user__first_name',
+    'user_last_name': 'user__last_name',
+    'user_phone_number': 'user__phone_number',
+    'created': 'created',
+    'edited': 'edited',
+}
+
+# Spreadsheets read the cells starting with these characters as formulas, so in the CSV they are
+# prefixed with FORMULA_ESCAPE (e.g. the phone numbers, +34600111222 is '+34600111222)
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+FORMULA_ESCAPE = "'"
+
+EXPORT_CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+@require_GET
+def export_appointments(request):
+    """Stream the appointments in the `format` (csv or ndjson) of the query string.
+
+    Staff users export every appointment, the other users their own ones. The appointments
+    are filtered with the filters of relay_appointments (e.g. `appointment_date__gte` and
+    `appointment_date__lt` as `YYYY-MM-DD HH:MM`, `day`, `appointment_state`).
+    """
+    user = request.user
+    if middleware._authenticate(request):
+        try:
+            user = authenticate_request(request) or user
+        except Exception as e:
+            return HttpResponse(str(e), status=401, content_type='text/plain')
+    if user.is_anonymous:
+        return HttpResponse(settings.USER_NOT_LOGGED_IN_ERROR, status=401, content_type='text/plain')
+
+    export_format = request.GET.get('format', 'csv')
+    if export_format not in EXPORT_CONTENT_TYPES:
+        return HttpResponseBadRequest('Format must be csv or ndjson.')
+
+    appointments = Appointment.objects.all() if user.is_staff else Appointment.objects.filter(user=user)
+    filterset = AppointmentFilter(request.GET, queryset=appointments)
+    if not filterset.is_valid():
+        return HttpResponseBadRequest(json.dumps(filterset.errors), content_type='application/json')
+
+    # Ordered by the unique index on appointment_date, so the rows are read in its order
+    rows = filterset.qs.order_by('appointment_date').values_list(*EXPORT_COLUMNS.values())
+    rows = rows.iterator(chunk_size=settings.EXPORT_CHUNK_SIZE)
+
+    lines = _csv_lines(rows) if export_format == 'csv' else _ndjson_lines(rows)
+    response = StreamingHttpResponse(_join_chunks(lines), content_type=EXPORT_CONTENT_TYPES[export_format])
+    response['Content-Disposition'] = 'attachment; filename="appointments.{}"'.format(export_format)
+
+    return response
+
+
+class _Echo:
+    # File-like object giving back what the csv writer writes, instead of buffering it
+    def write(self, value):
+        return value
+
+
+def _csv_lines(rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(EXPORT_COLUMNS)
+    for row in rows:
+        yield writer.writerow([_escape_formula(value) for value in _format_row(row)])
+
+
+def _ndjson_lines(rows):
+    for row in rows:
+        yield json.dumps(dict(zip(EXPORT_COLUMNS, _format_row(row)))) + '\n'
+
+
+def _format_row(row):
+    # Dates in ISO 8601, the same in both formats
+    return [value.isoformat() if hasattr(value, 'isoformat') else value for value in row]
+
+
+def _escape_formula(value):
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return FORMULA_ESCAPE + value
+
+    return value
+
+
+def _join_chunks(lines):
+    # One write per chunk of rows instead of one per row
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) >= settings.EXPORT_CHUNK_SIZE:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
@@ -0,0 +1,15 @@
+"""Declare the filtersets of the relay connections of users app."""
+from django.contrib.auth import get_user_model
+
+import django_filters
+
+
+class UserFilter(django_filters.FilterSet):
+    class Meta:
+        model = get_user_model()
+        fields = {
+            'is_active': ['exact'],
+            'is_vip': ['exact'],
+            'is_staff': ['exact'],
+            'date_joined': ['gte', 'lt'],
+        }
@@ -1,21 +1,52 @@
 from backend import settings
-from django.core.mail import EmailMessage
+from backend.optimizer import PAGINATION_ARGS, get_prefetched, optimize_queryset
+from dates.fields import BatchedFilterConnectionField, KeysetFilterConnectionField
+from dates.outbox import enqueue_email
+from dates.phones import normalize_phone_number
+from dates.search import search_user_ids
+from dates.subscriptions import AppointmentNode
 from django.contrib.auth import get_user_model
 from django.template.loader import render_to_string
+from graphene import relay
 from graphene_django import DjangoObjectType
 from graphql_jwt.utils import jwt_payload, jwt_encode, jwt_decode
 from jwt.exceptions import ExpiredSignatureError
+from users.filters import UserFilter
 
 import datetime
 import graphene
-import phonenumbers
 import re
 import sys
 
 
 class UserType(DjangoObjectType):
+    appointment_set = BatchedFilterConnectionField(AppointmentNode, required=True)
+
+    class Meta:
+        model = get_user_model()
+        exclude_fields = ('password', 'normalized_email', 'last_token', 'is_used_last_token')
+
+    def resolve_appointment_set(self, info, **kwargs):
+        prefetched = get_prefetched(self, 'appointment_set')
+        if prefetched is not None and all(arg in PAGINATION_ARGS for arg in kwargs):
+            return prefetched
+
+        # Filtered pages are resolved by the filterset of the connection field
+        return self.appointment_set.all()
+
+
+class UserNode(DjangoObjectType):
     class Meta:
         model = get_user_model()
+        exclude_fields = ('password', 'normalized_email', 'last_token', 'is_used_last_token')
+        filterset_class = UserFilter
+        interfaces = (relay.Node,)
+        # The users of other types (e.g. Appointment.user) stay UserType
+        skip_registry = True
+
+    @classmethod
+    def get_queryset(cls, queryset, info):
+        return optimize_queryset(queryset, info)
 
 
 class AccountActionEnum(graphene.Enum):
@@ -26,7 +57,23 @@ class AccountActionEnum(graphene.Enum):
 
 class Query(graphene.ObjectType):
     me = graphene.Field(UserType)
-    users = graphene.List(UserType)
+    # Staff only. First users joined
+    users = graphene.List(
+        UserType,
+        first=graphene.Int(description="Maximum number of users"),
+        deprecation_reason='Use relayUsers')
+    # Staff only. Pages ordered by signup date
+    relay_users = KeysetFilterConnectionField(UserNode, keyset=('date_joined', 'id'))
+    # Staff only
+    user_by_phone = graphene.Field(
+        UserNode,
+        phone_number=graphene.String(required=True),
+        description="Last user joined with the phone number, in any format")
+    # Staff only
+    search_users = graphene.List(
+        UserNode,
+        text=graphene.String(required=True),
+        first=graphene.Int(description="Maximum number of users, best matches first"))
 
     def resolve_me(self, info):
         user = info.context.user
@@ -35,9 +82,43 @@ class Query(graphene.ObjectType):
 
         return user
 
-    def resolve_users(self, info):
+    def resolve_users(self, info, first=None):
+        _check_staff(info.context.user)
+
+        limit = min(first or settings.USERS_MAX_FIRST, settings.USERS_MAX_FIRST)
+        return optimize_queryset(get_user_model().objects.order_by('date_joined', 'id'), info)[:limit]
+
+    def resolve_relay_users(self, info, **kwargs):
+        _check_staff(info.context.user)
+
         return get_user_model().objects.all()
 
+    def resolve_user_by_phone(self, info, phone_number):
+        _check_staff(info.context.user)
+
+        phone_number = normalize_phone_number(phone_number)
+        if phone_number is None:
+            raise Exception(settings.PHONE_NUMBER_NOT_VALID_ERROR)
+
+        return optimize_queryset(get_user_model().objects.filter(phone_number=phone_number), info) \
+            .order_by('-date_joined').first()
+
+    def resolve_search_users(self, info, text, first=None):
+        _check_staff(info.context.user)
+
+        limit = min(first or settings.SEARCH_USERS_MAX_FIRST, settings.SEARCH_USERS_MAX_FIRST)
+        ids = search_user_ids(text, limit)
+        users = {user.pk: user for user in optimize_queryset(get_user_model().objects.filter(pk__in=ids), info)}
+
+        return [users[pk] for pk in ids if pk in users]
+
+
+def _check_staff(user):
+    if user.is_anonymous:
+        raise Exception(settings.USER_NOT_LOGGED_IN_ERROR)
+    elif not user.is_staff:
+        raise Exception(settings.OPERATION_NOT_ALLOWED_ERROR)
+
 
 class SendVerificationEmail(graphene.Mutation):
     email = graphene.String()
@@ -70,13 +151,13 @@ class SendVerificationEmail(graphene.Mutation):
             context_user = info.context.user
             if context_user.is_anonymous:
                 errors_list.append(settings.USER_NOT_LOGGED_IN_ERROR)
-            elif get_user_model().objects.filter(email__iexact=email).exists():
+            elif get_user_model().objects.filter_by_email(email).exists():
                 errors_list.append(settings.EMAIL_ALREADY_REGISTERED_ERROR)
             else:
                 user = context_user
         else:
             try:
-                user = get_user_model().objects.get(email__iexact=email)
+                user = get_user_model().objects.filter_by_email(email).get()
             except get_user_model().DoesNotExist:
                 errors_list.append(settings.ACCOUNT_DOES_NOT_EXIST_ERROR)
 
@@ -122,8 +203,8 @@ class SendVerificationEmail(graphene.Mutation):
                     "site_dir": site_dir,
                     "site_name": settings.SITE_NAME
                 })
-                email_to_send = EmailMessage(subject, message, to=[email])
-                email_to_send.send()
+                # Sent in the background, the request does not wait for the mail server
+                enqueue_email(subject, message, email)
 
                 # It save the token information to allow a only use
                 user.is_used_last_token = False
@@ -168,7 +249,7 @@ class CreateAccount(graphene.Mutation):
             errors_list.append(settings.EMAIL_REQUIRED_ERROR)
         elif email_pattern.match(email) is None:
             errors_list.append(settings.EMAIL_REGEX_ERROR)
-        elif get_user_model().objects.filter(email__iexact=email).exists():
+        elif get_user_model().objects.filter_by_email(email).exists():
             errors_list.append(settings.EMAIL_ALREADY_REGISTERED_ERROR)
 
         if password1 is None or len(password1.strip()) == 0:
@@ -192,20 +273,15 @@ class CreateAccount(graphene.Mutation):
 
         if phone_number is None or len(phone_number.strip()) == 0:
             errors_list.append(settings.PHONE_NUMBER_REQUIRED_ERROR)
-        else:
-            try:
-                parsed_phone_number = phonenumbers.parse(phone_number)
-                if not phonenumbers.is_valid_number(parsed_phone_number):
-                    errors_list.append(settings.PHONE_NUMBER_NOT_VALID_ERROR)
-            except phonenumbers.NumberParseException:
-                errors_list.append(settings.PHONE_NUMBER_NOT_VALID_ERROR)
+        elif normalize_phone_number(phone_number) is None:
+            errors_list.append(settings.PHONE_NUMBER_NOT_VALID_ERROR)
 
         if len(errors_list) == 0:
             user = get_user_model()(
                 email=email.lower(),
                 first_name=name,
                 last_name=surnames,
-                phone_number=phone_number
+                phone_number=normalize_phone_number(phone_number)
             )
             user.set_password(input.password1)
             user.is_active = False
@@ -257,13 +333,8 @@ class EditAccount(graphene.Mutation):
 
         if phone_number is None or len(phone_number.strip()) == 0:
             errors_list.append(settings.PHONE_NUMBER_REQUIRED_ERROR)
-        else:
-            try:
-                parsed_phone_number = phonenumbers.parse(phone_number)
-                if not phonenumbers.is_valid_number(parsed_phone_number):
-                    errors_list.append(settings.PHONE_NUMBER_NOT_VALID_ERROR)
-            except phonenumbers.NumberParseException:
-                errors_list.append(settings.PHONE_NUMBER_NOT_VALID_ERROR)
+        elif normalize_phone_number(phone_number) is None:
+            errors_list.append(settings.PHONE_NUMBER_NOT_VALID_ERROR)
 
         edited_user = None  # account to edit
         logged_in_user = info.context.user
@@ -277,7 +348,7 @@ class EditAccount(graphene.Mutation):
         elif logged_in_user.is_staff:
             # when a staff user is editing another account
             try:
-                edited_user = get_user_model().objects.get(email=email.lower())
+                edited_user = get_user_model().objects.filter_by_email(email).get()
             except get_user_model().DoesNotExist:
                 errors_list.append(settings.ACCOUNT_DOES_NOT_EXIST_ERROR)
         else:
@@ -286,7 +357,7 @@ class EditAccount(graphene.Mutation):
         if len(errors_list) == 0:
             edited_user.first_name = input.name
             edited_user.last_name = input.surnames
-            edited_user.phone_number = input.phone_number
+            edited_user.phone_number = normalize_phone_number(input.phone_number)
             if logged_in_user.is_staff:
                 # This changes can only be done by a staff account
                 edited_user.is_vip = input.is_vip
@@ -326,7 +397,7 @@ class ActivateAccount(graphene.Mutation):
 
                 user = None
                 try:
-                    user = get_user_model().objects.get(email=email.lower())
+                    user = get_user_model().objects.filter_by_email(email).get()
                 except get_user_model().DoesNotExist:
                     errors_list.append(settings.ACCOUNT_DOES_NOT_EXIST_ERROR)
 
@@ -410,12 +481,12 @@ class UpdateEmail(graphene.Mutation):
                     raise Exception()
                 elif email_pattern.match(new_email) is None:
                     errors_list.append(settings.EMAIL_REGEX_ERROR)
-                elif get_user_model().objects.filter(email__iexact=new_email).exists():
+                elif get_user_model().objects.filter_by_email(new_email).exists():
                     errors_list.append(settings.EMAIL_ALREADY_REGISTERED_ERROR)
                 else:
                     user = None
                     try:
-                        user = get_user_model().objects.get(email=old_email)
+                        user = get_user_model().objects.filter_by_email(old_email).get()
                     except get_user_model().DoesNotExist:
                         errors_list.append(settings.ACCOUNT_DOES_NOT_EXIST_ERROR)
 
@@ -525,7 +596,7 @@ class ResetPassword(graphene.Mutation):
 
                 user = None
                 try:
-                    user = get_user_model().objects.get(email=email)
+                    user = get_user_model().objects.filter_by_email(email).get()
                 except get_user_model().DoesNotExist:
                     errors_list.append(settings.ACCOUNT_DOES_NOT_EXIST_ERROR)
 
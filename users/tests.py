@@ -1,3 +1,37 @@
-from django.test import TestCase
+from backend import settings
+from backend.schema import graphql_schema
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.test import RequestFactory, TestCase
+from unittest import mock
 
-# Create your tests here.
+
+def execute(query, user=None):
+    request = RequestFactory().post('/graphql/')
+    request.user = user or AnonymousUser()
+
+    return graphql_schema.execute(query, context_value=request)
+
+
+class UsersTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = get_user_model().objects.create_user(email='staff@example.com', is_staff=True)
+        cls.customer = get_user_model().objects.create_user(email='customer@example.com')
+        get_user_model().objects.create_user(email='other@example.com')
+
+    def test_staff_only(self):
+        self.assertEqual(execute('{ users { id } }').errors[0].message, settings.USER_NOT_LOGGED_IN_ERROR)
+        self.assertEqual(
+            execute('{ users { id } }', self.customer).errors[0].message, settings.OPERATION_NOT_ALLOWED_ERROR)
+
+    def test_capped(self):
+        with mock.patch.object(settings, 'USERS_MAX_FIRST', 2):
+            self.assertEqual(len(execute('{ users { id } }', self.staff).data['users']), 2)
+            self.assertEqual(len(execute('{ users(first: 5) { id } }', self.staff).data['users']), 2)
+            self.assertEqual(len(execute('{ users(first: 1) { id } }', self.staff).data['users']), 1)
+
+    def test_secrets_are_not_exposed(self):
+        for field in ('password', 'lastToken', 'isUsedLastToken'):
+            with self.subTest(field=field):
+                self.assertIsNotNone(execute('{ me { %s } }' % field, self.customer).errors)